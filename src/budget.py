@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+
+# Measurements used to fit a search into a time budget (search.py
+# --deadline-ms). For each feature we keep a moving average of its cost (wall
+# time in ms) and of its contribution: the absolute value of its weight times
+# the largest score it gives a document, i.e. how much it can move a
+# document's final score.
+
+# Weight of the latest measurement in the moving averages.
+SMOOTHING = 0.3
+
+# A feature left out of this many searches in a row is run again, as if it
+# had never been measured, so that its measurements do not go stale.
+REMEASURE_AFTER = 50
+
+COST_MS = 'cost_ms'
+CONTRIBUTION = 'contribution'
+RUNS = 'runs'
+# Number of searches that left the feature out since it was last measured.
+DROPPED = 'dropped'
+
+
+class FeatureStats(object):
+    def __init__(self, path=None):
+        """
+        path: If given (and it exists), measurements are loaded from this
+        JSON file, and save() writes them back to it.
+        """
+        self.path = path
+        self.stats = {}
+        # Searches running at the same time (in server.py) record their
+        # measurements into the same stats.
+        self.__lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.stats = json.load(f)
+
+    def record(self, name, cost_ms, contribution):
+        with self.__lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                self.stats[name] = {COST_MS: cost_ms,
+                                    CONTRIBUTION: contribution, RUNS: 1}
+                return
+            stats[COST_MS] += SMOOTHING * (cost_ms - stats[COST_MS])
+            stats[CONTRIBUTION] += SMOOTHING * (
+                contribution - stats[CONTRIBUTION])
+            stats[RUNS] += 1
+            stats[DROPPED] = 0
+
+    def drop(self, name):
+        """Counts a search that left the feature out."""
+        with self.__lock:
+            stats = self.stats.get(name)
+            if stats is not None:
+                stats[DROPPED] = stats.get(DROPPED, 0) + 1
+
+    def cost(self, name):
+        """Returns the expected cost of a feature in ms, or None if it has
+        never been measured."""
+        stats = self.stats.get(name)
+        return stats[COST_MS] if stats else None
+
+    def contribution(self, name):
+        stats = self.stats.get(name)
+        return stats[CONTRIBUTION] if stats else None
+
+    def needs_measuring(self, name):
+        """Returns True if a feature has never been measured, or has been
+        left out of REMEASURE_AFTER searches since it was last measured."""
+        stats = self.stats.get(name)
+        return stats is None or stats.get(DROPPED, 0) >= REMEASURE_AFTER
+
+    def save(self):
+        if not self.path:
+            return
+        with self.__lock, open(self.path + '.tmp', 'w') as f:
+            json.dump(self.stats, f, indent=2, sort_keys=True)
+        os.rename(self.path + '.tmp', self.path)
+
+
+def plan(names, stats, budget_ms):
+    """
+    Chooses the features to run within budget_ms.
+
+    Features are taken in order of contribution per ms of cost, as long as
+    their total expected cost fits the budget. Features that need measuring
+    (see FeatureStats.needs_measuring) are always chosen.
+
+    Returns the set of chosen names.
+    """
+    chosen = set(name for name in names if stats.needs_measuring(name))
+    measured = [name for name in names if name not in chosen]
+    measured.sort(key=lambda name: stats.contribution(name) /
+                  max(stats.cost(name), 0.01), reverse=True)
+
+    spent = 0.0
+    for name in measured:
+        if spent + stats.cost(name) <= budget_ms:
+            chosen.add(name)
+            spent += stats.cost(name)
+    return chosen
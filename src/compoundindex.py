@@ -1,61 +1,243 @@
+import array
+import bisect
+import hashlib
 import indexfields
+import json
+import math
+import numpy
+import os
+import postings
+import segment
+import snapshot
 
-from helpers import cache
+
+def manifest_path(dictionary_path):
+    """
+    Returns the path of the segment manifest belonging to a dictionary file.
+    """
+    return dictionary_path + '.segments'
+
+
+def read_manifest(dictionary_path):
+    """
+    Reads the segment manifest belonging to a dictionary file.
+
+    The manifest lists the delta segments written by `index.py --update` (as
+    file names relative to the dictionary's directory), and the guids of
+    documents that have since been deleted or replaced. Once the index has
+    been merged (`index.py --merge`), it also names the files of the base
+    segment, which are otherwise the dictionary and postings files
+    themselves, and the number of merges (the generation of those files.) If
+    there is no manifest, an empty one is returned.
+    """
+    path = manifest_path(dictionary_path)
+    if not os.path.exists(path):
+        return {
+            indexfields.SEGMENTS: [],
+            indexfields.DELETED: [],
+        }
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def segment_paths(dictionary_path, postings_path, manifest=None):
+    """
+    Returns the (dictionary, postings) paths of an index's base segment and
+    of the delta segments listed in its manifest (read if not given.)
+    """
+    if manifest is None:
+        manifest = read_manifest(dictionary_path)
+    directory = os.path.dirname(dictionary_path)
+    base = manifest.get(indexfields.BASE)
+    if base:
+        paths = [(os.path.join(directory, base[indexfields.SEGMENT_DICT]),
+                  os.path.join(directory, base[indexfields.SEGMENT_POSTINGS]))]
+    else:
+        paths = [(dictionary_path, postings_path)]
+    for entry in manifest[indexfields.SEGMENTS]:
+        paths.append((
+            os.path.join(directory, entry[indexfields.SEGMENT_DICT]),
+            os.path.join(directory, entry[indexfields.SEGMENT_POSTINGS])))
+    return paths
+
+
+def fingerprint(dictionary_path, postings_path):
+    """
+    Returns a string that changes whenever the index is rebuilt, updated or
+    merged: a hash of the size and modification time of its manifest and of
+    the files of every segment.
+    """
+    files = [manifest_path(dictionary_path)]
+    for segment_dictionary, segment_postings in segment_paths(
+            dictionary_path, postings_path):
+        files.extend([segment_dictionary, segment_postings])
+
+    digest = hashlib.sha1()
+    for path in files:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update('{} {} {!r}\n'.format(
+                os.path.abspath(path), stat.st_size, stat.st_mtime))
+    return digest.hexdigest()
+
+
+def load(dictionary_path, postings_path, use_snapshots=False):
+    """
+    Loads the index at dictionary_path and postings_path, together with any
+    delta segments listed in its manifest.
+
+    If use_snapshots is True, each segment is loaded from its binary snapshot
+    (see snapshot.py) if it has an up to date one, instead of from JSON.
+    """
+    manifest = read_manifest(dictionary_path)
+    compound_index = CompoundIndex()
+    for segment_dictionary, segment_postings in segment_paths(
+            dictionary_path, postings_path, manifest):
+        if use_snapshots and snapshot.is_fresh(segment_dictionary):
+            compound_index.append_segment(snapshot.SnapshotSegment(
+                snapshot.snapshot_path(segment_dictionary), segment_postings))
+        else:
+            with open(segment_dictionary, 'r') as f:
+                compound_index.add_segment(json.load(f), segment_postings)
+    compound_index.delete_guids(manifest[indexfields.DELETED])
+
+    return compound_index
 
 
 class CompoundIndex(object):
     """
     Presents an abstract interface to access fields stored in the index JSON
-    object.
+    object, and the postings lists stored in the postings file.
 
-    This file should be used as a format reference for the dictionary file
-    generated by index.py.
-    """
-    def __init__(self, json_obj):
-        self.__m_file = json_obj
-        self.__gd_map = self.__m_file[indexfields.GUID_DOC_MAP]
-        self.__dg_map = self.__m_file[indexfields.DOC_GUID_MAP]
-        self.__indices = self.__m_file[indexfields.ZONES]
-        self.__fields = self.__m_file[indexfields.FIELDS]
+    This file should be used as a format reference for the dictionary and
+    postings files generated by index.py.
 
-        self.__remap()
+    Only the dictionary is held in memory. Postings lists are decoded from the
+    memory-mapped postings file on demand, using the offset and length
+    recorded for each term in the dictionary. See postings.py for the postings
+    file format.
+
+    An index may consist of several segments: the index built by a full run of
+    index.py, followed by delta segments added by `index.py --update`. Guids
+    of later segments are always greater than those of earlier ones. Deleted
+    (or replaced) documents are excluded from every method below, and document
+    frequencies are corrected accordingly.
+    """
+    def __init__(self, json_obj=None, postings_path=None):
+        self.__segments = []
+        self.__first_guids = []
+        self.__deleted = set()
+        self.__deleted_array = numpy.array([], postings.GUID_DTYPE)
+        self.__index_names = set()
+        self.__clear_caches()
+        if json_obj is not None:
+            self.add_segment(json_obj, postings_path)
 
     def __str__(self):
-        return 'CompoundIndex (Loaded Dictionary: {})'.format(self.____path)
-
-    def __remap(self):
-        """Remaps keys to ints (JSON keys have to be strings.)"""
-        # Keys in JSON have to be strings, and our GUIDs are implicitly cast
-        # to strings on serialisation. We re-parse them into integer types to
-        # recover ease of comparison.
-        # Note:
-        # No error checking is performed. This method will fail fatally if the
-        # JSON file was modified out of band to contain invalid integers.
-        self.__m_file[indexfields.GUID_DOC_MAP] = {
-            int(key): self.__gd_map[key] for key in self.__gd_map
-        }
+        return 'CompoundIndex (Loaded Postings: {})'.format(
+            ', '.join(s.postings_path for s in self.__segments))
 
-        self.__fields = {
-            int(key): self.__fields[key] for key in self.__fields
-        }
+    def close(self):
+        """Closes the underlying postings files."""
+        for index_segment in self.__segments:
+            index_segment.close()
+
+    def add_segment(self, json_obj, postings_path):
+        """
+        Adds a delta segment (loaded from JSON) on top of the existing
+        segments.
+        """
+        self.append_segment(segment.IndexSegment(json_obj, postings_path))
+
+    def append_segment(self, index_segment):
+        """
+        Adds a segment.SegmentBase on top of the existing segments.
+        """
+        self.__segments.append(index_segment)
+        self.__first_guids.append(index_segment.first_guid)
+        self.__index_names.update(index_segment.index_names())
+        self.__clear_caches()
+
+    def delete_guids(self, guids):
+        """
+        Marks documents as deleted. They will no longer be returned by any
+        method of this index.
+        """
+        self.__deleted.update(guids)
+        self.__deleted_array = numpy.array(sorted(self.__deleted),
+                                           postings.GUID_DTYPE)
+        self.__clear_caches()
+
+    def __clear_caches(self):
+        """Drops what was computed from the documents of this index (when
+        segments or deletions change them.)"""
+        self.__live_document_counts = {}
+        self.__field_values = {}
+        self.__field_dicts = {}
+        self.__document_counts = {}
+
+    def segment_count(self):
+        """
+        Returns the number of segments in this index.
+        """
+        return len(self.__segments)
+
+    def max_guid(self):
+        """
+        Returns the largest guid ever assigned in this index (including
+        deleted documents), or -1 if the index is empty.
+        """
+        return max([-1] + [s.first_guid + s.guid_count() - 1
+                           for s in self.__segments])
+
+    def __is_simple(self):
+        """
+        True if this index has a single segment and no deletions, in which
+        case the statistics stored in the dictionary can be used directly.
+        """
+        return len(self.__segments) == 1 and not self.__deleted
+
+    def __check_index(self, index_name):
+        if index_name not in self.__index_names:
+            raise KeyError('Index: {} not recognized'.format(index_name))
 
     def indices(self):
         """
         Returns a list of indexed fields in this compound index.
         """
-        return sorted(self.__indices.keys())
+        return sorted(self.__index_names)
 
     def document_name_for_guid(self, guid):
         """
         Returns the document name on the disk for a given guid.
         """
-        return self.__gd_map.get(guid, None)
+        idx = bisect.bisect_right(self.__first_guids, guid) - 1
+        if idx < 0:
+            return None
+        return self.__segments[idx].document_name(guid)
 
     def guid_for_document_name(self, name):
         """
         Returns the guid for a given document name.
         """
-        return self.__dg_map.get(name, None)
+        # Later segments hold the most recent version of a document.
+        for index_segment in reversed(self.__segments):
+            guid = index_segment.guid_for_document_name(name)
+            if guid is not None and guid not in self.__deleted:
+                return guid
+        return None
+
+    def document_count(self, index_names):
+        """
+        Returns the number of documents in any of the given indices.
+        """
+        key = tuple(sorted(index_names))
+        if key not in self.__document_counts:
+            documents = set()
+            for index_name in index_names:
+                documents.update(self.documents_in_index(index_name))
+            self.__document_counts[key] = len(documents)
+        return self.__document_counts[key]
 
     def documents_in_index(self, index_name):
         """
@@ -63,32 +245,66 @@ class CompoundIndex(object):
 
         If the specified index does not exist, returns an empty list.
         """
-        if index_name not in self.__indices:
-            return []
-        else:
-            return self.__indices[index_name][indexfields.INDEX_DOCS]
+        if self.__is_simple():
+            return self.__segments[0].documents_in_index(index_name)
+
+        docs = []
+        for index_segment in self.__segments:
+            docs.extend(
+                guid for guid in index_segment.documents_in_index(index_name)
+                if guid not in self.__deleted)
+        return docs
+
+    def __live_values(self, field):
+        """
+        Yields (guid, value)-tuples of a field for all documents that are not
+        deleted. Only the column of the given field is read.
+        """
+        for index_segment in self.__segments:
+            column = index_segment.column(field)
+            if column is None:
+                continue
+            for guid, val in column.items():
+                if guid not in self.__deleted:
+                    yield guid, val
+
+    def field_value(self, guid, field):
+        """
+        Returns the value of a field for a single guid, or None if the
+        document does not have one.
+        """
+        index_segment = self.__segment_for_guid(guid)
+        if index_segment is None:
+            return None
+        column = index_segment.column(field)
+        return column.get(guid) if column else None
+
+    def __segment_for_guid(self, guid):
+        """
+        Returns the segment holding a (live) guid, or None.
+        """
+        if guid in self.__deleted:
+            return None
+        idx = bisect.bisect_right(self.__first_guids, guid) - 1
+        if idx < 0:
+            return None
+        return self.__segments[idx]
 
-    @cache.naive_class_method_cache
     def value_for_field(self, field):
         """
         Returns a list of (guid, fieid_value) for the given field.
         """
-        retval = []
-        for guid, fields in self.__fields.iteritems():
-            if field in fields:
-                retval.append((guid, fields.get(field)))
-        return retval
+        if field not in self.__field_values:
+            self.__field_values[field] = list(self.__live_values(field))
+        return self.__field_values[field]
 
-    @cache.naive_class_method_cache
     def dict_for_field(self, field):
         """
         Returns a dict of <doc_id>: value for the given field.
         """
-        retval = {}
-        for guid, fields in self.__fields.iteritems():
-            if field in fields:
-                retval[guid] = fields.get(field)
-        return retval
+        if field not in self.__field_dicts:
+            self.__field_dicts[field] = dict(self.__live_values(field))
+        return self.__field_dicts[field]
 
     def terms_in_index(self, index_name):
         """
@@ -96,11 +312,10 @@ class CompoundIndex(object):
 
         If the specified index does not exist, returns an empty list.
         """
-        if index_name not in self.__indices:
-            return []
-        else:
-            index = self.__indices[index_name]
-            return sorted(index[indexfields.INDEX_DICT].keys())
+        terms = set()
+        for index_segment in self.__segments:
+            terms.update(index_segment.terms(index_name))
+        return sorted(terms)
 
     def term_count_for_index(self, index_name):
         """
@@ -108,11 +323,9 @@ class CompoundIndex(object):
 
         If the specified index does not exist, returns 0.
         """
-        if index_name not in self.__indices:
-            return 0
-        else:
-            index = self.__indices[index_name]
-            return len(index[indexfields.INDEX_DICT].keys())
+        if self.__is_simple():
+            return self.__segments[0].term_count(index_name)
+        return len(self.terms_in_index(index_name))
 
     def document_frequency(self, index_name, term):
         """
@@ -120,15 +333,19 @@ class CompoundIndex(object):
 
         If the specified term does not exist in the index, returns 0.
         """
-        if index_name not in self.__indices:
-            raise KeyError('Index: {} not recognized'.format(index_name))
-        assert index_name in self.__indices
+        self.__check_index(index_name)
 
-        dictionary = self.__indices[index_name][indexfields.INDEX_DICT]
-        if term not in dictionary:
-            return 0
-        else:
-            return dictionary[term][indexfields.TOKEN_DOC_FREQ]
+        if self.__deleted:
+            # Deleted documents may still be in the postings of earlier
+            # segments, so count the remaining postings instead.
+            return len(self.postings_arrays(index_name, term)[0])
+
+        doc_freq = 0
+        for index_segment in self.__segments:
+            entry = index_segment.term_entry(index_name, term)
+            if entry:
+                doc_freq += entry[0]
+        return doc_freq
 
     def inverse_document_frequency(self, index_name, term):
         """
@@ -136,15 +353,72 @@ class CompoundIndex(object):
 
         If the specified term does not exist in the index, returns 0.
         """
-        if index_name not in self.__indices:
-            raise KeyError('Index: {} not recognized'.format(index_name))
-        assert index_name in self.__indices
+        self.__check_index(index_name)
+
+        if self.__is_simple():
+            entry = self.__segments[0].term_entry(index_name, term)
+            return entry[1] if entry else 0
 
-        dictionary = self.__indices[index_name][indexfields.INDEX_DICT]
-        if term not in dictionary:
+        doc_freq = self.document_frequency(index_name, term)
+        if doc_freq == 0:
             return 0
-        else:
-            return dictionary[term][indexfields.TOKEN_IDF]
+        if index_name not in self.__live_document_counts:
+            self.__live_document_counts[index_name] = \
+                len(self.documents_in_index(index_name))
+        count = self.__live_document_counts[index_name]
+        return math.log(float(count) / doc_freq, 10)
+
+    def document_norm(self, index_name, guid):
+        """
+        Returns the length of a document's full vector in the given index,
+        where each term is weighted by its log-tf. This is computed at index
+        time.
+
+        If the document is not in the index, returns 0.
+        """
+        self.__check_index(index_name)
+
+        index_segment = self.__segment_for_guid(guid)
+        if index_segment is None:
+            return 0.0
+        return index_segment.norm(index_name, guid)
+
+    def document_norms(self, index_name, guids):
+        """
+        Like document_norm, for a NumPy array of guids. Returns a NumPy array
+        of float64.
+        """
+        self.__check_index(index_name)
+
+        guids = numpy.asarray(guids, numpy.int64)
+        norms = numpy.zeros(len(guids))
+        for index_segment in self.__segments:
+            segment_norms = index_segment.norm_array(index_name)
+            offsets = guids - index_segment.first_guid
+            inside = (offsets >= 0) & (offsets < len(segment_norms))
+            norms[inside] = segment_norms[offsets[inside]]
+        if len(self.__deleted_array):
+            norms[numpy.in1d(guids, self.__deleted_array)] = 0.0
+        return norms
+
+    def max_weight(self, index_name, term):
+        """
+        Returns the largest weight of a term in a document of the given index
+        (its log-tf divided by the document's norm), as stored at index time,
+        or None if a segment does not store it.
+
+        Deleted documents are included, so this is an upper bound. If the
+        term is not in the index, returns 0.
+        """
+        self.__check_index(index_name)
+
+        largest = 0.0
+        for index_segment in self.__segments:
+            weight = index_segment.max_weight(index_name, term)
+            if weight is None:
+                return None
+            largest = max(largest, weight)
+        return largest
 
     def postings_list(self, index_name, term, use_doc_names=False):
         """
@@ -155,20 +429,54 @@ class CompoundIndex(object):
         If use_doc_names is True, a list of (document_name, term_freq)-tuples
         is returned instead.
         """
-        if index_name not in self.__indices:
-            raise KeyError('Index: {} not recognized'.format(index_name))
-        assert index_name in self.__indices
+        guids, tfs = self.postings_arrays(index_name, term)
+        if use_doc_names:
+            guids = [self.document_name_for_guid(guid) for guid in guids]
+        return zip(guids, tfs)
 
-        dictionary = self.__indices[index_name][indexfields.INDEX_DICT]
-        if term not in dictionary:
-            return []
-        else:
-            postings = dictionary[term][indexfields.TOKEN_ENTRIES]
-            result = []
-            for entry in postings:
-                assert len(entry) == 2
-                guid, tf = entry[0], entry[1]
-                if use_doc_names:
-                    guid = self.document_name_for_guid(guid)
-                result.append((guid, tf))
-            return result
+    def postings_arrays(self, index_name, term):
+        """
+        Returns the postings list for a term in the given index as a pair of
+        parallel arrays: (guids, term_freqs).
+
+        If the specified term does not exist in the index, both arrays are
+        empty.
+        """
+        self.__check_index(index_name)
+
+        if self.__is_simple():
+            return self.__segments[0].postings_arrays(index_name, term)
+
+        # Segments are in increasing guid order, so concatenating their
+        # postings keeps the result sorted by guid.
+        guids, tfs = array.array('i'), array.array('i')
+        for index_segment in self.__segments:
+            segment_guids, segment_tfs = \
+                index_segment.postings_arrays(index_name, term)
+            for guid, tf in zip(segment_guids, segment_tfs):
+                if guid not in self.__deleted:
+                    guids.append(guid)
+                    tfs.append(tf)
+        return guids, tfs
+
+    def postings_numpy(self, index_name, term):
+        """
+        Returns the postings list for a term in the given index as a pair of
+        parallel NumPy arrays: (int32 guids, term_freqs).
+
+        If the index was built with raw postings (and has a single segment and
+        no deletions), these are read-only views over the postings file.
+        """
+        self.__check_index(index_name)
+
+        if self.__is_simple():
+            return self.__segments[0].postings_numpy(index_name, term)
+
+        lists = [index_segment.postings_numpy(index_name, term)
+                 for index_segment in self.__segments]
+        guids = numpy.concatenate([g for g, _ in lists])
+        tfs = numpy.concatenate([t for _, t in lists])
+        if len(self.__deleted_array):
+            live = ~numpy.in1d(guids, self.__deleted_array)
+            guids, tfs = guids[live], tfs[live]
+        return guids, tfs
@@ -0,0 +1,83 @@
+import importlib
+import patentfields
+import threading
+
+# Every feature a search can run, by name. The module of a feature is only
+# imported (and the feature created) the first time the feature is loaded,
+# so a search only pays for the features it runs. Each entry is (module,
+# attribute, arguments): the attribute of the module is either the feature's
+# class, or (given arguments) a function that returns the class.
+FEATURES = {
+    'VSM_Title': ('features.vsm.single', 'VSMTitle', ()),
+    'VSM_Abstract': ('features.vsm.single', 'VSMAbstract', ()),
+    'VSM_Title_Minus_Stopwords': (
+        'features.vsm.single', 'VSMTitleMinusStopwords', ()),
+    'VSM_Abstract_Minus_Stopwords': (
+        'features.vsm.single', 'VSMAbstractMinusStopwords', ()),
+    'VSM_Title_Nouns_Only': ('features.vsm.single', 'VSMTitleNounsOnly', ()),
+    'VSM_Abstract_Nouns_Only': (
+        'features.vsm.single', 'VSMAbstractNounsOnly', ()),
+
+    'VSM_Title_and_Abstract': (
+        'features.vsm.multiple', 'VSMTitleAndAbstract', ()),
+    'VSM_Title_and_Abstract_Minus_Stopwords': (
+        'features.vsm.multiple', 'VSMTitleAndAbstractMinusStopwords', ()),
+
+    'VSM_Title_Minus_Stopwords_Plus_Expansion': (
+        'features.vsm.expansion', 'VSMTitleMinusStopwordsPlusExpansion', ()),
+    'VSM_Abstract_Minus_Stopwords_Plus_Expansion': (
+        'features.vsm.expansion', 'VSMAbstractMinusStopwordsPlusExpansion',
+        ()),
+
+    'citationcount': ('features.fields', 'CitationCount', ()),
+
+    'Cites': ('features.relation', 'Citations', ()),
+    'FamilyMembers': ('features.relation', 'FamilyMembers', ()),
+
+    'IPC_Section_Labels_Title': ('features.ipc', 'IPCSectionLabelsTitle', ()),
+    'IPC_Section_Labels_Abstract': (
+        'features.ipc', 'IPCSectionLabelsAbstract', ()),
+}
+
+# Cluster features, named after their field (see
+# features.cluster.cluster_feature_generator.)
+for _field in [patentfields.IPC_SECTION, patentfields.IPC_CLASS,
+               patentfields.IPC_GROUP, patentfields.IPC_PRIMARY,
+               patentfields.IPC_SUBCLASS, patentfields.ALL_IPC,
+               patentfields.ALL_UPC, patentfields.UPC_PRIMARY,
+               patentfields.UPC_CLASS]:
+    FEATURES['Cluster' + _field.replace(' ', '')] = (
+        'features.cluster', 'cluster_feature_generator', (_field,))
+del _field
+
+# Features loaded so far, shared by every search, including searches running
+# at the same time (e.g. in server.py): features keep no per-query state, as
+# the search and its shared object are passed to them.
+__loaded = {}
+__lock = threading.Lock()
+
+
+def names():
+    return sorted(FEATURES)
+
+
+def load(name):
+    """
+    Returns the feature called name, importing its module and creating it
+    the first time. The same instance is returned to every search (in any
+    thread), so features must not keep anything about a query on themselves.
+    Raises KeyError for an unknown name.
+    """
+    with __lock:
+        feature = __loaded.get(name)
+        if feature is None:
+            module_name, attribute, arguments = FEATURES[name]
+            cls = getattr(importlib.import_module(module_name), attribute)
+            if arguments:
+                cls = cls(*arguments)
+            feature = cls()
+            if feature.NAME != name:
+                raise ValueError('Feature {} is called {}.'.format(
+                    name, feature.NAME))
+            __loaded[name] = feature
+        return feature
@@ -1,6 +1,7 @@
 import collections
+import itertools
 
-from helpers import cache
+from features.vsm.base import VSMBase
 
 
 class ClusterBase(object):
@@ -17,24 +18,31 @@ class ClusterBase(object):
     """
     INDEX = None
 
-    @cache.naive_class_method_cache
     def get_cluster(self, compound_index, shared_obj, index):
         """Returns a dicionary with the aggregated/average scores for each
         field."""
         cluster = collections.defaultdict(lambda: 0)
         cluster_count = collections.defaultdict(lambda: 0)
 
+        # NOTE(michael): We use a not so arbitrary weight here (The
+        # intuition is that is you score pretty well (roughly), your
+        # enum value counts for a little more.
+        # NOTE(michael): Ignore fields starting with 'Cluster' else we
+        # get a unwanted compounding effect.
+        if hasattr(shared_obj, 'score_sums'):
+            # Array-backed scores can be summed without a dict per document.
+            doc_ids, sums = shared_obj.score_sums(exclude_prefix='Cluster')
+            weights = itertools.izip(doc_ids.tolist(), sums.tolist())
+        else:
+            weights = ((doc_id, sum(v for k, v in score_dict.iteritems()
+                                    if not k.startswith('Cluster')))
+                       for doc_id, score_dict
+                       in shared_obj.doc_ids_to_scores.iteritems())
+
         d = compound_index.dict_for_field(index)
-        for doc_id, score_dict in shared_obj.doc_ids_to_scores.iteritems():
+        for doc_id, weight in weights:
             val = d.get(doc_id)
             if val:
-                # NOTE(michael): We use a not so arbitrary weight here (The
-                # intuition is that is you score pretty well (roughly), your
-                # enum value counts for a little more.
-                # NOTE(michael): Ignore fields starting with 'Cluster' else we
-                # get a unwanted compounding effect.
-                weight = sum(v for k, v in score_dict.iteritems()
-                    if not k.startswith('Cluster'))
                 cluster[val] += weight
                 cluster_count[val] += 1
 
@@ -53,6 +61,11 @@ class ClusterBase(object):
             if score:
                 shared_obj.set_feature_score(self.NAME, doc_id, score)
 
+# Scores read from the shared search object. Documents given a score by an
+# earlier cluster feature also count towards the averages (with the weight of
+# their other scores), so earlier clusters are inputs too.
+ClusterBase.INPUTS = (VSMBase, ClusterBase)
+
 
 def cluster_feature_generator(index):
     """Dynamically generates a cluster subclass given an index."""
@@ -1,5 +1,6 @@
 import patentfields
 import math
+import numpy
 
 
 class FieldFeatureBase(object):
@@ -9,6 +10,20 @@ class FieldFeatureBase(object):
     def score(self, val):
         raise NotImplementedError()
 
+    def score_bounds(self, search, doc_ids):
+        """Returns (lowest, highest): NumPy arrays of the least and most this
+        feature can score each of the given documents. A document's score
+        only depends on its value, so both are its score (0 if it has none.)
+        """
+        values = search.compound_index.dict_for_field(self.FIELD)
+        doc_values = [values.get(doc_id) for doc_id in doc_ids.tolist()]
+        scores = dict((val, self.score(val)) for val in set(doc_values)
+                      if val is not None)
+        scores[None] = 0.0
+        bounds = numpy.array([scores[val] for val in doc_values],
+                             numpy.float64)
+        return bounds, bounds
+
     def __call__(self, search, shared_obj):
         for doc_id, val in search.compound_index.value_for_field(self.FIELD):
             shared_obj.set_feature_score(self.NAME, doc_id, self.score(val))
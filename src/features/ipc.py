@@ -1,37 +1,71 @@
 import collections
+import lexicon
+import numpy
 import patentfields
+import postings
+import threading
 
 from features.vsm import single
 from tokenizer import free_text
 
 
-IPC_SECTIONS = {
-    'A': free_text('Human Necessities'),
-    'B': free_text('Performaing Operations, Transporting'),
-    'C': free_text('Chemistry, Metallurgy'),
-    'D': free_text('Textiles, Paper'),
-    'E': free_text('Fixed Constructions'),
-    'F': free_text('Mechanical Engineering, Lighting, Heating, Weapons'),
-    'G': free_text('Physics'),
-    'H': free_text('Electricity'),
+IPC_SECTION_LABELS = {
+    'A': 'Human Necessities',
+    'B': 'Performaing Operations, Transporting',
+    'C': 'Chemistry, Metallurgy',
+    'D': 'Textiles, Paper',
+    'E': 'Fixed Constructions',
+    'F': 'Mechanical Engineering, Lighting, Heating, Weapons',
+    'G': 'Physics',
+    'H': 'Electricity',
 }
 
+# The tokens of each label, computed on first use (under a lock, as features
+# may run in several threads.)
+__section_tokens = None
+__section_tokens_lock = threading.Lock()
+
+
+def section_tokens():
+    """Returns a dict of the tokens of each IPC section's label: from the
+    lexicon, if one is loaded (see lexicon.py), or else by tokenizing the
+    labels."""
+    global __section_tokens
+    current_lexicon = lexicon.current()
+    if current_lexicon is not None:
+        return current_lexicon.ipc_sections
+    if __section_tokens is None:
+        with __section_tokens_lock:
+            if __section_tokens is None:
+                __section_tokens = dict(
+                    (section, free_text(label))
+                    for section, label in IPC_SECTION_LABELS.iteritems())
+    return __section_tokens
+
 
 class IPCSectionLabels(single.VSMSingleFieldMinusStopwords):
     """VSM feature using the text descriptions of the IPC sections."""
-    def idf(self):
+    # Documents match a section's label with a tf of 1, not through their
+    # text, so the norms of the index do not apply.
+    USE_INDEX_NORMS = False
+
+    def idf(self, search, shared_obj, term):
         return 1
 
-    def matches(self, term):
-        for section, tokens in IPC_SECTIONS.iteritems():
+    def postings(self, search, shared_obj, term):
+        for section, tokens in section_tokens().iteritems():
             if term in tokens:
-                retval = []
-                for doc_id, val in compound_index.value_for_field(
-                        patentfields.IPC_SECTION):
-                    if val == section:
-                        retval.append((doc_id, 1))
-                return retval
-        return []
+                doc_ids = [doc_id for doc_id, val in
+                           search.compound_index.value_for_field(
+                               patentfields.IPC_SECTION)
+                           if val == section]
+                return (numpy.array(doc_ids, postings.GUID_DTYPE),
+                        numpy.ones(len(doc_ids), numpy.int32))
+        return (numpy.array([], postings.GUID_DTYPE),
+                numpy.array([], numpy.int32))
+
+    def postings_key(self, term):
+        return 'ipc_section_labels', term
 
 
 class IPCSectionLabelsTitle(IPCSectionLabels):
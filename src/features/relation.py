@@ -12,6 +12,10 @@ class RelationalFeatureBase(object):
     """
     FIELD = None
 
+    # Scores read from the shared search object: those of every earlier
+    # feature.
+    INPUTS = (object,)
+
     def __call__(self, search, shared_obj):
         relational_score = collections.defaultdict(lambda: 0)
 
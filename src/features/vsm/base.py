@@ -1,5 +1,7 @@
 import collections
+import numpy
 
+from features.vsm import shared
 from features.vsm.vsmutils import *
 
 
@@ -10,16 +12,17 @@ class VSMBase(object):
 
     We extend this base class in several ways to provide several different VSM
     scores (which operate on different indices etc.). Each subclass overrides
-    (among other methods) `query_tokens` and `matches` to specify the query
+    (among other methods) `query_tokens` and `postings` to specify the query
     and field for the VSM.
 
     At a high-level, each VSM feature has a query (returned by `query_tokens`):
 
         [A, B, C]
 
-    and a call to matches (with a term) should return a postings list:
+    and a call to postings (with a term) should return the documents matching
+    it, and the term's frequency in each:
 
-        self.matches(A) => [(d1, tf), (d2, tf) ... ]
+        self.postings(search, shared_obj, A) => ([d1, d2 ...], [tf, tf ...])
 
     Through a simple class hierachy, we are able to create VSM features for:
 
@@ -28,53 +31,82 @@ class VSMBase(object):
         - query::title (only nouns) -> document::title
         - query::description -> document::abstract
         - ...
+
+    A feature is shared by every search (see featureregistry.py), so the
+    search and its shared object are passed to these methods rather than
+    kept on the feature. The VSM features of a search are scored together,
+    in one pass over their postings (see features.vsm.shared): the first one
+    to run scores them all.
     """
     NAME = ''
 
-    def idf(self, term):
+    # If True, documents are weighted by log-tf and normalised by the length
+    # of their full vector (computed at index time). Otherwise, documents are
+    # weighted by raw tf and normalised by their length in the dimensions of
+    # the query, which is what the feature weights were trained on.
+    USE_INDEX_NORMS = False
+
+    def idf(self, search, shared_obj, term):
         """Given a term, returns the IDF score for that term in the index."""
         raise NotImplementedError()
 
-    def query_tokens(self):
+    def query_tokens(self, search):
         """Returns a list of tokens for the query."""
         raise NotImplementedError()
 
-    def matches(self, term):
-        """Returns a list of postings for the given term.
+    def postings(self, search, shared_obj, term):
+        """Returns the postings of the given term, as (doc_ids,
+        term_frequencies) NumPy arrays, sorted by doc_id."""
+        raise NotImplementedError()
 
-        Each posting is a (doc_id, term_frequency) pair."""
+    def postings_key(self, term):
+        """Returns a key for the postings of a term, equal for every feature
+        that gets the same postings for it (so that they are only read once
+        per search.)"""
         raise NotImplementedError()
 
-    def __call__(self, search, shared_obj):
-        # Assign instance properties (so these are accessible in the other
-        # methods, allowing subclasses to defined more complex behavior than
-        # is specified here.)
-        self.search = search
-        self.compound_index = search.compound_index
-
-        # Process query (to get the dimensions of the VSM and the
-        # unit_query_vector.)
-        query_tokens = self.query_tokens()
+    def document_norms(self, search, doc_ids):
+        """Returns the lengths of the documents' full vectors (given a NumPy
+        array of doc_ids), as computed at index time. Only used if
+        USE_INDEX_NORMS is set."""
+        raise NotImplementedError()
+
+    def max_weight(self, search, shared_obj, term):
+        """Returns an upper bound on the weight of a term in a document
+        vector divided by the vector's length, i.e. on what the term can add
+        to a document's score per unit of its query weight, or None if there
+        is none.
+
+        A document's length in the query's dimensions is at least its weight
+        in any one of them, so without index norms this is 1."""
+        if not self.USE_INDEX_NORMS:
+            return 1.0
+        return None
+
+    def document_weights(self, term_frequencies):
+        """Returns the weights of terms in document vectors, given a NumPy
+        array of their term frequencies."""
+        if self.USE_INDEX_NORMS:
+            return logtf_array(term_frequencies)
+        return term_frequencies.astype(numpy.float64)
+
+    def query_vector(self, search, shared_obj):
+        """Returns (terms, weights): the sorted terms of the query, and the
+        unit query vector over them."""
+        query_tokens = self.query_tokens(search)
         query_tf = collections.Counter(query_tokens)
         query_terms_sorted = sorted(set(query_tokens))
         # NOTE(michael): Do the idf weighting on the query vector so we only do
         # it once. (similar to doing this on the tf values of individual
         # documents).
-        query_vector = [logtf(query_tf[term]) * self.idf(term)
-            for term in query_terms_sorted]
-        unit_query_vector = list(unit_vector(query_vector))
-
-        # Get the term frequencies of the docs for each of the dimensions.
-        results = collections.defaultdict(dict)
-        for term in query_tokens:
-            for doc_id, term_frequency in self.matches(term):
-                results[doc_id][term] = term_frequency
-
-        # Calculate the document score.
-        for doc_id, tfs in results.iteritems():
-            doc_vector = [tfs.get(term, 0) for term in query_terms_sorted]
-            doc_unit_vector = unit_vector(doc_vector)
-            score = dot_product(unit_query_vector, doc_unit_vector)
-
-            # Set the score on the shared search object.
-            shared_obj.set_feature_score(self.NAME, doc_id, score)
+        query_vector = [logtf(query_tf[term]) *
+                        self.idf(search, shared_obj, term)
+                        for term in query_terms_sorted]
+        return query_terms_sorted, list(unit_vector(query_vector))
+
+    def __call__(self, search, shared_obj):
+        features = [feature for feature in search.features
+                    if isinstance(feature, VSMBase) and
+                    feature.NAME in search.planned_features]
+        doc_ids, scores = shared.scores(search, shared_obj, self, features)
+        shared_obj.set_feature_scores(self.NAME, doc_ids, scores)
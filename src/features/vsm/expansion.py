@@ -1,4 +1,7 @@
+import lexicon
 import patentfields
+import postings
+import threading
 
 from features.vsm import single
 from thesaurus import Thesaurus
@@ -6,68 +9,69 @@ from helpers import cache
 from tokenizer import free_text as tokenizer
 
 
-class VSMSingleFieldMinusStopwordsPlusExpansion(
-        single.VSMSingleFieldMinusStopwords):
-    """Base class for VSM on a single field using synonym expansion of each
-    word in the field (ignoring stopwords.)"""
+# Loaded on first use (under a lock, as features may run in several threads),
+# and shared by every query.
+__thesaurus = None
+__thesaurus_lock = threading.Lock()
 
-    def stemmed_unstemmed_map(self, index):
-        """Given an index, returns a dictionary where keys are stems of the
-        words contained within, and values are the corresponding unstemmed
-        word."""
-        # TODO(michael): Cache this value.
-        stemmed_unstemmed_dict = {}
-        stems = self.search.get_tokens_for(index)
-        originals = self.search.get_tokens_for(index, unstemmed=True)
 
-        for idx, stem in enumerate(stems):
-            stemmed_unstemmed_dict[stem] = originals[idx]
+def thesaurus():
+    global __thesaurus
+    if __thesaurus is None:
+        with __thesaurus_lock:
+            if __thesaurus is None:
+                __thesaurus = Thesaurus()
+    return __thesaurus
 
-        return stemmed_unstemmed_dict
 
-    def matches(self, term):
-        """Given a term, returns a list of postings for that term and its
-        synonyms.
+def synonym_stems(word):
+    """Returns the stems of the synonyms of a word: from the lexicon, if one
+    is loaded (see lexicon.py), or else by stemming the thesaurus' synonyms.
+    """
+    current_lexicon = lexicon.current()
+    if current_lexicon is not None:
+        return current_lexicon.thesaurus.values(word) if word else []
+    return [tokenizer(synonym)[0] for synonym in thesaurus()[word]]
 
-        We find synonyms for the given term, obtain their postings, and merge
-        them with the \"original\" list of postings for the term itself."""
-        # Obtain the postings list for this term.
-        term_postings = \
-            set(self.compound_index.postings_list(self.INDEX, term))
 
-        # Convert the postings list into a dictionary,
-        # where keys are doc IDs and values are term counts.
-        posting_dict = {}
-        for posting in term_postings:
-            posting_dict[posting[0]] = posting[1]
+class VSMSingleFieldMinusStopwordsPlusExpansion(
+        single.VSMSingleFieldMinusStopwords):
+    """Base class for VSM on a single field using synonym expansion of each
+    word in the field (ignoring stopwords.)"""
 
+    def expanded_terms(self, search, term):
+        """Returns the term, followed by the stems of its synonyms."""
         # Find synonyms of the term from our thesaurus.
-        thesaurus = Thesaurus()
-        unstemmed = self.stemmed_unstemmed_map(self.INDEX)[term]
-        synonyms = thesaurus[unstemmed]
-
-        for synonym in synonyms:
-            # Get the postings for this synonym.
-            stemmed_synonym = tokenizer(synonym)[0]
-            postings = self.compound_index.postings_list(
-                self.INDEX, stemmed_synonym)
-
-            # Update the existing postings with each synonym's count.
-            for posting in postings:
-                doc_id = posting[0]
-                count = posting[1]
-
-                if doc_id in posting_dict:
-                    posting_dict[doc_id] += count
-                else:
-                    posting_dict[doc_id] = count
-
-        # Convert the posting dictionary back into a posting list.
-        combined_postings = []
-        for doc_id, count in posting_dict.iteritems():
-            combined_postings.append([doc_id, count])
-
-        return sorted(combined_postings)
+        unstemmed = search.query_analysis.stem_map(self.INDEX)[term]
+        return [term] + synonym_stems(unstemmed)
+
+    def postings(self, search, shared_obj, term):
+        """Given a term, returns the postings for that term and its synonyms.
+
+        We find synonyms for the given term, obtain their postings, and merge
+        them with the \"original\" list of postings for the term itself,
+        adding up the term counts of each document."""
+        term_postings = [
+            shared_obj.postings(search.compound_index, self.INDEX, expanded)
+            for expanded in self.expanded_terms(search, term)]
+        return postings.union_sum(term_postings)
+
+    def max_weight(self, search, shared_obj, term):
+        """The log-tf of a sum of term frequencies is at most the sum of
+        their log-tfs, so the largest weights of the term and its synonyms
+        add up to a bound."""
+        if not self.USE_INDEX_NORMS:
+            return 1.0
+        total = 0.0
+        for expanded in self.expanded_terms(search, term):
+            weight = search.compound_index.max_weight(self.INDEX, expanded)
+            if weight is None:
+                return None
+            total += weight
+        return total
+
+    def postings_key(self, term):
+        return 'expansion', self.INDEX, term
 
 
 class VSMTitleMinusStopwordsPlusExpansion(
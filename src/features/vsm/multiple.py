@@ -1,8 +1,6 @@
-import collections
 import patentfields
-import utils
+import postings
 
-from helpers import cache
 from features.vsm import base
 from features.vsm.vsmutils import *
 
@@ -11,46 +9,47 @@ class VSMMultipleFields(base.VSMBase):
     """Base class for VSM on multiple fields."""
     ZONES = []
 
-    def idf(self, term):
+    # The index stores no norms for the union of several zones, so these
+    # always normalise by the length in the query's dimensions.
+    USE_INDEX_NORMS = False
+
+    def idf(self, search, shared_obj, term):
         # HACK(michael): Calculate the idf from the idfs of the fields.
-        documents_with_term = set()
-        for idx in self.ZONES:
-            for doc_id, _ in self.compound_index.postings_list(idx, term):
-                documents_with_term.add(doc_id)
-        document_freq = len(documents_with_term)
-        documents_in_index = self.number_of_docs_in_indices()
+        doc_ids, _ = self.postings(search, shared_obj, term)
+        document_freq = len(doc_ids)
+        documents_in_index = self.number_of_docs_in_indices(search)
         return idf(documents_in_index, document_freq)
 
-    @cache.naive_class_method_cache
-    def number_of_docs_in_indices(self):
-        documents_in_index = set()
-        for idx in self.ZONES:
-            for doc_id in self.compound_index.documents_in_index(idx):
-                documents_in_index.add(doc_id)
-        return len(documents_in_index)
+    def postings(self, search, shared_obj, term):
+        """Returns the (doc_ids, term_frequencies) arrays of the term across
+        all zones, with the term frequencies of each document summed."""
+        return shared_obj.cached(
+            self.postings_key(term),
+            lambda: postings.union_sum(
+                [shared_obj.postings(search.compound_index, idx, term)
+                 for idx in self.ZONES]))
+
+    def postings_key(self, term):
+        return 'zone_postings', tuple(self.ZONES), term
+
+    def number_of_docs_in_indices(self, search):
+        return search.compound_index.document_count(self.ZONES)
 
-    def query_tokens(self):
+    def query_tokens(self, search):
         tokens = []
         for idx in self.ZONES:
-            tokens.extend(self.search.get_tokens_for(idx))
+            tokens.extend(search.query_analysis.tokens(idx))
         return tokens
 
-    def matches(self, term):
-        results = collections.defaultdict(lambda: 0)
-        for idx in self.ZONES:
-            for doc_id, term_freq in \
-                    self.compound_index.postings_list(idx, term):
-                results[doc_id] += term_freq
-        return results.iteritems()
-
 
 class VSMMultipleFieldsMinusStopwords(VSMMultipleFields):
     """Base class for VSM on multiple indices, removing stopwords from their
     text."""
-    def query_tokens(self):
-        query_tokens = super(VSMMultipleFieldsMinusStopwords,
-            self).query_tokens()
-        return utils.without_stopwords(query_tokens)
+    def query_tokens(self, search):
+        tokens = []
+        for idx in self.ZONES:
+            tokens.extend(search.query_analysis.tokens_without_stopwords(idx))
+        return tokens
 
 
 class VSMTitleAndAbstract(VSMMultipleFields):
@@ -0,0 +1,279 @@
+import numpy
+import postings
+import profiling
+
+# The VSM features of a search are scored in one pass over their postings:
+#
+#   1. Each feature's query vector is computed, and the postings of each of
+#      its terms are read (each distinct postings list once, however many
+#      features use it; see VSMBase.postings_key.)
+#   2. The documents of all the postings are numbered once (numpy.unique),
+#      for every feature.
+#   3. Each feature's dot products and document lengths are then added up per
+#      document with numpy.bincount, in the order of its (sorted) terms, so
+#      that the scores are exactly those of scoring each feature on its own,
+#      one term at a time.
+#
+# With a top_k, only the documents that may be among the results are scored
+# (MaxScore; see top_candidates), if the other features of the search allow
+# it (see other_bounds.) They get exactly the same scores as in a full pass.
+#
+# The scores of every feature are kept in the search's shared object, and
+# each feature sets its own when it runs.
+
+# Key of the scores in SharedSearchObject.cached.
+SCORES = 'vsm scores'
+
+# Bounds are compared with scores summed in a different order, so they are
+# allowed this much rounding error (relative to the threshold.)
+BOUND_SLACK = 1e-9
+
+# The threshold of top_candidates is found by scoring this many times top_k
+# documents.
+SEEDS = 2
+
+
+def scores(search, shared_obj, feature, features):
+    """
+    Returns the (doc_ids, scores) NumPy arrays of a VSM feature of a search.
+
+    The first time this is called for a search, every feature in features
+    (the VSM features the search runs) is scored. A feature whose query
+    vector or postings raise an exception is left out of the pass, and scored
+    on its own when it runs, so that the exception is raised by that feature.
+    """
+    all_scores = shared_obj.cached(SCORES, lambda: score_features(
+        search, shared_obj, features, skip_errors=True, top_k=search.top_k))
+    if feature.NAME in all_scores:
+        return all_scores[feature.NAME]
+    return score_features(search, shared_obj, [feature])[feature.NAME]
+
+
+def score_features(search, shared_obj, features, skip_errors=False,
+                   top_k=None):
+    """
+    Scores VSM features in one pass, returning a dict of feature name:
+    (doc_ids, scores), where doc_ids are the (sorted) documents matching any
+    of the feature's terms.
+
+    If skip_errors is True, features that raise an exception are left out;
+    otherwise the exception is raised.
+
+    If top_k is set, documents that cannot be among the top_k results of the
+    search may be left out (see top_candidates.)
+    """
+    queries, rows = read_queries(search, shared_obj, features, skip_errors)
+    doc_ids, entries = all_documents(rows)
+    if top_k is not None:
+        keep = top_candidates(search, shared_obj, features, queries, rows,
+                              top_k, doc_ids, entries)
+        if keep is not None:
+            doc_ids, entries = doc_ids[keep], select(entries, keep)
+    profiling.current().count('VSM postings entries accumulated',
+                              sum(len(documents) for documents, _ in entries))
+
+    result = {}
+    for name, (touched, score) in accumulate(
+            search, queries, doc_ids, entries).iteritems():
+        result[name] = (doc_ids[touched], score)
+    return result
+
+
+def read_queries(search, shared_obj, features, skip_errors):
+    """
+    Returns (queries, rows): for each feature, (feature, its terms, the
+    positions of their postings in rows, its query weights), and the postings
+    read (each distinct list once.)
+    """
+    keys = {}
+    rows = []
+    queries = []
+    for feature in features:
+        try:
+            terms, weights = feature.query_vector(search, shared_obj)
+            positions = []
+            for term in terms:
+                key = feature.postings_key(term)
+                if key not in keys:
+                    keys[key] = len(rows)
+                    rows.append(feature.postings(search, shared_obj, term))
+                positions.append(keys[key])
+        except Exception:
+            if not skip_errors:
+                raise
+            continue
+        queries.append((feature, terms, positions, weights))
+    return queries, rows
+
+
+def all_documents(rows):
+    """
+    Returns (doc_ids, entries): every document in the postings rows (sorted),
+    and for each row, (the position in doc_ids of each posting's document,
+    the term frequencies.)
+    """
+    if not rows:
+        return numpy.array([], postings.GUID_DTYPE), []
+    doc_ids, inverse = numpy.unique(
+        numpy.concatenate([numpy.asarray(guids) for guids, _ in rows]),
+        return_inverse=True)
+    entries = []
+    start = 0
+    for guids, tfs in rows:
+        end = start + len(guids)
+        entries.append((inverse[start:end], numpy.asarray(tfs)))
+        start = end
+    return doc_ids, entries
+
+
+def select(entries, keep):
+    """
+    Returns the entries (see all_documents) of the documents for which the
+    boolean array keep is True, numbered by their position in doc_ids[keep].
+    """
+    positions = numpy.cumsum(keep) - 1
+    selected = []
+    for documents, tfs in entries:
+        kept = keep[documents]
+        selected.append((positions[documents[kept]], tfs[kept]))
+    return selected
+
+
+def accumulate(search, queries, doc_ids, entries):
+    """
+    Returns a dict of feature name: (positions in doc_ids of the documents
+    matching any of the feature's terms, their scores), given the entries of
+    the postings rows for doc_ids (see all_documents.)
+    """
+    empty = numpy.array([], numpy.int64)
+    result = {}
+    for feature, _, positions, weights in queries:
+        documents = numpy.concatenate(
+            [entries[i][0] for i in positions] + [empty])
+        doc_weights = feature.document_weights(numpy.concatenate(
+            [entries[i][1] for i in positions] + [empty]))
+        query_weights = numpy.repeat(
+            numpy.array(weights, numpy.float64),
+            numpy.array([len(entries[i][0]) for i in positions],
+                        numpy.int64))
+
+        # Accumulate, one term (dimension) at a time, the dot product of each
+        # document with the unit query vector and the squared length of the
+        # document in the dimensions of the query.
+        size = len(doc_ids)
+        dot = numpy.bincount(documents, query_weights * doc_weights, size)
+        length_squared = numpy.bincount(
+            documents, doc_weights * doc_weights, size)
+        touched = numpy.flatnonzero(numpy.bincount(documents, None, size))
+
+        # Calculate the document scores.
+        if feature.USE_INDEX_NORMS:
+            length = feature.document_norms(search, doc_ids[touched])
+        else:
+            length = numpy.sqrt(length_squared[touched])
+        score = numpy.zeros(len(touched))
+        nonzero = length != 0
+        score[nonzero] = dot[touched][nonzero] / length[nonzero]
+        result[feature.NAME] = (touched, score)
+    return result
+
+
+def other_bounds(search, features, doc_ids):
+    """
+    Returns (lowest, highest): NumPy arrays of the least and most the
+    features of a search other than the given VSM features add to the score
+    of each of the given documents.
+
+    Returns None if a feature's scores are not bounded (it has no
+    score_bounds), or if it reads other features' scores (its INPUTS; e.g.
+    the clusters average the VSM scores of every document), so that it
+    depends on every document being scored, or if features may be left out
+    to meet a deadline.
+    """
+    if search.deadline_ms is not None:
+        return None
+    names = set(feature.NAME for feature in features)
+    others = [(feature, weight) for feature, weight
+              in zip(search.features, search.features_weights)
+              if feature.NAME not in names]
+    for feature, _ in others:
+        if getattr(feature, 'INPUTS', ()) or \
+                not hasattr(feature, 'score_bounds'):
+            return None
+
+    lowest = numpy.zeros(len(doc_ids))
+    highest = numpy.zeros(len(doc_ids))
+    for feature, weight in others:
+        bounds = feature.score_bounds(search, doc_ids)
+        if bounds is None:
+            return None
+        low, high = weight * bounds[0], weight * bounds[1]
+        lowest += numpy.minimum(low, high)
+        highest += numpy.maximum(low, high)
+    return lowest, highest
+
+
+def top_candidates(search, shared_obj, features, queries, rows, top_k,
+                   doc_ids, entries):
+    """
+    Returns a boolean array over doc_ids (with the entries of all_documents)
+    marking the documents that may be among the top_k results of the search,
+    or None if every document has to be scored.
+
+    A term can add at most max(0, feature weight * query weight * its
+    max_weight) to a document's score in each feature that has it, and no
+    VSM score is more than 1, so a document's VSM scores add up to at most
+    the least of the bounds of the terms it has, and the positive feature
+    weights. With the bounds of the other features for the document (see
+    other_bounds), this bounds its score. Some documents (those with the
+    largest bounds, and those the other features score highest) are scored,
+    and the top_k-th best of their scores (or min_score, if higher) is a
+    score that the top_k-th result reaches: the documents whose bounds are
+    below it are left out.
+    """
+    if top_k < 1 or not len(doc_ids):
+        return None
+    bounds = other_bounds(search, features, doc_ids)
+    if bounds is None:
+        return None
+    lowest, highest = bounds
+    weights = dict(zip(search.features_vector_key, search.features_weights))
+
+    # The most each postings row adds to a document's score.
+    row_bounds = numpy.zeros(len(rows))
+    for feature, terms, positions, query_weights in queries:
+        weight = weights[feature.NAME]
+        for term, position, query_weight in zip(terms, positions,
+                                                query_weights):
+            max_weight = feature.max_weight(search, shared_obj, term)
+            if max_weight is None:
+                return None
+            row_bounds[position] += max(0.0,
+                                        weight * query_weight * max_weight)
+    vsm_bounds = numpy.bincount(
+        numpy.concatenate([documents for documents, _ in entries]),
+        numpy.repeat(row_bounds, [len(tfs) for _, tfs in entries]),
+        len(doc_ids))
+    most = sum(max(0.0, weights[feature.NAME])
+               for feature, _, _, _ in queries)
+    upper = highest + numpy.minimum(vsm_bounds, most)
+
+    # Find a score the top_k-th result reaches.
+    threshold = search.min_score
+    count = min(len(doc_ids), SEEDS * top_k)
+    seeds = numpy.zeros(len(doc_ids), bool)
+    seeds[numpy.argpartition(-upper, count - 1)[:count]] = True
+    seeds[numpy.argpartition(-lowest, count - 1)[:count]] = True
+    if seeds.sum() >= top_k:
+        seed_scores = lowest[seeds]
+        for name, (touched, score) in accumulate(
+                search, queries, doc_ids[seeds],
+                select(entries, seeds)).iteritems():
+            seed_scores[touched] += weights[name] * score
+        kth = len(seed_scores) - top_k
+        threshold = max(threshold, numpy.partition(seed_scores, kth)[kth])
+
+    keep = upper + BOUND_SLACK * (1 + abs(threshold)) >= threshold
+    profiling.current().count('MaxScore documents skipped',
+                              len(keep) - int(keep.sum()))
+    return keep
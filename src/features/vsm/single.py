@@ -1,8 +1,5 @@
 import base
 import patentfields
-import utils
-
-from nltk import pos_tag
 
 
 class VSMSingleField(base.VSMBase):
@@ -12,15 +9,26 @@ class VSMSingleField(base.VSMBase):
     """
     INDEX = None
 
-    def idf(self, term):
-        return self.compound_index.inverse_document_frequency(
+    def idf(self, search, shared_obj, term):
+        return search.compound_index.inverse_document_frequency(
             self.INDEX, term)
 
-    def query_tokens(self):
-        return self.search.get_tokens_for(self.INDEX)
+    def query_tokens(self, search):
+        return search.query_analysis.tokens(self.INDEX)
+
+    def postings(self, search, shared_obj, term):
+        return shared_obj.postings(search.compound_index, self.INDEX, term)
+
+    def postings_key(self, term):
+        return self.INDEX, term
+
+    def document_norms(self, search, doc_ids):
+        return search.compound_index.document_norms(self.INDEX, doc_ids)
 
-    def matches(self, term):
-        return self.compound_index.postings_list(self.INDEX, term)
+    def max_weight(self, search, shared_obj, term):
+        if not self.USE_INDEX_NORMS:
+            return 1.0
+        return search.compound_index.max_weight(self.INDEX, term)
 
 
 class VSMTitle(VSMSingleField):
@@ -35,10 +43,8 @@ class VSMAbstract(VSMSingleField):
 
 class VSMSingleFieldMinusStopwords(VSMSingleField):
     """Base class for VSM on a single field, removing stopwords from its text."""
-    def query_tokens(self):
-        query_tokens = super(VSMSingleFieldMinusStopwords,
-            self).query_tokens()
-        return utils.without_stopwords(query_tokens)
+    def query_tokens(self, search):
+        return search.query_analysis.tokens_without_stopwords(self.INDEX)
 
 
 class VSMTitleMinusStopwords(VSMSingleFieldMinusStopwords):
@@ -53,14 +59,8 @@ class VSMAbstractMinusStopwords(VSMSingleFieldMinusStopwords):
 
 class VSMSingleFieldNounsOnly(VSMSingleField):
     """Base class for VSM on a single field, considering only nouns."""
-    def query_tokens(self):
-        query_tokens = super(VSMSingleFieldNounsOnly,
-            self).query_tokens()
-
-        # Run the query tokens through a part of speech tagger and filter out
-        # tokens that are not nouns.
-        pos_words = pos_tag(query_tokens)
-        return [token for token, pos in pos_words if pos == 'NN']
+    def query_tokens(self, search):
+        return search.query_analysis.nouns(self.INDEX)
 
 class VSMTitleNounsOnly(VSMSingleFieldNounsOnly):
     NAME = 'VSM_Title_Nouns_Only'
@@ -1,4 +1,5 @@
 import math
+import numpy
 
 from nose.tools import eq_ as assert_eq
 from nose.tools import raises
@@ -78,3 +79,10 @@ def test_idf_zero():
     assert_eq(0, idf(1, 0))
     assert_eq(0, idf(0, 1))
     assert_eq(0, idf(0, 0))
+
+
+def test_logtf_array():
+    term_frequencies = numpy.array([3, 1, 10, 3, 250], numpy.int32)
+    assert_eq([logtf(tf) for tf in term_frequencies.tolist()],
+              logtf_array(term_frequencies).tolist())
+    assert_eq([], logtf_array(numpy.array([], numpy.int32)).tolist())
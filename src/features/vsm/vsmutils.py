@@ -1,4 +1,5 @@
 import math
+import numpy
 import utils
 
 from types import GeneratorType
@@ -33,6 +34,17 @@ def logtf(term_frequency):
     return 1 + math.log(term_frequency, LOG_BASE)
 
 
+def logtf_array(term_frequencies):
+    """Calculates the logtf of each term frequency in a NumPy array.
+
+    logtf is computed once per distinct frequency, so that the weights are
+    exactly those of logtf (and of the norms computed at index time.)
+    """
+    values, inverse = numpy.unique(term_frequencies, return_inverse=True)
+    weights = numpy.array([logtf(tf) for tf in values.tolist()], numpy.float64)
+    return weights[inverse]
+
+
 def idf(n, df):
     """Calculates idf given n and df.
 
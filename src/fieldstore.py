@@ -0,0 +1,83 @@
+import array
+import indexfields
+
+# Code stored for documents that do not have a value for a field.
+MISSING = -1
+
+# Column types.
+INT = 'int'
+CATEGORICAL = 'categorical'
+
+
+def encode_column(values, first_guid, count):
+    """Encodes the values of one field as a column aligned to guid.
+
+    values: dict of guid: value for the documents that have the field.
+    first_guid: guid of the first document in the column.
+    count: number of documents in the column.
+
+    If every value is a non-negative integer, the column stores the values
+    directly. Otherwise it is dictionary-encoded: the column stores codes
+    into a sorted list of the distinct values.
+    """
+    codes = [MISSING] * count
+    if all(isinstance(val, (int, long)) and val >= 0
+           for val in values.itervalues()):
+        for guid, val in values.iteritems():
+            codes[guid - first_guid] = val
+        return {
+            indexfields.COLUMN_TYPE: INT,
+            indexfields.COLUMN_CODES: codes,
+        }
+
+    distinct = sorted(set(values.itervalues()))
+    lookup = {val: code for code, val in enumerate(distinct)}
+    for guid, val in values.iteritems():
+        codes[guid - first_guid] = lookup[val]
+    return {
+        indexfields.COLUMN_TYPE: CATEGORICAL,
+        indexfields.COLUMN_VALUES: distinct,
+        indexfields.COLUMN_CODES: codes,
+    }
+
+
+class FieldColumn(object):
+    """
+    The values of a single field for a contiguous range of guids, as written
+    by encode_column.
+    """
+    def __init__(self, json_obj, first_guid):
+        self.first_guid = first_guid
+        self.is_int = json_obj[indexfields.COLUMN_TYPE] == INT
+        self.values = json_obj.get(indexfields.COLUMN_VALUES)
+        codes = json_obj[indexfields.COLUMN_CODES]
+        if not isinstance(codes, array.array):
+            codes = array.array('i', codes)
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def get(self, guid):
+        """
+        Returns the value for a guid, or None if the document does not have
+        one.
+        """
+        offset = guid - self.first_guid
+        if offset < 0 or offset >= len(self.codes):
+            return None
+        code = self.codes[offset]
+        if code == MISSING:
+            return None
+        return code if self.is_int else self.values[code]
+
+    def items(self):
+        """
+        Yields (guid, value)-tuples for every document that has a value.
+        """
+        values = self.values
+        guid = self.first_guid
+        for code in self.codes:
+            if code != MISSING:
+                yield guid, (code if self.is_int else values[code])
+            guid += 1
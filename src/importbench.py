@@ -0,0 +1,46 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+# What is timed: each is run in a new Python process, whose wall time
+# (including starting the interpreter) is measured.
+COMMANDS = [
+    ('python', ['-c', 'pass']),
+    ('search.py --help', [os.path.join(SRC, 'search.py'), '--help']),
+    ('import search', ['-c', 'import search']),
+    ('load features', [
+        '-c', 'import featureregistry, search\n'
+              'for name, _ in search.Search.enabled_features():\n'
+              '    featureregistry.load(name)']),
+    ('import nltk', ['-c', 'import nltk']),
+]
+
+
+def time_command(args):
+    """Returns the wall time (in seconds) of running Python with args."""
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        subprocess.check_call([sys.executable] + args, cwd=SRC,
+                              stdout=devnull)
+        return time.time() - start
+
+
+def main(args):
+    for name, command in COMMANDS:
+        timings = [time_command(command) for _ in xrange(args.repeat)]
+        print '{:<20} {:8.1f} ms'.format(name, 1000 * min(timings))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measures how long search.py takes to start: to print '
+                    'its help, to be imported, and to load its features, '
+                    'each in a new process.')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='number of runs; the fastest is reported.')
+    args = parser.parse_args()
+    main(args)
@@ -1,10 +1,24 @@
 #!/env/bin/python
 import argparse
+import compoundindex
+import contextlib
+import fcntl
+import fieldstore
+import heapq
 import indexfields
+import itertools
 import json
 import math
+import multiprocessing
 import os
 import patentfields
+import pipeline
+import postings
+import profiling
+import snapshot
+import sys
+import tempfile
+import tokenizer
 import utils
 
 from tokenizer import free_text
@@ -17,10 +31,21 @@ class IndexBuilder(object):
 
     This class is used to preprocess patent documents.
     """
-    # Stores a monotonically increasing guid for terms added to the index.
-    guid = 0
+    # Rough number of bytes a single in-memory posting costs (a (guid, tf)
+    # tuple plus its slot in a postings list.)
+    POSTING_SIZE_ESTIMATE = 80
 
-    def __init__(self, dict_path, postings_path):
+    def __init__(self, dict_path, postings_path, memory_budget=None,
+                 first_guid=0, raw_postings=False):
+        """
+        memory_budget: If specified, the approximate number of bytes of
+        postings to hold in memory. Once exceeded, postings are flushed to a
+        sorted run on disk, and all runs are merged on serialisation.
+        first_guid: Guid assigned to the first document. Delta segments start
+        after the largest guid of the index they are added to.
+        raw_postings: Write fixed width postings that can be used in place as
+        NumPy arrays, instead of compressed postings. See postings.py.
+        """
         self.dict_path = dict_path
         self.postings_path = postings_path
         self.m_file = {
@@ -31,6 +56,16 @@ class IndexBuilder(object):
         }
         self.m_indices = dict()
 
+        # Stores a monotonically increasing guid for documents added to the
+        # index.
+        self.__guid = first_guid
+        self.m_file[indexfields.FIRST_GUID] = first_guid
+
+        self.memory_budget = memory_budget
+        self.raw_postings = raw_postings
+        self.__postings_in_memory = 0
+        self.__runs = []
+
     def get_guid(self, doc_id):
         """Return the guid for given doc_id.
 
@@ -39,7 +74,7 @@ class IndexBuilder(object):
         """
         all_docs = self.m_file[indexfields.DOC_GUID_MAP]
         if doc_id not in all_docs:
-            guid = IndexBuilder.next_guid()
+            guid = self.next_guid()
             all_docs[doc_id] = guid
             self.m_file[indexfields.GUID_DOC_MAP][guid] = doc_id
         return all_docs[doc_id]
@@ -48,16 +83,58 @@ class IndexBuilder(object):
         """Adds a simple field-value pair for a doc_id."""
         guid = self.get_guid(doc_id)
 
-        if guid not in self.m_file[indexfields.FIELDS]:
-            self.m_file[indexfields.FIELDS][guid] = {}
+        if field not in self.m_file[indexfields.FIELDS]:
+            self.m_file[indexfields.FIELDS][field] = {}
 
-        self.m_file[indexfields.FIELDS][guid][field] = val
+        self.m_file[indexfields.FIELDS][field][guid] = val
 
     def add_tokens_for_zone(self, tokens, doc_id, key):
         """
         Adds a list of tokens corresponding to a doc_id to the zone specified
         by 'key'.
         """
+        tf = IndexBuilder.term_frequencies(tokens)
+        self.add_term_frequencies_for_zone(tf, doc_id, key)
+
+    def add_term_frequencies_for_zone(self, tf, doc_id, key):
+        """
+        Adds a dictionary of term: term_frequency corresponding to a doc_id to
+        the zone specified by 'key'.
+
+        This is used when the term frequencies were already computed elsewhere
+        (e.g. by a worker process.)
+        """
+        guid = self.get_guid(doc_id)
+
+        # Record the length of the document's full log-tf weighted vector, so
+        # that VSM features do not have to compute it at query time. fsum is
+        # exact, so the norm does not depend on the order tf iterates in
+        # (which differs for term frequencies sent back by worker processes.)
+        self.add_document_norm_for_zone(math.sqrt(math.fsum(
+            (1 + math.log(freq, 10)) ** 2 for freq in tf.itervalues())),
+            doc_id, key)
+
+        # Finally, we iterate through each term seen in that document and
+        # build a list of (guid, term_frequency)-tuples.
+        dictionary = self.m_file[indexfields.ZONES][key][indexfields.INDEX_DICT]
+        for term in tf:
+            _tuple = (guid, tf[term])
+            if term in dictionary:
+                dictionary[term].append(_tuple)
+            else:
+                dictionary[term] = [_tuple]
+
+        self.__count_postings(len(tf))
+
+    def add_document_norm_for_zone(self, norm, doc_id, key):
+        """
+        Adds a doc_id to the zone specified by 'key', with the norm of its
+        vector in that zone.
+
+        Together with add_postings_for_zone, this is used to add documents
+        term by term (e.g. when merging segments), instead of document by
+        document.
+        """
         guid = self.get_guid(doc_id)
 
         # Create an index for the specified field (key) if it does not already
@@ -66,55 +143,166 @@ class IndexBuilder(object):
         if key not in indices:
             indices[key] = {
                 indexfields.INDEX_DOCS: set(),
-                indexfields.INDEX_DICT: dict()
+                indexfields.INDEX_DICT: dict(),
+                indexfields.INDEX_NORMS: dict(),
             }
-        docs = indices[key][indexfields.INDEX_DOCS]
-        dictionary = indices[key][indexfields.INDEX_DICT]
 
         # Within the index for the specified field (key), we add the document's
         # guid to the set of documents that occur in that index.
-        docs.add(guid)
+        indices[key][indexfields.INDEX_DOCS].add(guid)
+        indices[key][indexfields.INDEX_NORMS][guid] = norm
 
-        # Finally, we iterate through each token seen in that document and
-        # build a list of (guid, term_frequency)-tuples.
-        tf = self.__compute_term_frequencies(tokens)
-        for term in tf:
-            _tuple = (guid, tf[term])
-            if term in dictionary:
-                dictionary[term].append(_tuple)
-            else:
-                dictionary[term] = [_tuple]
+    def add_postings_for_zone(self, entries, key, term):
+        """
+        Adds (guid, term_frequency)-tuples of a term to the zone specified by
+        'key' (whose documents were added by add_document_norm_for_zone).
+        Guids are those of this builder, and must come after any guid already
+        added for the term.
+        """
+        dictionary = self.m_file[indexfields.ZONES][key][indexfields.INDEX_DICT]
+        dictionary.setdefault(term, []).extend(entries)
+        self.__count_postings(len(entries))
+
+    def __count_postings(self, count):
+        """
+        Counts postings added to memory, and flushes them to a run once they
+        exceed the memory budget.
+        """
+        self.__postings_in_memory += count
+        if self.memory_budget is not None and \
+                self.__postings_in_memory * self.POSTING_SIZE_ESTIMATE > \
+                self.memory_budget:
+            self.__flush_run()
 
     def serialize(self, pretty=False):
         """
-        Writes the in-memory index-dictioanry to a JSON file.
+        Writes the postings lists to the (binary) postings file and the
+        in-memory index-dictionary (without postings) to a JSON file.
+
+        Each term in the dictionary only records its document frequency,
+        inverse document frequency, its largest weight in a document (its
+        log-tf divided by the document's norm, which bounds what it can add
+        to a VSM score), and the byte offset and length of its postings list
+        in the postings file.
         """
         indices = self.m_file[indexfields.ZONES]
+        if self.__runs:
+            self.__flush_run()
+            terms = self.__merge_runs()
+        else:
+            terms = self.__in_memory_terms()
+
+        # We convert the document-set for each index to a sorted list so that
+        # it can be natively json serialised. Document norms are stored as a
+        # list aligned to guid (0 for documents not in the index.)
+        first_guid = self.m_file[indexfields.FIRST_GUID]
+        count = self.__guid - first_guid
         for key in indices:
-            # We convert the document-set for each index to a sorted list so
-            # that it can be natively json serialised.
             indices[key][indexfields.INDEX_DOCS] = \
                 sorted(indices[key][indexfields.INDEX_DOCS])
-
-            # Compute document frequency and inverse document frequency.
-            index = indices[key]
-            count = len(index[indexfields.INDEX_DOCS])
-            for dict_key in index[indexfields.INDEX_DICT]:
-                entries = index[indexfields.INDEX_DICT][dict_key]
+            norms = indices[key][indexfields.INDEX_NORMS]
+            indices[key][indexfields.INDEX_NORMS] = [
+                norms.get(guid, 0.0)
+                for guid in xrange(first_guid, first_guid + count)]
+
+        with open(self.postings_path, 'wb') as postings_file:
+            writer = postings.PostingsWriter(postings_file, self.raw_postings)
+
+            # Compute document frequency and inverse document frequency, and
+            # write out the postings list for each term.
+            for key, term, entries in terms:
+                index = indices[key]
+                doc_count = len(index[indexfields.INDEX_DOCS])
                 doc_freq = len(entries)
-                idf = math.log(float(count) / doc_freq, 10)
-                index[indexfields.INDEX_DICT][dict_key] = {
+                idf = math.log(float(doc_count) / doc_freq, 10)
+                norms = index[indexfields.INDEX_NORMS]
+                max_weight = max((1 + math.log(tf, 10)) /
+                                 norms[guid - first_guid]
+                                 for guid, tf in entries)
+
+                offset, length = writer.write(entries)
+
+                index[indexfields.INDEX_DICT][term] = {
                     indexfields.TOKEN_DOC_FREQ: doc_freq,
                     indexfields.TOKEN_IDF: idf,
-                    indexfields.TOKEN_ENTRIES: entries
+                    indexfields.TOKEN_MAX_WEIGHT: max_weight,
+                    indexfields.TOKEN_OFFSET: offset,
+                    indexfields.TOKEN_LENGTH: length,
                 }
 
+        for run_path in self.__runs:
+            os.remove(run_path)
+        self.__runs = []
+
+        # Store each field as a column aligned to guid. Guids are assigned
+        # contiguously, starting at first_guid.
+        fields = self.m_file[indexfields.FIELDS]
+        for field in fields:
+            fields[field] = fieldstore.encode_column(
+                fields[field], first_guid, count)
+
         with open(self.dict_path, 'w') as f:
-            json.dump(self.m_file, f)
+            json.dump(self.m_file, f, sort_keys=True)
+
+    def __in_memory_terms(self):
+        """
+        Yields (zone, term, postings)-tuples held in memory, sorted by zone
+        and term.
+        """
+        indices = self.m_file[indexfields.ZONES]
+        for key in sorted(indices):
+            dictionary = indices[key][indexfields.INDEX_DICT]
+            for term in sorted(dictionary):
+                yield key, term, dictionary[term]
+
+    def __flush_run(self):
+        """
+        Writes the postings held in memory to a sorted run on disk, and frees
+        them.
+
+        Each line of a run is a JSON encoded [zone, term, postings] list.
+        Lines are sorted by zone and then term.
+        """
+        run = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(self.postings_path), prefix='spimi-',
+            suffix='.run', delete=False)
+        with run:
+            for entry in self.__in_memory_terms():
+                run.write(json.dumps(entry))
+                run.write('\n')
+        self.__runs.append(run.name)
+
+        for index in self.m_file[indexfields.ZONES].itervalues():
+            index[indexfields.INDEX_DICT] = dict()
+        self.__postings_in_memory = 0
+
+    def __merge_runs(self):
+        """
+        Performs a k-way merge of all runs on disk.
 
-    def __compute_term_frequencies(self, tokens):
+        Yields (zone, term, postings)-tuples sorted by zone and term, where
+        the postings of a term are concatenated across all runs.
         """
-        Computes document frequencies.
+        def read_run(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    yield tuple(json.loads(line))
+
+        # Runs are written in increasing guid order, and ties on (zone, term)
+        # are broken by the postings themselves, so the postings of a term
+        # come out in increasing guid order as well.
+        merged = heapq.merge(*[read_run(path) for path in self.__runs])
+        for (key, term), group in itertools.groupby(
+                merged, key=lambda entry: entry[:2]):
+            entries = []
+            for _, _, run_entries in group:
+                entries.extend(run_entries)
+            yield key, term, entries
+
+    @staticmethod
+    def term_frequencies(tokens):
+        """
+        Computes term frequencies.
         """
         tf = dict()
         for w in tokens:
@@ -124,13 +312,12 @@ class IndexBuilder(object):
                 tf[w] = 1
         return tf
 
-    @staticmethod
-    def next_guid():
+    def next_guid(self):
         """
         Enforces montonicity of guid.
         """
-        val = IndexBuilder.guid
-        IndexBuilder.guid += 1
+        val = self.__guid
+        self.__guid += 1
         return val
 
 
@@ -147,6 +334,11 @@ class DirectoryProcessor(object):
         patentfields.ABSTRACT,
     ]
 
+    # Fields (from FIELDS) that hold counts, and are stored as integers.
+    COUNT_FIELDS = [
+        patentfields.CITED_BY_COUNT,
+    ]
+
     FIELDS = [
         # Citations
         patentfields.CITED_BY_COUNT,
@@ -168,12 +360,19 @@ class DirectoryProcessor(object):
         patentfields.UPC_CLASS,
     ]
 
-    def __init__(self, doc_dir, indexer, free_text_tokenizer=None):
+    # Number of files handed to a worker process at a time.
+    SLICE_SIZE = 64
+
+    def __init__(self, doc_dir, indexer, free_text_tokenizer=None, workers=1,
+                 use_pipeline=False, queue_size=pipeline.QUEUE_SIZE):
         """
         doc_dir: Directory containing XML files to process.
         indexer: In-memory index.
         free_text_tokenizer: Can be specified if a custom tokenizer is
         preferred.
+        workers: Number of processes used to parse and tokenize documents.
+        use_pipeline: Read files in a thread of their own, ahead of the
+        workers, through queues of queue_size slices (see pipeline.py.)
         """
         # Normalize with trailing slash for consistency.
         if doc_dir[-1] != '/':
@@ -182,59 +381,511 @@ class DirectoryProcessor(object):
         self.__doc_dir = doc_dir
         self.__indexer = indexer
         self.free_text_tokenizer = free_text_tokenizer or free_text
+        self.workers = workers
+        self.use_pipeline = use_pipeline
+        self.queue_size = queue_size
+        self.pipeline_stats = None
 
     def run(self):
         """
         Begins processing all XML files in the specified directory.
         """
+        filenames = []
         for filename in os.listdir(self.__doc_dir):
             doc_id, extension = os.path.splitext(filename)
             if extension.lower() != '.xml':
                 print 'Ignoring file: {} Reason: Not an XML document.'\
                       .format(filename)
                 continue
+            filenames.append(filename)
+
+        if self.use_pipeline:
+            parsed = self.__parse_pipeline(filenames)
+        elif self.workers > 1:
+            parsed = self.__parse_parallel(filenames)
+        else:
+            parsed = (self.parse_patent(f) for f in filenames)
 
-            full_path = self.__doc_dir + filename
-            patent_info = utils.xml_file_to_dict(full_path)
-            self.__process_patent(doc_id, patent_info)
+        profile = profiling.current()
+        for doc_id, zones, fields in parsed:
+            with profile.timer('insert'):
+                self.__add_patent(doc_id, zones, fields)
 
-        self.__indexer.serialize()
+        with profile.timer('serialize'):
+            self.__indexer.serialize()
 
-    def __process_patent(self, doc_id, info):
+        if self.pipeline_stats:
+            print >> sys.stderr, self.pipeline_stats.report()
+
+    def parse_patent(self, filename, xml=None):
         """
-        Processes a single patent XML.
+        Parses and tokenizes a single patent XML, given its contents (xml) if
+        they were already read.
+
+        Returns a (doc_id, {zone: {term: tf}}, {field: value})-tuple, ready to
+        be added to the index.
         """
+        doc_id, _ = os.path.splitext(filename)
+        profile = profiling.current()
+        profile.count('documents')
+        with profile.timer('parse xml'):
+            if xml is None:
+                info = utils.xml_file_to_dict(self.__doc_dir + filename)
+            else:
+                info = utils.xml_string_to_dict(xml)
+
         # Process free text.
+        zones = {}
         for zone in self.ZONES:
             text = info.get(zone)
             if text:
                 tokens = self.free_text_tokenizer(text)
-                self.__indexer.add_tokens_for_zone(tokens, doc_id, zone)
+                zones[zone] = IndexBuilder.term_frequencies(tokens)
 
         # Process fields.
+        fields = {}
         for field in self.FIELDS:
             val = info.get(field)
             if val:
-                self.__indexer.add_value_for_field(val, doc_id, field)
+                if field in self.COUNT_FIELDS:
+                    try:
+                        val = int(val)
+                    except ValueError:
+                        pass
+                fields[field] = val
+
+        return doc_id, zones, fields
+
+    def __parse_parallel(self, filenames):
+        """
+        Parses slices of filenames in worker processes.
+
+        Yields parsed patents in the same order as filenames, so that guids
+        (and hence the index) are identical to those of a serial run.
+        """
+        slices = [filenames[i:i + self.SLICE_SIZE]
+                  for i in xrange(0, len(filenames), self.SLICE_SIZE)]
+        pool = multiprocessing.Pool(self.workers, _init_worker, (self,))
+        try:
+            for parsed_slice, profile, vocabulary in pool.imap(_parse_slice,
+                                                               slices):
+                if profile:
+                    profiling.current().merge(profile)
+                if vocabulary:
+                    tokenizer.add_to_vocabulary(vocabulary)
+                for parsed in parsed_slice:
+                    yield parsed
+        finally:
+            pool.terminate()
+
+    def __parse_pipeline(self, filenames):
+        """
+        Reads slices of filenames in a thread, while worker processes parse
+        the slices already read, so that slow reads (e.g. from a network
+        filesystem) do not stall tokenizing, nor tokenizing reads.
+
+        Yields parsed patents in the same order as filenames, like
+        __parse_parallel. The throughput of each stage is kept in
+        pipeline_stats.
+        """
+        slices = [filenames[i:i + self.SLICE_SIZE]
+                  for i in xrange(0, len(filenames), self.SLICE_SIZE)]
+        self.pipeline_stats = pipeline.PipelineStats('documents')
+        _init_worker(self)
+        for parsed_slice, profile, vocabulary in pipeline.run(
+                slices, self.__read_slice, _parse_contents, self.workers,
+                self.queue_size, self.pipeline_stats,
+                lambda result: len(result[0])):
+            if profile:
+                profiling.current().merge(profile)
+            if vocabulary:
+                tokenizer.add_to_vocabulary(vocabulary)
+            for parsed in parsed_slice:
+                yield parsed
+
+    def __read_slice(self, filenames):
+        """Returns (filename, contents) of each file of a slice."""
+        contents = []
+        for filename in filenames:
+            with open(self.__doc_dir + filename, 'rb') as f:
+                contents.append((filename, f.read()))
+        return contents
+
+    def __add_patent(self, doc_id, zones, fields):
+        """
+        Adds a parsed patent to the index.
+        """
+        for zone in self.ZONES:
+            if zone in zones:
+                self.__indexer.add_term_frequencies_for_zone(
+                    zones[zone], doc_id, zone)
+
+        for field in self.FIELDS:
+            if field in fields:
+                self.__indexer.add_value_for_field(
+                    fields[field], doc_id, field)
+
+
+# The DirectoryProcessor used by a worker process. It is inherited from the
+# parent process on fork, so custom tokenizers do not need to be picklable.
+_worker_processor = None
+
+
+def _init_worker(processor):
+    global _worker_processor
+    _worker_processor = processor
+
+
+def _parse_slice(filenames):
+    """
+    Parses a slice of the corpus in a worker process.
+
+    Returns the parsed patents, the profile of the slice if profiling, and
+    the words stemmed if recording the vocabulary (to be merged into the
+    parent's.)
+    """
+    profile = profiling.start() if profiling.enabled() else None
+    tokenizer.take_vocabulary()
+    parsed = [_worker_processor.parse_patent(f) for f in filenames]
+    return parsed, profile and profile.to_dict(), tokenizer.take_vocabulary()
+
+
+def _parse_contents(contents):
+    """
+    Like _parse_slice, given the (filename, contents) of each file of the
+    slice.
+    """
+    profile = profiling.start() if profiling.enabled() else None
+    tokenizer.take_vocabulary()
+    parsed = [_worker_processor.parse_patent(f, xml) for f, xml in contents]
+    return parsed, profile and profile.to_dict(), tokenizer.take_vocabulary()
+
+
+def update_index(doc_dir, dict_path, postings_path, memory_budget=None,
+                 workers=1, raw_postings=False, free_text_tokenizer=None,
+                 use_pipeline=False, queue_size=pipeline.QUEUE_SIZE):
+    """
+    Indexes the documents in doc_dir as a new delta segment of an existing
+    index.
+
+    Documents that already exist in the index are replaced: their old guids
+    are added to the deletion list in the segment manifest.
+
+    The manifest is locked while the segment is written (see
+    manifest_lock), so an update waits for a merge to commit, or the merge
+    for the update.
+    """
+    with manifest_lock(dict_path):
+        compound_index = compoundindex.load(dict_path, postings_path)
+        manifest = compoundindex.read_manifest(dict_path)
+
+        # Merges remove segments from the manifest, so numbers may be free
+        # again before the last one.
+        number = len(manifest[indexfields.SEGMENTS]) + 1
+        while os.path.exists('{}.{}'.format(dict_path, number)):
+            number += 1
+        segment_dict = '{}.{}'.format(dict_path, number)
+        segment_postings = '{}.{}'.format(postings_path, number)
+
+        ib = IndexBuilder(segment_dict, segment_postings, memory_budget,
+                          first_guid=compound_index.max_guid() + 1,
+                          raw_postings=raw_postings)
+        dp = DirectoryProcessor(doc_dir, ib, free_text_tokenizer, workers,
+                                use_pipeline, queue_size)
+        dp.run()
+
+        deleted = set(manifest[indexfields.DELETED])
+        for doc_id in ib.m_file[indexfields.DOC_GUID_MAP]:
+            guid = compound_index.guid_for_document_name(doc_id)
+            if guid is not None:
+                deleted.add(guid)
+        compound_index.close()
+
+        manifest[indexfields.SEGMENTS].append({
+            indexfields.SEGMENT_DICT: os.path.basename(segment_dict),
+            indexfields.SEGMENT_POSTINGS: os.path.basename(segment_postings),
+        })
+        manifest[indexfields.DELETED] = sorted(deleted)
+        write_manifest(dict_path, manifest)
+
+
+def merge_segments(dict_path, postings_path, memory_budget=None,
+                   raw_postings=False):
+    """
+    Compacts an index and all of its delta segments into a single segment,
+    dropping deleted documents.
+
+    The postings of the live documents are read one term at a time, renumbered
+    (in guid order), and added to a new IndexBuilder, which spills them to
+    runs on disk beyond memory_budget as when indexing. The result is written
+    to new files, <dictionary>.gN and <postings>.gN (the Nth merge), and
+    committed by a single atomic write of the manifest, naming them as the
+    base segment. Until then, the index is unchanged: an interrupted merge
+    only leaves the new files behind, and the next merge overwrites them.
+
+    Only the commit holds the manifest lock, so searches and updates carry
+    on while the segments are merged. Segments added meanwhile are kept, and
+    the documents they replace are deleted from the merged segment. Searches
+    that already opened the old files are unaffected by their removal.
+    """
+    with merge_lock(dict_path):
+        with manifest_lock(dict_path):
+            manifest = compoundindex.read_manifest(dict_path)
+            if not manifest[indexfields.SEGMENTS] and \
+                    not manifest[indexfields.DELETED]:
+                return
+            compound_index = compoundindex.load(dict_path, postings_path)
+        try:
+            generation = manifest.get(indexfields.GENERATION, 0) + 1
+            merged_dict = '{}.g{}'.format(dict_path, generation)
+            merged_postings = '{}.g{}'.format(postings_path, generation)
+            guids = write_merged(compound_index, merged_dict, merged_postings,
+                                 memory_budget, raw_postings)
+            max_guid = compound_index.max_guid()
+        finally:
+            compound_index.close()
+        for path in [merged_dict, merged_postings]:
+            sync(path)
+
+        with manifest_lock(dict_path):
+            current = compoundindex.read_manifest(dict_path)
+            merged = set(entry[indexfields.SEGMENT_DICT]
+                         for entry in manifest[indexfields.SEGMENTS])
+            # Documents deleted by updates since the merge started are
+            # deleted from the merged segment too, under their new guids.
+            deleted = set()
+            for guid in current[indexfields.DELETED]:
+                if guid in guids:
+                    deleted.add(guids[guid])
+                elif guid > max_guid:
+                    deleted.add(guid)
+            write_manifest(dict_path, {
+                indexfields.BASE: {
+                    indexfields.SEGMENT_DICT: os.path.basename(merged_dict),
+                    indexfields.SEGMENT_POSTINGS:
+                        os.path.basename(merged_postings),
+                },
+                indexfields.GENERATION: generation,
+                indexfields.SEGMENTS: [
+                    entry for entry in current[indexfields.SEGMENTS]
+                    if entry[indexfields.SEGMENT_DICT] not in merged],
+                indexfields.DELETED: sorted(deleted),
+            })
+
+            # The merged files are no longer read by new searches.
+            for old_dict, old_postings in compoundindex.segment_paths(
+                    dict_path, postings_path, manifest):
+                for path in [old_dict, old_postings,
+                             snapshot.snapshot_path(old_dict)]:
+                    if os.path.exists(path):
+                        os.remove(path)
+
+
+def write_merged(compound_index, dict_path, postings_path,
+                 memory_budget=None, raw_postings=False):
+    """
+    Writes the live documents of compound_index as a single segment, in guid
+    order. Returns a dict of old guid: new guid.
+    """
+    live = set()
+    for zone in compound_index.indices():
+        live.update(compound_index.documents_in_index(zone))
+    for field in DirectoryProcessor.FIELDS:
+        live.update(guid for guid, _ in compound_index.value_for_field(field))
+
+    ib = IndexBuilder(dict_path, postings_path, memory_budget,
+                      raw_postings=raw_postings)
+    names = {}
+    guids = {}
+    for guid in sorted(live):
+        names[guid] = compound_index.document_name_for_guid(guid)
+        guids[guid] = ib.get_guid(names[guid])
+
+    for zone in sorted(compound_index.indices()):
+        docs = sorted(compound_index.documents_in_index(zone))
+        norms = compound_index.document_norms(zone, docs).tolist()
+        for guid, norm in zip(docs, norms):
+            ib.add_document_norm_for_zone(norm, names[guid], zone)
+        for term in sorted(compound_index.terms_in_index(zone)):
+            entries = [(guids[guid], tf) for guid, tf
+                       in compound_index.postings_list(zone, term)]
+            if entries:
+                ib.add_postings_for_zone(entries, zone, term)
+
+    for field in DirectoryProcessor.FIELDS:
+        for guid, val in compound_index.value_for_field(field):
+            ib.add_value_for_field(val, names[guid], field)
+    ib.serialize()
+    return guids
+
+
+@contextlib.contextmanager
+def locked(path):
+    """
+    Holds an exclusive lock on the file at path (created if needed) for the
+    duration of the with block.
+    """
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def manifest_lock(dict_path):
+    """Locks the segment manifest of an index, for reading and replacing."""
+    return locked(compoundindex.manifest_path(dict_path) + '.lock')
+
+
+def merge_lock(dict_path):
+    """Locks an index for a merge, so that only one runs at a time."""
+    return locked(dict_path + '.merge.lock')
+
+
+def write_manifest(dict_path, manifest):
+    """
+    Atomically replaces the segment manifest belonging to a dictionary file.
+    """
+    path = compoundindex.manifest_path(dict_path)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, sort_keys=True)
+    sync(path + '.tmp')
+    os.rename(path + '.tmp', path)
+
+
+def sync(path):
+    """Flushes a file to disk, so that it is complete before it is used."""
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+# Tokenizers for free text, by their --tokenizer name. search.py always uses
+# free_text; fast_free_text splits sentences differently in rare cases (see
+# tokenbench.py.)
+TOKENIZERS = {
+    'nltk': free_text,
+    'fast': tokenizer.fast_free_text,
+}
 
 
 def main(args):
-    args.index = os.path.abspath(args.index)
+    if args.index:
+        args.index = os.path.abspath(args.index)
     args.dictionary = os.path.abspath(args.dictionary)
     args.postings = os.path.abspath(args.postings)
 
-    ib = IndexBuilder(args.dictionary, args.postings)
-    dp = DirectoryProcessor(args.index, ib)
-    dp.run()
+    memory_budget = None
+    if args.memory_budget is not None:
+        memory_budget = int(args.memory_budget * 1024 * 1024)
+
+    if args.stem_table:
+        tokenizer.record_vocabulary()
+
+    if args.merge:
+        if args.background:
+            pid = os.fork()
+            if pid:
+                print >> sys.stderr, 'Merging in process {}'.format(pid)
+                return
+            os.setsid()
+        merge_segments(args.dictionary, args.postings, memory_budget,
+                       args.raw_postings)
+    elif args.update:
+        update_index(args.index, args.dictionary, args.postings,
+                     memory_budget, args.workers, args.raw_postings,
+                     TOKENIZERS[args.tokenizer], args.pipeline,
+                     args.queue_size)
+    else:
+        ib = IndexBuilder(args.dictionary, args.postings, memory_budget,
+                          raw_postings=args.raw_postings)
+        dp = DirectoryProcessor(args.index, ib, TOKENIZERS[args.tokenizer],
+                                args.workers, args.pipeline, args.queue_size)
+        dp.run()
+        # The new build replaces any segments (or merged files) of an index
+        # built before at the same path.
+        with manifest_lock(args.dictionary):
+            if os.path.exists(compoundindex.manifest_path(args.dictionary)):
+                os.remove(compoundindex.manifest_path(args.dictionary))
+
+    if args.stem_table and not args.merge:
+        with profiling.current().timer('stem table'):
+            tokenizer.write_stem_table(
+                tokenizer.stem_table_path(args.dictionary),
+                tokenizer.take_vocabulary())
+
+    if args.snapshot:
+        with profiling.current().timer('snapshot'):
+            snapshot.write_snapshots(args.dictionary)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Patsnap assignment - Index')
-    parser.add_argument('-i', '--index', required=True,
+    parser.add_argument('-i', '--index',
                         help='directory of documents.')
     parser.add_argument('-d', '--dictionary', required=True,
                         help='dictionary file.')
     parser.add_argument('-p', '--postings', required=True,
                         help='postings file.')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of processes used to parse and tokenize '
+                             'documents.')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='read documents in a thread of their own, ahead '
+                             'of the worker processes, and print the '
+                             'throughput of reading, parsing and inserting '
+                             '(and how full the queues between them were) to '
+                             'stderr.')
+    parser.add_argument('--queue-size', type=int, default=pipeline.QUEUE_SIZE,
+                        help='with --pipeline, number of slices of {} '
+                             'documents each queue holds (default: '
+                             '%(default)s.)'.format(
+                                 DirectoryProcessor.SLICE_SIZE))
+    parser.add_argument('--tokenizer', choices=sorted(TOKENIZERS),
+                        default='nltk',
+                        help='tokenizer for free text: NLTK (the default), or '
+                             'a faster, single pass tokenizer that gives the '
+                             'same tokens but for rare sentence boundaries.')
+    parser.add_argument('-m', '--memory-budget', type=float, default=None,
+                        help='approximate memory (in MiB) to use for postings '
+                             'before spilling them to disk.')
+    parser.add_argument('--raw-postings', action='store_true',
+                        help='write uncompressed, fixed width postings that '
+                             'search can use without decoding.')
+    parser.add_argument('-u', '--update', action='store_true',
+                        help='add the documents as a new segment of the '
+                             'existing index, replacing documents that were '
+                             'indexed before.')
+    parser.add_argument('--merge', action='store_true',
+                        help='compact the index and its segments into a '
+                             'single segment (no documents are read.) '
+                             'Searches and updates may run meanwhile.')
+    parser.add_argument('--background', action='store_true',
+                        help='with --merge, merge in a process of its own and '
+                             'return at once.')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='also write binary snapshots of the dictionary '
+                             'files, for faster loading by search.py.')
+    parser.add_argument('--stem-table', action='store_true',
+                        help='also write (or add to) a table of the stem of '
+                             'every word seen, which search.py --stem-table '
+                             'uses instead of stemming them again.')
+    parser.add_argument('--profile', nargs='?', const=profiling.TEXT,
+                        choices=profiling.FORMATS,
+                        help='print the time taken by each stage (XML '
+                             'parsing, tokenizing, stemming, inserting, '
+                             'serializing) to stderr, as a table, or as JSON '
+                             'with --profile json. Times of worker processes '
+                             'are added up.')
     args = parser.parse_args()
-    main(args)
+    if not args.merge and not args.index:
+        parser.error('argument -i/--index is required')
+    if args.background and not args.merge:
+        parser.error('argument --background requires --merge')
+    if args.profile:
+        profiling.start()
+    try:
+        main(args)
+    finally:
+        if args.profile:
+            print >> sys.stderr, profiling.stop().report(args.profile)
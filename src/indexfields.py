@@ -3,7 +3,20 @@ GUID_DOC_MAP = 'guid_doc'
 ZONES = 'zones'
 INDEX_DOCS = 'docs'
 INDEX_DICT = 'dictionary'
+INDEX_NORMS = 'norms'
 TOKEN_DOC_FREQ = 'df'
 TOKEN_IDF = 'idf'
-TOKEN_ENTRIES = 'entries'
+TOKEN_OFFSET = 'offset'
+TOKEN_LENGTH = 'length'
+TOKEN_MAX_WEIGHT = 'max_weight'
 FIELDS = 'fields'
+SEGMENTS = 'segments'
+SEGMENT_DICT = 'dictionary'
+SEGMENT_POSTINGS = 'postings'
+DELETED = 'deleted'
+BASE = 'base'
+GENERATION = 'generation'
+FIRST_GUID = 'first_guid'
+COLUMN_TYPE = 'type'
+COLUMN_VALUES = 'values'
+COLUMN_CODES = 'codes'
@@ -1,6 +1,5 @@
 import argparse
 import compoundindex
-import json
 import os
 import scipy.optimize
 import search
@@ -47,7 +46,7 @@ def learn(compound_index):
     t = training_data()
 
     # Use current weights so we don't start computing from scratch each time.
-    starting_coeffs = [w for f, w in search.Search.FEATURES]
+    starting_coeffs = [w for _, w in search.Search.enabled_features()]
     for qname, q in t.iteritems():
         s = search.Search(q['query'], compound_index)
         q['search'] = s.execute()
@@ -151,9 +150,8 @@ def learn(compound_index):
 
 def main(args):
     dictionary_file = os.path.abspath(args.dictionary)
-    with open(dictionary_file, 'r') as f:
-        json_obj = json.load(f)
-    compound_index = compoundindex.CompoundIndex(json_obj)
+    postings_file = os.path.abspath(args.postings)
+    compound_index = compoundindex.load(dictionary_file, postings_file)
     learn(compound_index)
 
 
@@ -161,5 +159,11 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Patsnap assignment - Learn')
     parser.add_argument('-d', '--dictionary', help='dictionary file.',
                         default='run/dictionary.txt')
+    parser.add_argument('-p', '--postings', help='postings file.',
+                        default='run/postings.txt')
+    parser.add_argument('--index-norms', action='store_true',
+                        help='train the weights for search.py --index-norms.')
     args = parser.parse_args()
+    if args.index_norms:
+        search.use_index_norms()
     main(args)
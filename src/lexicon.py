@@ -0,0 +1,308 @@
+import argparse
+import json
+import mmap
+import numpy
+import os
+import snapshot
+import struct
+import zlib
+
+# A lexicon bundles the word lists search reads while answering queries, so
+# that they are compiled once (by running this module after indexing) rather
+# than loaded or recomputed by every search process:
+#
+#   stopwords: NLTK's English stopwords (see utils.without_stopwords.)
+#   stems: the stem table written by index.py --stem-table, if any.
+#   thesaurus: the thesaurus, with every synonym already stemmed (see
+#     features.vsm.expansion.)
+#   ipc_sections: the stems of the IPC section labels (see features.ipc.)
+#
+# It is laid out as a snapshot (see snapshot.py), and memory-mapped. Each word
+# list is a hash table that is probed in place: the words, separated by
+# SEPARATOR, with the offset of each (and of the end of the last), a list of
+# slots holding the position of a word (or -1), addressed by the CRC-32 of
+# the word with linear probing, and optionally a list of strings for each
+# word, stored the same way as the words with the position of the first
+# string of each word.
+MAGIC = 'LEX1'
+SEPARATOR = snapshot.SEPARATOR
+
+# Lexicons of any other version are rejected; bump it whenever what is
+# stored changes.
+VERSION = 1
+
+# Header keys.
+VERSION_KEY = 'version'
+SOURCE = 'source'
+
+STOPWORDS = 'stopwords'
+STEMS = 'stems'
+THESAURUS = 'thesaurus'
+IPC_SECTIONS = 'ipc_sections'
+
+EMPTY_SLOT = -1
+
+# How the int64 offsets of a string (and of the next), the int32 slots, and
+# the int32 positions of the first string of a word (and of the next) are
+# read.
+OFFSETS = struct.Struct('<2q')
+SLOT = struct.Struct('<i')
+STARTS = struct.Struct('<2i')
+
+
+def lexicon_path(dictionary_path):
+    """Returns the path of the lexicon belonging to a dictionary file."""
+    return dictionary_path + '.lexicon'
+
+
+def _encode(word):
+    return word.encode('utf-8') if isinstance(word, unicode) else word
+
+
+def _slot(word, mask):
+    return (zlib.crc32(word) & 0xffffffff) & mask
+
+
+def _string_sections(name, strings):
+    offsets = numpy.zeros(len(strings) + 1, numpy.int64)
+    numpy.cumsum([len(s) + len(SEPARATOR) for s in strings],
+                 out=offsets[1:])
+    return [(name, SEPARATOR.join(strings)),
+            (name + ':offsets', offsets)]
+
+
+def _table_sections(name, table):
+    """
+    Returns the sections of a word list, given a dict of word: list of
+    strings (or None for no strings.)
+    """
+    words = sorted(_encode(word) for word in table)
+    size = 1
+    while size < 2 * len(words):
+        size *= 2
+    slots = numpy.empty(size, numpy.int32)
+    slots.fill(EMPTY_SLOT)
+    for i, word in enumerate(words):
+        slot = _slot(word, size - 1)
+        while slots[slot] != EMPTY_SLOT:
+            slot = (slot + 1) & (size - 1)
+        slots[slot] = i
+
+    sections = _string_sections(name + ':words', words)
+    sections.append((name + ':slots', slots))
+    encoded = dict((_encode(word), strings)
+                   for word, strings in table.iteritems())
+    if any(strings is not None for strings in encoded.itervalues()):
+        values = []
+        starts = numpy.zeros(len(words) + 1, numpy.int32)
+        for i, word in enumerate(words):
+            values.extend(_encode(s) for s in encoded[word] or [])
+            starts[i + 1] = len(values)
+        sections.extend(_string_sections(name + ':values', values))
+        sections.append((name + ':starts', starts))
+    return sections
+
+
+def write_lexicon(path, stopwords, stems, thesaurus, ipc_sections,
+                  source=None):
+    """
+    Writes a lexicon.
+
+    stopwords: Iterable of stopwords.
+    stems: Dict of word: stem.
+    thesaurus: Dict of word: list of the stems of its synonyms.
+    ipc_sections: Dict of IPC section: list of the stems of its label.
+    source: Recorded in the header (e.g. the dictionary file.)
+    """
+    sections = []
+    sections.extend(_table_sections(
+        STOPWORDS, dict((word, None) for word in stopwords)))
+    sections.extend(_table_sections(
+        STEMS, dict((word, [stem]) for word, stem in stems.iteritems())))
+    sections.extend(_table_sections(THESAURUS, thesaurus))
+    sections.append((IPC_SECTIONS, json.dumps(ipc_sections, sort_keys=True)))
+    snapshot.write_sections(path, MAGIC, {
+        VERSION_KEY: VERSION,
+        SOURCE: source,
+    }, sections)
+
+
+class WordTable(object):
+    """
+    A word list of a lexicon, read in place (with struct, which is much
+    faster than NumPy at reading single numbers.)
+    """
+    def __init__(self, lexicon, name):
+        self.__buf = lexicon.buf
+        self.__words = lexicon.strings(name + ':words')
+        self.__slots = lexicon.start(name + ':slots')
+        self.__mask = lexicon.count(name + ':slots') - 1
+        self.__count = lexicon.count(name + ':words:offsets') - 1
+        if lexicon.has_section(name + ':starts'):
+            self.__values = lexicon.strings(name + ':values')
+            self.__starts = lexicon.start(name + ':starts')
+        else:
+            self.__starts = None
+
+    def __string(self, strings, i):
+        """Returns the i-th string of a section of strings."""
+        start, offsets = strings
+        begin, end = OFFSETS.unpack_from(self.__buf, offsets + 8 * i)
+        return self.__buf[start + begin:start + end - len(SEPARATOR)]
+
+    def __find(self, word):
+        """Returns the position of word, or None."""
+        word = _encode(word)
+        mask = self.__mask
+        slot = _slot(word, mask)
+        while True:
+            i, = SLOT.unpack_from(self.__buf, self.__slots + 4 * slot)
+            if i == EMPTY_SLOT:
+                return None
+            if self.__string(self.__words, i) == word:
+                return i
+            slot = (slot + 1) & mask
+
+    def __len__(self):
+        return self.__count
+
+    def __contains__(self, word):
+        return self.__find(word) is not None
+
+    def values(self, word):
+        """Returns the strings stored for word (empty if there are none.)"""
+        i = self.__find(word)
+        if i is None or self.__starts is None:
+            return []
+        first, last = STARTS.unpack_from(self.__buf, self.__starts + 4 * i)
+        return [self.__string(self.__values, j).decode('utf-8')
+                for j in xrange(first, last)]
+
+    def get(self, word, default=None):
+        """Returns the first string stored for word, or default."""
+        values = self.values(word)
+        return values[0] if values else default
+
+
+class Lexicon(object):
+    def __init__(self, path):
+        result = snapshot.read_header(path, MAGIC)
+        if result is None:
+            raise ValueError('{} is not a lexicon.'.format(path))
+        header, self.__data_start = result
+        if header.get(VERSION_KEY) != VERSION:
+            raise ValueError('{} is a version {} lexicon; version {} is '
+                             'needed. Rebuild it with lexicon.py.'.format(
+                                 path, header.get(VERSION_KEY), VERSION))
+        self.__sections = header[snapshot.SECTIONS]
+        self.__file = open(path, 'rb')
+        self.buf = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.stopwords = WordTable(self, STOPWORDS)
+        self.stems = WordTable(self, STEMS)
+        self.thesaurus = WordTable(self, THESAURUS)
+        self.ipc_sections = json.loads(self.section(IPC_SECTIONS))
+
+    def has_section(self, name):
+        return name in self.__sections
+
+    def section(self, name):
+        return snapshot.read_section(self.buf, self.__data_start,
+                                     self.__sections[name])
+
+    def start(self, name):
+        """Returns the position of a section in buf."""
+        return self.__data_start + self.__sections[name][0]
+
+    def count(self, name):
+        """Returns the number of entries (or bytes) of a section."""
+        return self.__sections[name][2]
+
+    def strings(self, name):
+        """Returns (position of the strings, position of their offsets) in
+        buf, for a section of strings."""
+        return self.start(name), self.start(name + ':offsets')
+
+    def close(self):
+        self.buf.close()
+        self.__file.close()
+
+
+# The lexicon used by the current process, if one was loaded.
+__current = None
+
+
+def load(path):
+    """
+    Opens the lexicon at path and makes it the current one, returning it.
+    Does nothing (and returns None) if there is no lexicon at path.
+    """
+    global __current
+    if not os.path.exists(path):
+        return None
+    __current = Lexicon(path)
+    return __current
+
+
+def current():
+    """Returns the lexicon loaded by load, or None."""
+    return __current
+
+
+def unload():
+    """Closes the current lexicon, if any."""
+    global __current
+    if __current is not None:
+        __current.close()
+        __current = None
+
+
+def build(dictionary_path):
+    """
+    Compiles the lexicon belonging to a dictionary file from NLTK's
+    stopwords, the stem table (if any), thesaurus.json and the IPC section
+    labels, returning its path.
+    """
+    # Imported here, as they read this module.
+    import tokenizer
+    import utils
+    from features import ipc
+    from thesaurus import Thesaurus
+
+    stems = {}
+    table_path = tokenizer.stem_table_path(dictionary_path)
+    if os.path.exists(table_path):
+        with open(table_path, 'r') as f:
+            stems = json.load(f)
+
+    thesaurus = {}
+    for word, synonyms in Thesaurus().iteritems():
+        stemmed = [tokenizer.free_text(synonym) for synonym in synonyms]
+        # A synonym is looked up by the stem of its first word.
+        thesaurus[word] = [tokens[0] for tokens in stemmed if tokens]
+
+    ipc_sections = dict(
+        (section, tokenizer.free_text(label))
+        for section, label in ipc.IPC_SECTION_LABELS.iteritems())
+
+    path = lexicon_path(dictionary_path)
+    write_lexicon(path, utils.english_stopwords(), stems, thesaurus,
+                  ipc_sections, source=os.path.basename(dictionary_path))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compiles the stopwords, stem table, thesaurus and IPC '
+                    'labels used at query time into a lexicon, for search.py '
+                    '--lexicon.')
+    parser.add_argument(
+        '-d', '--dictionary', default='dictionary.txt',
+        help='Dictionary file of the index.')
+    args = parser.parse_args()
+
+    print 'Wrote {}'.format(build(os.path.abspath(args.dictionary)))
+
+
+if __name__ == '__main__':
+    main()
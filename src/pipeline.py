@@ -0,0 +1,212 @@
+import multiprocessing
+import Queue
+import threading
+import time
+import traceback
+
+# A pipeline runs three stages at once, connected by bounded queues:
+#
+#   reader: a thread calling read(batch) for each batch, in order (I/O, which
+#     releases the GIL.)
+#   workers: processes calling process() on what was read (CPU-bound work.)
+#   writer: the caller, which receives process()'s results in batch order
+#     (so the result does not depend on the number of workers.)
+#
+# When the writer or the workers fall behind, the queues fill up and the
+# stages before them wait (backpressure). The writer must take results in
+# order, so the reader also waits while queue_size + workers batches have
+# been read but not yet written: a slow batch stops the reader, rather than
+# letting the batches after it pile up in the writer. So at most
+# queue_size + workers batches are in memory at once, however large the
+# input.
+
+# Number of batches each queue holds.
+QUEUE_SIZE = 4
+
+# How often (in seconds) the writer checks that the reader and the workers
+# are still alive while it waits.
+POLL_INTERVAL = 1.0
+
+READ = 'read'
+PROCESS = 'process'
+WRITE = 'write'
+STAGES = [READ, PROCESS, WRITE]
+
+READ_QUEUE = 'read'
+RESULT_QUEUE = 'result'
+QUEUES = [READ_QUEUE, RESULT_QUEUE]
+
+
+class PipelineStats(object):
+    """
+    Throughput of each stage of a pipeline (the items it handled, the time it
+    spent working and the time it spent waiting on a queue), and the depths
+    of the queues, sampled whenever the writer receives a batch.
+
+    Times of the workers are added up.
+    """
+    def __init__(self, unit='items'):
+        self.unit = unit
+        self.items = dict((stage, 0) for stage in STAGES)
+        self.busy = dict((stage, 0.0) for stage in STAGES)
+        self.waiting = dict((stage, 0.0) for stage in STAGES)
+        self.depths = dict((queue, []) for queue in QUEUES)
+        self.queue_size = QUEUE_SIZE
+        self.elapsed = 0.0
+        self.__lock = threading.Lock()
+
+    def add(self, stage, items, busy, waiting):
+        with self.__lock:
+            self.items[stage] += items
+            self.busy[stage] += busy
+            self.waiting[stage] += waiting
+
+    def sample(self, queue, depth):
+        self.depths[queue].append(depth)
+
+    def report(self):
+        lines = ['Pipeline: {} {} in {:.2f}s'.format(
+                     self.items[WRITE], self.unit, self.elapsed),
+                 '{:<10} {:>10} {:>10} {:>10} {:>12}'.format(
+                     'stage', self.unit, 'busy (s)', 'wait (s)',
+                     self.unit + '/s')]
+        for stage in STAGES:
+            rate = self.items[stage] / self.busy[stage] \
+                if self.busy[stage] else 0.0
+            lines.append('{:<10} {:>10} {:>10.2f} {:>10.2f} {:>12.1f}'.format(
+                stage, self.items[stage], self.busy[stage],
+                self.waiting[stage], rate))
+        lines.append('{:<10} {:>10} {:>10} {:>10}'.format(
+            'queue', 'mean depth', 'max depth', 'size'))
+        for queue in QUEUES:
+            depths = self.depths[queue]
+            if not depths:
+                continue
+            lines.append('{:<10} {:>10.1f} {:>10} {:>10}'.format(
+                queue, float(sum(depths)) / len(depths), max(depths),
+                self.queue_size))
+        return '\n'.join(lines)
+
+
+def _depth(queue):
+    try:
+        return queue.qsize()
+    except NotImplementedError:
+        # Not available on every platform (e.g. OS X.)
+        return None
+
+
+def _read(batches, read, tasks, workers, window, stats, errors):
+    """
+    Runs in the reader thread. window is a semaphore with a slot for each
+    batch that may be read ahead of the writer.
+    """
+    try:
+        for i, batch in enumerate(batches):
+            wait_start = time.time()
+            window.acquire()
+            start = time.time()
+            data = read(batch)
+            read_done = time.time()
+            tasks.put((i, data))
+            stats.add(READ, len(batch), read_done - start,
+                      start - wait_start + time.time() - read_done)
+    except Exception:
+        errors.append(traceback.format_exc())
+    finally:
+        for _ in xrange(workers):
+            tasks.put(None)
+
+
+def _work(process, tasks, results):
+    """Runs in a worker process."""
+    while True:
+        start = time.time()
+        task = tasks.get()
+        if task is None:
+            return
+        i, data = task
+        got = time.time()
+        try:
+            result = process(data)
+            error = None
+        except Exception:
+            result = None
+            error = traceback.format_exc()
+        done = time.time()
+        results.put((i, result, error, done - got, got - start))
+        if error:
+            return
+
+
+def run(batches, read, process, workers=1, queue_size=QUEUE_SIZE,
+        stats=None, count=len):
+    """
+    Yields process(read(batch)) for each of batches (a list), in order.
+    At most queue_size + workers batches are read but not yet written (a
+    result is written once the caller asks for the next one.)
+
+    read is called in a thread of this process, and process in worker
+    processes. The processes are forked, so process does not need to be
+    picklable, but what read and process return is sent between processes
+    and must be.
+
+    stats: A PipelineStats to record into, if given.
+    count: Returns the number of items (for stats) in a result of process.
+    """
+    stats = stats or PipelineStats()
+    stats.queue_size = queue_size
+    start = time.time()
+
+    tasks = multiprocessing.Queue(queue_size)
+    results = multiprocessing.Queue(queue_size)
+    window = threading.Semaphore(queue_size + workers)
+    errors = []
+    processes = [multiprocessing.Process(target=_work,
+                                         args=(process, tasks, results))
+                 for _ in xrange(workers)]
+    for p in processes:
+        p.daemon = True
+        p.start()
+    reader = threading.Thread(
+        target=_read,
+        args=(batches, read, tasks, workers, window, stats, errors))
+    reader.daemon = True
+    reader.start()
+
+    # Results that arrived before those of earlier batches (fewer than the
+    # slots of window.)
+    pending = {}
+    try:
+        for i in xrange(len(batches)):
+            wait_start = time.time()
+            while i not in pending:
+                try:
+                    j, result, error, busy, waiting = results.get(
+                        timeout=POLL_INTERVAL)
+                except Queue.Empty:
+                    if errors:
+                        raise RuntimeError(
+                            'Pipeline reader failed:\n' + errors[0])
+                    if not any(p.is_alive() for p in processes):
+                        raise RuntimeError('Pipeline workers exited.')
+                    continue
+                if error:
+                    raise RuntimeError('Pipeline worker failed:\n' + error)
+                stats.add(PROCESS, count(result), busy, waiting)
+                pending[j] = result
+            result = pending.pop(i)
+            for name, queue in [(READ_QUEUE, tasks), (RESULT_QUEUE, results)]:
+                depth = _depth(queue)
+                if depth is not None:
+                    stats.sample(name, depth)
+
+            write_start = time.time()
+            yield result
+            window.release()
+            stats.add(WRITE, count(result), time.time() - write_start,
+                      write_start - wait_start)
+    finally:
+        for p in processes:
+            p.terminate()
+        stats.elapsed = time.time() - start
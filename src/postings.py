@@ -0,0 +1,200 @@
+import array
+import mmap
+import numpy
+
+# Every postings file starts with one of these headers, identifying how its
+# postings lists are encoded, so that a reader can reject files written in
+# some other format (such as the older JSON postings).
+#
+# VARINT: gap and variable-byte encoded (see encode_postings.) Smallest on
+#   disk, but every list has to be decoded.
+# RAW: fixed width. Each list is an array of int32 guids followed by an array
+#   of uint16 term frequencies, padded to a multiple of 4 bytes. Lists can be
+#   used in place as NumPy arrays over the memory-mapped file.
+MAGIC = 'PSTV'
+RAW_MAGIC = 'PSTR'
+
+GUID_DTYPE = numpy.int32
+TF_DTYPE = numpy.uint16
+MAX_RAW_TF = numpy.iinfo(TF_DTYPE).max
+
+
+def encode_varint(value, out):
+    """Appends the variable-byte encoding of a non-negative integer to out.
+
+    Each byte holds 7 bits of the value, least significant group first. The
+    high bit of a byte is set if more bytes follow.
+    """
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(data):
+    """Decodes a buffer of concatenated varints into an int64 NumPy array.
+
+    Decoding is vectorised: a value ends at each byte without the high bit
+    set, and each byte contributes its low 7 bits, shifted by 7 for every
+    byte before it in its value. Bytes after the last complete value are
+    ignored.
+    """
+    data = numpy.frombuffer(data, numpy.uint8)
+    ends = numpy.flatnonzero(data < 0x80)
+    if len(ends) == len(data):
+        # Every value fits in a byte (most gaps and term frequencies.)
+        return data.astype(numpy.int64)
+    if not len(ends):
+        return numpy.zeros(0, numpy.int64)
+    data = data[:ends[-1] + 1]
+
+    starts = numpy.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = 7 * (numpy.arange(len(data)) -
+                  numpy.repeat(starts, ends - starts + 1))
+    payload = (data & 0x7f).astype(numpy.int64) << shifts
+    return numpy.add.reduceat(payload, starts)
+
+
+def encode_postings(entries):
+    """Encodes a postings list of (guid, term_freq)-pairs into a byte string.
+
+    The guids are sorted and stored as gaps from the previous guid. Gaps and
+    term frequencies are then interleaved and variable-byte encoded.
+    """
+    out = bytearray()
+    previous = 0
+    for guid, tf in sorted(entries):
+        encode_varint(guid - previous, out)
+        encode_varint(tf, out)
+        previous = guid
+    return str(out)
+
+
+def decode_postings(data):
+    """Decodes a byte string from encode_postings.
+
+    Returns a pair of parallel NumPy arrays: (int32 guids, int32
+    term_freqs).
+    """
+    values = decode_varints(data)
+    # Undo the gap encoding.
+    guids = numpy.cumsum(values[0::2]).astype(GUID_DTYPE)
+    tfs = values[1::2].astype(numpy.int32)
+    return guids, tfs
+
+
+def encode_raw_postings(entries):
+    """Encodes a postings list of (guid, term_freq)-pairs in the fixed width
+    RAW format. The result is not padded.
+    """
+    entries = sorted(entries)
+    guids = numpy.array([guid for guid, _ in entries], dtype=GUID_DTYPE)
+    tfs = [tf for _, tf in entries]
+    if tfs and max(tfs) > MAX_RAW_TF:
+        raise ValueError('Term frequency {} does not fit in the raw postings '
+                         'format.'.format(max(tfs)))
+    return guids.tostring() + numpy.array(tfs, dtype=TF_DTYPE).tostring()
+
+
+def union_sum(postings):
+    """Merges several postings lists into one.
+
+    postings: a list of (guids, term_freqs) pairs of arrays.
+
+    Returns (guids, term_freqs) NumPy arrays holding every guid that appears
+    in any of the lists (sorted), and the sum of its term frequencies across
+    the lists.
+    """
+    postings = [(guids, tfs) for guids, tfs in postings if len(guids)]
+    if not postings:
+        return numpy.array([], GUID_DTYPE), numpy.array([], numpy.int32)
+    if len(postings) == 1:
+        guids, tfs = postings[0]
+        return numpy.asarray(guids), numpy.asarray(tfs, numpy.int32)
+
+    all_guids = numpy.concatenate([numpy.asarray(g) for g, _ in postings])
+    all_tfs = numpy.concatenate([numpy.asarray(t) for _, t in postings])
+    guids, inverse = numpy.unique(all_guids, return_inverse=True)
+    tfs = numpy.bincount(inverse, weights=all_tfs).astype(numpy.int32)
+    return guids, tfs
+
+
+class PostingsWriter(object):
+    """
+    Appends encoded postings lists to an open (binary) postings file.
+
+    If raw is True, lists are written in the fixed width RAW format instead of
+    being compressed.
+    """
+    def __init__(self, f, raw=False):
+        self.__file = f
+        self.__raw = raw
+        self.__file.write(RAW_MAGIC if raw else MAGIC)
+
+    def write(self, entries):
+        """
+        Writes a postings list, returning its (offset, length) in the file.
+        """
+        if self.__raw:
+            data = encode_raw_postings(entries)
+        else:
+            data = encode_postings(entries)
+        offset = self.__file.tell()
+        self.__file.write(data)
+        if self.__raw and len(data) % 4:
+            # Keep every list aligned for its int32 guids.
+            self.__file.write('\0' * (4 - len(data) % 4))
+        return offset, len(data)
+
+
+class PostingsReader(object):
+    """
+    Reads postings lists out of a memory-mapped postings file.
+
+    The file is mapped read-only so that concurrent search processes share
+    the same pages in the OS page cache.
+    """
+    def __init__(self, path):
+        self.__file = open(path, 'rb')
+        self.__mmap = mmap.mmap(self.__file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+        magic = self.__mmap[:len(MAGIC)]
+        if magic not in (MAGIC, RAW_MAGIC):
+            self.close()
+            raise ValueError('{} is not a postings file.'.format(path))
+        self.raw = magic == RAW_MAGIC
+
+    def read(self, offset, length):
+        """
+        Returns the (guids, term_freqs) arrays of the postings list stored at
+        offset.
+        """
+        guids, tfs = self.read_numpy(offset, length)
+        return array.array('i', guids.tostring()), \
+            array.array('i', tfs.astype(numpy.int32).tostring())
+
+    def read_numpy(self, offset, length):
+        """
+        Returns the postings list stored at offset as a pair of NumPy arrays:
+        (int32 guids, term_freqs).
+
+        For RAW files these are read-only views over the memory-mapped file,
+        so nothing is copied; they must not be used after close(). VARINT
+        lists are decoded first.
+        """
+        if not self.raw:
+            return decode_postings(self.__mmap[offset:offset + length])
+
+        count = length / (numpy.dtype(GUID_DTYPE).itemsize +
+                          numpy.dtype(TF_DTYPE).itemsize)
+        guids = numpy.frombuffer(self.__mmap, GUID_DTYPE, count, offset)
+        tfs = numpy.frombuffer(
+            self.__mmap, TF_DTYPE, count,
+            offset + count * numpy.dtype(GUID_DTYPE).itemsize)
+        return guids, tfs
+
+    def close(self):
+        self.__mmap.close()
+        self.__file.close()
@@ -0,0 +1,184 @@
+import collections
+import contextlib
+import json
+import threading
+import time
+
+# A profile records where the time of a search (or index) run goes: the wall
+# and CPU time of named stages, and counters. Code on the hot paths records
+# into current(), which does nothing unless a profile was started, so that
+# profiling costs (almost) nothing when it is off.
+#
+# CPU time is that of the whole process (time.clock), so the CPU times of
+# stages running in concurrent threads overlap.
+
+# Output formats.
+TEXT = 'text'
+JSON = 'json'
+FORMATS = [TEXT, JSON]
+
+# Rates reported with the counters they are derived from (see define_rate):
+# name: (names of the hit counters, names of the lookup counters.)
+_RATES = collections.OrderedDict()
+
+
+def define_rate(name, hits, lookups):
+    """
+    Reports the rate called name, the sum of the counters named in hits over
+    the sum of those named in lookups, in every profile that counted any
+    lookups.
+    """
+    _RATES[name] = (tuple(hits), tuple(lookups))
+
+
+class Profile(object):
+    def __init__(self):
+        # name: [calls, wall seconds, CPU seconds], in order of first use.
+        self.timings = {}
+        self.counters = {}
+        self.__order = []
+        self.__lock = threading.Lock()
+
+    def __name(self, name):
+        if name not in self.timings and name not in self.counters:
+            self.__order.append(name)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Adds the time spent in the with block to the named stage."""
+        wall, cpu = time.time(), time.clock()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - wall, time.clock() - cpu)
+
+    def add_time(self, name, wall, cpu, calls=1):
+        with self.__lock:
+            self.__name(name)
+            timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += calls
+            timing[1] += wall
+            timing[2] += cpu
+
+    def count(self, name, n=1):
+        with self.__lock:
+            self.__name(name)
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        """Returns the profile as a JSON-serialisable dict."""
+        return {
+            'timings': [{'name': name, 'calls': calls, 'wall_ms': 1000 * wall,
+                         'cpu_ms': 1000 * cpu}
+                        for name in self.__order if name in self.timings
+                        for calls, wall, cpu in [self.timings[name]]],
+            'counters': [{'name': name, 'count': self.counters[name]}
+                         for name in self.__order if name in self.counters],
+            'rates': [{'name': name, 'rate': rate}
+                      for name, rate in self.rates()],
+        }
+
+    def rates(self):
+        """Returns the (name, rate)-tuples of the defined rates that have
+        lookups in this profile."""
+        rates = []
+        for name, (hits, lookups) in _RATES.iteritems():
+            total = sum(self.counters.get(counter, 0) for counter in lookups)
+            if total:
+                rates.append((name, float(sum(
+                    self.counters.get(counter, 0) for counter in hits)) /
+                    total))
+        return rates
+
+    def merge(self, data):
+        """Adds a profile returned by to_dict (e.g. from a worker process.)"""
+        for timing in data['timings']:
+            self.add_time(timing['name'], timing['wall_ms'] / 1000,
+                          timing['cpu_ms'] / 1000, timing['calls'])
+        for counter in data['counters']:
+            self.count(counter['name'], counter['count'])
+
+    def report(self, format=TEXT):
+        """Returns the profile as a table, or as JSON."""
+        data = self.to_dict()
+        if format == JSON:
+            return json.dumps(data, indent=2, sort_keys=True)
+
+        width = max([len(entry['name']) for entry in
+                     data['timings'] + data['counters'] + data['rates']] +
+                    [5])
+        lines = ['{:<{w}} {:>8} {:>12} {:>12}'.format(
+            'stage', 'calls', 'wall ms', 'cpu ms', w=width)]
+        for timing in data['timings']:
+            lines.append('{:<{w}} {:>8} {:>12.2f} {:>12.2f}'.format(
+                timing['name'], timing['calls'], timing['wall_ms'],
+                timing['cpu_ms'], w=width))
+        if data['counters']:
+            lines.append('')
+            lines.append('{:<{w}} {:>8}'.format('counter', 'count', w=width))
+            for counter in data['counters']:
+                lines.append('{:<{w}} {:>8}'.format(
+                    counter['name'], counter['count'], w=width))
+        if data['rates']:
+            lines.append('')
+            lines.append('{:<{w}} {:>8}'.format('rate', '%', w=width))
+            for rate in data['rates']:
+                lines.append('{:<{w}} {:>8.1f}'.format(
+                    rate['name'], 100 * rate['rate'], w=width))
+        return '\n'.join(lines)
+
+
+class _NullTimer(object):
+    """A timer that does nothing (one is shared by every NullProfile.timer.)"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullProfile(object):
+    """Stands in for a Profile when profiling is off."""
+    def timer(self, name):
+        # No generator or context manager is made for each use: timers wrap
+        # hot code.
+        return _NULL_TIMER
+
+    def add_time(self, name, wall, cpu, calls=1):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def to_dict(self):
+        return None
+
+
+_NULL = NullProfile()
+_current = _NULL
+
+
+def start():
+    """Starts recording into a new Profile, which is returned."""
+    global _current
+    _current = Profile()
+    return _current
+
+
+def stop():
+    """Stops recording, returning the Profile (or None if there was none.)"""
+    global _current
+    profile, _current = _current, _NULL
+    return profile if isinstance(profile, Profile) else None
+
+
+def current():
+    """Returns the Profile being recorded, or a NullProfile."""
+    return _current
+
+
+def enabled():
+    return _current is not _NULL
@@ -0,0 +1,92 @@
+import string
+import threading
+import utils
+
+from tokenizer import free_text as tokenizer
+
+
+# NLTK takes most of a second to import, so it is imported the first time a
+# query is tagged.
+def pos_tag(tokens):
+    from nltk import pos_tag
+    return pos_tag(tokens)
+
+
+class QueryAnalysis(object):
+    """
+    The words of each zone (title, abstract) of a query, in every form the
+    features read them: stemmed tokens, surface forms, tokens without
+    stopwords, part of speech tags, nouns and the surface form of each stem.
+
+    Each form of a zone is computed the first time it is asked for, and kept
+    for the rest of the query, so the query is tokenized (and tagged) once
+    however many features read it. Forms are computed lazily so that, as
+    before, a form that cannot be computed (e.g. the tagger is not
+    installed) fails only the features that read it. Features may run in
+    several threads (see scheduler.py), so each form is computed under a
+    lock, once.
+    """
+    def __init__(self, texts):
+        """texts: Dict of the raw text of each zone."""
+        self.texts = texts
+        self.__forms = {}
+        # Reentrant, as forms are computed from other forms.
+        self.__lock = threading.RLock()
+
+    def zones(self):
+        return sorted(self.texts)
+
+    def __form(self, name, zone, compute):
+        key = (name, zone)
+        form = self.__forms.get(key)
+        if form is None:
+            with self.__lock:
+                form = self.__forms.get(key)
+                if form is None:
+                    form = self.__forms[key] = compute(zone)
+        return form
+
+    def tokens(self, zone):
+        """Returns the case-folded, stemmed tokens of a zone, without tokens
+        that consist of just punctuation."""
+        def compute(zone):
+            return [x for x in tokenizer(self.texts[zone])
+                    if x not in string.punctuation]
+        return self.__form('tokens', zone, compute)
+
+    def surface_forms(self, zone):
+        """Returns the (unstemmed) words of a zone, stripped of
+        punctuation."""
+        def compute(zone):
+            return [x.strip(string.punctuation)
+                    for x in self.texts[zone].split()]
+        return self.__form('surface_forms', zone, compute)
+
+    def tokens_without_stopwords(self, zone):
+        def compute(zone):
+            return utils.without_stopwords(self.tokens(zone))
+        return self.__form('tokens_without_stopwords', zone, compute)
+
+    def pos_tags(self, zone):
+        """Returns the tokens of a zone as (token, tag)-tuples."""
+        def compute(zone):
+            return pos_tag(self.tokens(zone))
+        return self.__form('pos_tags', zone, compute)
+
+    def nouns(self, zone):
+        """Returns the tokens of a zone tagged as (singular) nouns."""
+        def compute(zone):
+            return [token for token, pos in self.pos_tags(zone)
+                    if pos == 'NN']
+        return self.__form('nouns', zone, compute)
+
+    def stem_map(self, zone):
+        """Returns a dict of the surface form of each stem of a zone.
+
+        Stems are paired with surface forms by position, so a stem whose
+        position is past the last surface form raises an IndexError."""
+        def compute(zone):
+            surface_forms = self.surface_forms(zone)
+            return dict((stem, surface_forms[i])
+                        for i, stem in enumerate(self.tokens(zone)))
+        return self.__form('stem_map', zone, compute)
@@ -0,0 +1,129 @@
+import errno
+import hashlib
+import json
+import os
+import threading
+
+# A result cache is a directory of files, one per cached search, named after
+# the SHA-1 of the search's key and holding its results as JSON. Reading an
+# entry updates its modification time, and the entries read least recently
+# are removed when the directory grows over its size limit. Listing the
+# directory costs a stat per entry, so a cache only checks its size once
+# 1 / EVICT_EVERY of the limit has been written through it since it last did.
+#
+# The directory also holds the fingerprint of the index the results came
+# from. When a cache is opened for a different fingerprint (the index has
+# been rebuilt, updated or merged), every entry is removed.
+FINGERPRINT_FILE = 'FINGERPRINT'
+ENTRY_EXTENSION = '.json'
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+EVICT_EVERY = 16
+
+
+class ResultCache(object):
+    def __init__(self, directory, fingerprint, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        directory: Directory of the cache. Created if it does not exist.
+        fingerprint: Fingerprint of the loaded index (see
+        compoundindex.fingerprint).
+        max_bytes: Approximate limit on the size of the cached results.
+        """
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.max_bytes = max_bytes
+        # Bytes put since the size was last checked (by any thread.)
+        self.__written = 0
+        self.__lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fingerprint_path = os.path.join(directory, FINGERPRINT_FILE)
+        if os.path.exists(fingerprint_path):
+            with open(fingerprint_path, 'r') as f:
+                stored = f.read()
+        else:
+            stored = None
+        if stored != fingerprint:
+            self.clear()
+            self.__write(fingerprint_path, fingerprint)
+
+    def __entry_path(self, key):
+        digest = hashlib.sha1(json.dumps([self.fingerprint, key],
+                                         sort_keys=True)).hexdigest()
+        return os.path.join(self.directory, digest + ENTRY_EXTENSION)
+
+    def __entries(self):
+        return [os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith(ENTRY_EXTENSION)]
+
+    def __write(self, path, data):
+        # Write to a temporary file and rename it, so that readers (possibly
+        # in other processes) never see a partial entry. The temporary file is
+        # named after the process and thread, as a server may put the same
+        # entry from several threads.
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                         threading.current_thread().ident)
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+
+    def get(self, key):
+        """
+        Returns the results cached for key (any JSON-serialisable value), as
+        a list of (document name, score)-tuples, or None.
+        """
+        path = self.__entry_path(key)
+        try:
+            with open(path, 'r') as f:
+                results = json.load(f)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return [(doc, score) for doc, score in results]
+
+    def put(self, key, results):
+        """
+        Caches the results (a list of (document name, score)-tuples) for key,
+        then, if enough has been written since the last check (see
+        EVICT_EVERY), evicts the least recently used entries if the cache is
+        too large.
+        """
+        data = json.dumps(results)
+        self.__write(self.__entry_path(key), data)
+        with self.__lock:
+            self.__written += len(data)
+            due = self.__written * EVICT_EVERY > self.max_bytes
+            if due:
+                self.__written = 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for path in self.__entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Removes every cached entry."""
+        for path in self.__entries():
+            # Another process sharing the cache may have removed it.
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
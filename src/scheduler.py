@@ -0,0 +1,149 @@
+import Queue
+import profiling
+import time
+import traceback
+
+from multiprocessing.pool import ThreadPool
+
+
+def feature_inputs(feature):
+    """
+    Returns the classes of the features whose scores a feature reads from the
+    shared search object (its INPUTS attribute), or an empty tuple if it only
+    reads the query and the index.
+    """
+    return tuple(getattr(feature, 'INPUTS', ()))
+
+
+def dependencies(features):
+    """
+    Returns, for each feature, the positions of the features it depends on.
+
+    A feature that reads scores (one with INPUTS) reads every score set
+    before it runs, not only those of its INPUTS, so it depends on all the
+    features before it in the list. Other features depend on none.
+
+    Only earlier features can be depended on, so the features always form a
+    DAG, and running them in list order is always valid.
+    """
+    return [range(i) if feature_inputs(feature) else []
+            for i, feature in enumerate(features)]
+
+
+class BufferedScores(object):
+    """
+    Stands in for the shared search object while a feature runs
+    concurrently with others. Scores set by the feature are kept aside until
+    the scheduler commits them; everything else is read from the shared
+    search object.
+    """
+    def __init__(self, shared_obj):
+        self.__shared_obj = shared_obj
+        # (name of the method, arguments) of each score set, in order.
+        self.scores = []
+
+    def set_feature_score(self, feature, doc_id, score):
+        self.scores.append(('set_feature_score', (feature, doc_id, score)))
+
+    def set_feature_scores(self, feature, doc_ids, scores):
+        self.scores.append(('set_feature_scores', (feature, doc_ids, scores)))
+
+    def commit(self):
+        for method, arguments in self.scores:
+            getattr(self.__shared_obj, method)(*arguments)
+
+    def __getattr__(self, name):
+        return getattr(self.__shared_obj, name)
+
+
+class FeatureScheduler(object):
+    """
+    Runs the features of a search.
+
+    With one worker, features are run one after the other in list order,
+    writing straight to the shared search object.
+
+    With more workers, features run in a thread pool as soon as the features
+    they depend on (see dependencies) are committed, each writing to its own
+    BufferedScores. Scores are committed to the shared search object in list
+    order. A feature that reads scores only starts once every feature before
+    it is committed, and nothing after it is committed until it is done, so
+    it sees exactly the scores it would have seen in list order: the results
+    are the same as with one worker.
+
+    A feature that raises an exception is reported by on_error(feature,
+    traceback) and does not affect the others; any scores it set before
+    failing are kept, as with one worker.
+
+    Before a feature is started, should_skip(feature) (if given) is asked
+    whether to skip it instead; skipped features set no scores.
+
+    Returns a dict of feature name: seconds taken, for the features that were
+    run (not skipped.) The time taken by each feature is also recorded in the
+    current profile.
+    """
+    def __init__(self, features, workers=1):
+        self.features = features
+        self.workers = workers
+        self.deps = dependencies(features)
+
+    def run(self, search, shared_obj, on_error, should_skip=None):
+        timings = {}
+
+        def run_feature(feature, scores):
+            """Runs a feature unless skipped, returning the traceback of its
+            exception (if any)."""
+            if should_skip and should_skip(feature):
+                return None
+            start = time.time()
+            try:
+                with profiling.current().timer('feature ' + feature.NAME):
+                    feature(search, scores)
+            except Exception:
+                return traceback.format_exc()
+            finally:
+                timings[feature.NAME] = time.time() - start
+
+        if self.workers <= 1:
+            for feature in self.features:
+                error = run_feature(feature, shared_obj)
+                if error:
+                    on_error(feature, error)
+            return timings
+
+        features = self.features
+        done = Queue.Queue()
+
+        def run_buffered(i):
+            scores = BufferedScores(shared_obj)
+            error = run_feature(features[i], scores)
+            done.put((i, scores, error))
+
+        pool = ThreadPool(self.workers)
+        try:
+            started = set()
+            finished = {}
+            committed = 0
+            while committed < len(features):
+                for i in xrange(len(features)):
+                    if i in started:
+                        continue
+                    if all(j < committed for j in self.deps[i]):
+                        started.add(i)
+                        pool.apply_async(run_buffered, (i,))
+
+                i, scores, error = done.get()
+                finished[i] = (scores, error)
+
+                # Commit in list order. A feature reading the scores waits
+                # for the features before it, so it is never running here.
+                while committed in finished:
+                    scores, error = finished[committed]
+                    if error:
+                        on_error(features[committed], error)
+                    scores.commit()
+                    committed += 1
+        finally:
+            pool.close()
+            pool.join()
+        return timings
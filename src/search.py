@@ -1,16 +1,24 @@
 #!/env/bin/python
 import argparse
+import budget
 import collections
 import compoundindex
-import json
+import featureregistry
+import lexicon
+import numpy
 import os
 import patentfields
+import profiling
+import resultcache
 import utils
-import string
+import sys
+import threading
+import time
 
-from features import vsm, fields, ipc, cluster, relation
 from helpers import cache
-from tokenizer import free_text as tokenizer
+from queryanalysis import QueryAnalysis
+from scheduler import FeatureScheduler
+from tokenizer import load_stem_table, stem_table_path
 
 
 class Search(object):
@@ -47,52 +55,56 @@ class Search(object):
     # Arbitrary minimum score of a relevant document.
     MIN_SCORE = 1
 
-    # Declaration of features and their weights.
+    # Measured cost and contribution of each feature, shared by all searches
+    # in a process (used to meet deadlines; see execute.)
+    feature_stats = budget.FeatureStats()
+    # If True, every search measures its features into feature_stats, not
+    # only those with a deadline (or profiled.)
+    measure_features = False
+
+    # Declaration of features (by name; see featureregistry.py) and their
+    # weights. Features with a weight of zero are never loaded.
     FEATURES = [
-        (vsm.single.VSMTitle(),                                 -5.31243308),
-        (vsm.single.VSMAbstract(),                              -9.30356609),
-        (vsm.single.VSMTitleMinusStopwords(),                   1.27085722),
-        (vsm.single.VSMAbstractMinusStopwords(),                -8.83578166),
-        (vsm.single.VSMTitleNounsOnly(),                        0.000146222472),
-        (vsm.single.VSMAbstractNounsOnly(),                     0.0000824446915),
+        ('VSM_Title',                                   -5.31243308),
+        ('VSM_Abstract',                                -9.30356609),
+        ('VSM_Title_Minus_Stopwords',                   1.27085722),
+        ('VSM_Abstract_Minus_Stopwords',                -8.83578166),
+        ('VSM_Title_Nouns_Only',                        0.000146222472),
+        ('VSM_Abstract_Nouns_Only',                     0.0000824446915),
 
-        (vsm.multiple.VSMTitleAndAbstract(),                    5.59690266),
-        (vsm.multiple.VSMTitleAndAbstractMinusStopwords(),      0.572786546),
+        ('VSM_Title_and_Abstract',                      5.59690266),
+        ('VSM_Title_and_Abstract_Minus_Stopwords',      0.572786546),
 
-        (vsm.expansion.VSMTitleMinusStopwordsPlusExpansion(),   1.10834491),
-        (vsm.expansion.VSMAbstractMinusStopwordsPlusExpansion(),1.13443603),
+        ('VSM_Title_Minus_Stopwords_Plus_Expansion',    1.10834491),
+        ('VSM_Abstract_Minus_Stopwords_Plus_Expansion', 1.13443603),
 
         # clusters
-        (cluster.cluster_feature_generator(
-            patentfields.IPC_SECTION)(),                        4.48495518),
-        (cluster.cluster_feature_generator(
-            patentfields.IPC_CLASS)(),                          -0.00504756358),
-        (cluster.cluster_feature_generator(
-            patentfields.IPC_GROUP)(),                          1.64642283),
-        (cluster.cluster_feature_generator(
-            patentfields.IPC_PRIMARY)(),                        0.769168418),
-        (cluster.cluster_feature_generator(
-            patentfields.IPC_SUBCLASS)(),                       0.929689840),
-        (cluster.cluster_feature_generator(
-            patentfields.ALL_IPC)(),                            16.5908845),
-
-        (cluster.cluster_feature_generator(
-            patentfields.ALL_UPC)(),                            1.03998143),
-        (cluster.cluster_feature_generator(
-            patentfields.UPC_PRIMARY)(),                        -0.266005728),
-        (cluster.cluster_feature_generator(
-            patentfields.UPC_CLASS)(),                          -0.599552688),
-
-        (fields.CitationCount(),                                3.05807617),
+        ('ClusterIPCSection',                           4.48495518),
+        ('ClusterIPCClass',                             -0.00504756358),
+        ('ClusterIPCGroup',                             1.64642283),
+        ('ClusterIPCPrimary',                           0.769168418),
+        ('ClusterIPCSubclass',                          0.929689840),
+        ('ClusterAllIPC',                               16.5908845),
+
+        ('ClusterAllUPC',                               1.03998143),
+        ('ClusterUPCPrimary',                           -0.266005728),
+        ('ClusterUPCClass',                             -0.599552688),
+
+        ('citationcount',                               3.05807617),
 
         # Unused features (these don't seem to work too well. Oh well.)
-        # (relation.Citations(),                                  0),
-        # (relation.FamilyMembers(),                              0),
-        # (ipc.IPCSectionLabelsTitle(),                           1),
-        # (ipc.IPCSectionLabelsAbstract(),                        1),
+        ('Cites',                                       0),
+        ('FamilyMembers',                               0),
+        # ('IPC_Section_Labels_Title',                    1),
+        # ('IPC_Section_Labels_Abstract',                 1),
     ]
 
-    def __init__(self, query_xml, compound_index):
+    # Names of features not to run (even with a non-zero weight.)
+    disabled_features = frozenset()
+
+    def __init__(self, query_xml, compound_index, top_k=None,
+                 feature_threads=1, compact_scores=False, deadline_ms=None,
+                 measure_features=None):
         self.__compound_index = compound_index
         self.__query = utils.parse_query_xml(query_xml)
 
@@ -102,6 +114,8 @@ class Search(object):
             patentfields.TITLE: self.query_title,
             patentfields.ABSTRACT: self.query_description
         }
+        # The query's tokens, in the forms features read them, computed once.
+        self.query_analysis = QueryAnalysis(self.__text)
 
         self.min_score = self.MIN_SCORE
         # Set up lists to represent the feature functions and
@@ -109,14 +123,48 @@ class Search(object):
         self.features = []
         self.features_weights = []
         self.features_vector_key = []
-        for f, weight in self.FEATURES:
-            self.features.append(f)
+        for name, weight in self.enabled_features():
+            self.features.append(featureregistry.load(name))
             self.features_weights.append(weight)
-            self.features_vector_key.append(f.NAME)
+            self.features_vector_key.append(name)
+
+        # If set, only the top_k most relevant documents are returned.
+        self.top_k = top_k
+
+        # Number of threads features are run in (see execute.)
+        self.feature_threads = feature_threads
+
+        # Names of the features that raised an exception in execute.
+        self.failed_features = []
+
+        # If set, the time (in ms) features may take; see execute.
+        self.deadline_ms = deadline_ms
+        # Names of the features execute left out to meet the deadline.
+        self.dropped_features = []
+        # Whether execute records the cost and contribution of the features
+        # in feature_stats: by default, with a deadline (or when profiling.)
+        if measure_features is None:
+            measure_features = self.measure_features or \
+                deadline_ms is not None or profiling.enabled()
+        self.measure_features = measure_features
+        # Names of the features execute means to run: all of them, or with a
+        # deadline, those planned to fit it.
+        self.planned_features = frozenset(self.features_vector_key)
 
         # Set up our "global" object to share information
         # between feature functions.
-        self.shared_search_obj = SharedSearchObject()
+        if compact_scores:
+            self.shared_search_obj = ArraySearchObject(
+                compound_index.max_guid() + 1)
+        else:
+            self.shared_search_obj = SharedSearchObject()
+
+    @classmethod
+    def enabled_features(cls):
+        """Returns the (name, weight)-tuples of the features searches run:
+        those with a non-zero weight that are not disabled."""
+        return [(name, weight) for name, weight in cls.FEATURES
+                if weight and name not in cls.disabled_features]
 
     def override_features_weights(self, weights):
         """Overrides specified feature weights.
@@ -139,38 +187,132 @@ class Search(object):
         By default, this will return case-folded and stemmed tokens. If
         the unstemmed argument is set to True, the original words will be
         returned instead."""
-        raw_text = self.__text.get(index)
-
         if unstemmed:
-            # We need to return just the words, without any punctuation.
-            words = raw_text.split()
-            stripped = [x.strip(string.punctuation) for x in words]
-            return stripped
-
-        tokens = tokenizer(raw_text)
-
-        # We want to strip out tokens which consist of just
-        # punctuation characters.
-        return [x for x in tokens if x not in string.punctuation]
+            return self.query_analysis.surface_forms(index)
+        return self.query_analysis.tokens(index)
 
     def execute(self):
         """Executes the search by iterating through all features.
 
         Since features can be added arbitrarily and are typically added by
         multiple developers, we add a try catch here for each feature. Failure
-        of one feature should not take down the entire system."""
-        # Loop through all our feature functions. Each feature updates
-        # self.shared_search_obj with its score for each document.
-        for feature in self.features:
-            try:
-                feature(self, self.shared_search_obj)
-            except Exception, e:
-                import traceback
-                tb = traceback.format_exc()
-                print "# Error in feature: %s\n%s" % (feature.NAME, tb)
-
+        of one feature should not take down the entire system.
+
+        With feature_threads > 1, features that do not read scores (see the
+        INPUTS of a feature) are run concurrently. The scores are the same
+        either way; see scheduler.FeatureScheduler.
+
+        With a deadline_ms, only the features expected to fit in that many ms
+        (by contribution per ms, as measured in feature_stats) are run, and
+        any feature that would overrun the deadline is skipped. The names of
+        the features left out are kept in dropped_features, and reported on
+        stderr.
+
+        If measure_features is set, the cost and contribution of the features
+        run are recorded in feature_stats."""
+        # Each feature updates self.shared_search_obj with its score for each
+        # document.
+        def report(feature, tb):
+            self.failed_features.append(feature.NAME)
+            print "# Error in feature: %s\n%s" % (feature.NAME, tb)
+
+        should_skip = None
+        if self.deadline_ms is not None:
+            start = time.time()
+            stats = self.feature_stats
+            chosen = budget.plan(self.features_vector_key, stats,
+                                 self.deadline_ms)
+            self.planned_features = frozenset(chosen)
+
+            def should_skip(feature):
+                if feature.NAME not in chosen:
+                    return True
+                elapsed = 1000 * (time.time() - start)
+                return elapsed + (stats.cost(feature.NAME) or 0) > \
+                    self.deadline_ms
+
+        scheduler = FeatureScheduler(self.features, self.feature_threads)
+        timings = scheduler.run(self, self.shared_search_obj, report,
+                                should_skip)
+        touched = len(self.shared_search_obj.doc_ids_to_scores)
+        profiling.current().count('documents touched', touched)
+
+        self.dropped_features = [name for name in self.features_vector_key
+                                 if name not in timings]
+        if self.dropped_features:
+            print >> sys.stderr, "# Dropped features (deadline): %s" % \
+                ', '.join(self.dropped_features)
+            profiling.current().count('dropped features',
+                                      len(self.dropped_features))
+            for name in self.dropped_features:
+                profiling.current().count('dropped ' + name)
+                self.feature_stats.drop(name)
+
+        if self.measure_features:
+            self.record_feature_stats(timings)
         return self
 
+    def record_feature_stats(self, timings):
+        """Adds the cost and contribution of each feature that was run to
+        feature_stats."""
+        doc_ids, matrix = self.shared_search_obj.score_matrix(
+            self.features_vector_key)
+        if len(doc_ids):
+            largest = numpy.abs(matrix).max(axis=0).tolist()
+        else:
+            largest = [0.0] * len(self.features_vector_key)
+        for name, weight, score in zip(self.features_vector_key,
+                                       self.features_weights, largest):
+            if name in timings:
+                self.feature_stats.record(name, 1000 * timings[name],
+                                          abs(weight) * score)
+
+    def run(self, result_cache=None):
+        """Executes the search and returns its scored_results.
+
+        If a resultcache.ResultCache is given, the results are looked up in it
+        first (by cache_key), and execute is skipped if they are found.
+        Otherwise they are added to it, unless a feature failed or was
+        dropped."""
+        if result_cache is None:
+            self.execute()
+            return self.scored_results()
+
+        key = self.cache_key()
+        results = result_cache.get(key)
+        if results is not None:
+            profiling.current().count('result cache hits')
+            return results
+        profiling.current().count('result cache misses')
+
+        self.execute()
+        results = self.scored_results()
+        if not self.failed_features and not self.dropped_features:
+            result_cache.put(key, results)
+        return results
+
+    def cache_key(self):
+        """Returns everything the results of this search depend on (other
+        than the index): the query, as the tokens features read through
+        get_tokens_for, the features and their weights, the min score, the
+        number of results, the kind of score storage and the features that
+        use the norms stored in the index."""
+        tokens = {}
+        for index in sorted(self.__text):
+            tokens[index] = [self.get_tokens_for(index),
+                             self.get_tokens_for(index, unstemmed=True)]
+        return {
+            'tokens': tokens,
+            'features': self.features_vector_key,
+            'weights': list(self.features_weights),
+            'min_score': self.min_score,
+            'top_k': self.top_k,
+            'compact_scores': isinstance(self.shared_search_obj,
+                                         ArraySearchObject),
+            'index_norms': [feature.NAME for feature in self.features
+                            if getattr(feature, 'USE_INDEX_NORMS', False)],
+        }
+
     def results(self):
         """Returns a list of documents that match the search query, in order
         of relevance.
@@ -178,35 +320,52 @@ class Search(object):
         NOTE: This is separated from execute so we can vary weights during the
         learning phase without recomputing the unweighted feature scores.
         """
-        # Generate a list of documents, in descending order of relevance,
-        # where the score of each document is above our threshold.
-        results = self.calculate_score(
-            self.shared_search_obj.doc_ids_to_scores)
+        return [doc for doc, _ in self.scored_results()]
 
-        # Highest score first.
-        results.sort(reverse=True)
-
-        # Filter out results below the min_score
-        results = [r for r in results if r[0] > self.min_score]
+    def scored_results(self):
+        """Returns a list of (document name, score) for the documents that
+        match the search query, in order of relevance."""
+        with profiling.current().timer('rank'):
+            return self.__scored_results()
 
-        return [self.compound_index.document_name_for_guid(str(elem[-1]))
-                for elem in results]
+    def __scored_results(self):
+        doc_ids, matrix, scores = self.calculate_scores()
 
-    def calculate_score(self, doc_ids_to_scores):
-        """Returns a list of (score, doc_id).
-
-        Calculates the dot product between each document's score for each
-        feature and the respective feature weights."""
-        results = []
-        for doc_id, score in doc_ids_to_scores.iteritems():
-            doc_score_vector = [score.get(key, 0) for key in
-                                self.features_vector_key]
+        # Filter out results below the min_score
+        candidates = numpy.flatnonzero(scores > self.min_score)
 
-            doc_score = utils.dot_product(
-                doc_score_vector, self.features_weights)
+        k = self.top_k
+        if k is not None and len(candidates) > k:
+            # Only rank the documents scoring at least the k-th best score
+            # (including any ties with it.)
+            kth = len(candidates) - k
+            kth_score = numpy.partition(scores[candidates], kth)[kth]
+            candidates = candidates[scores[candidates] >= kth_score]
 
-            results.append((doc_score, doc_score_vector, doc_id))
-        return results
+        # Highest score first.
+        order = candidates[numpy.argsort(-scores[candidates],
+                                         kind='mergesort')]
+        order = _break_ties(order, doc_ids, matrix, scores)[:k]
+
+        return [(self.compound_index.document_name_for_guid(doc_id), score)
+                for doc_id, score in zip(doc_ids[order].tolist(),
+                                         scores[order].tolist())]
+
+    def calculate_scores(self):
+        """Returns (doc_ids, score_matrix, scores) for all scored documents.
+
+        score_matrix holds each document's score for each feature (see
+        SharedSearchObject.score_matrix), and scores the dot product of each
+        row with the feature weights."""
+        doc_ids, matrix = self.shared_search_obj.score_matrix(
+            self.features_vector_key)
+
+        # Add the weighted columns up in feature order, as
+        # utils.dot_product would, so that the scores are exactly the same.
+        scores = numpy.zeros(len(doc_ids))
+        for column, weight in enumerate(self.features_weights):
+            scores += matrix[:, column] * weight
+        return doc_ids, matrix, scores
 
     query_title = property(lambda self: self.__query['title'])
     compound_index = property(lambda self: self.__compound_index)
@@ -221,14 +380,118 @@ class Search(object):
         return raw
 
 
+def _break_ties(order, doc_ids, matrix, scores):
+    """Given row indices sorted by descending score, orders rows with equal
+    scores by their score vectors and then doc ids (descending), as sorting
+    (score, score vector, doc_id)-tuples would."""
+    ranked = scores[order]
+    ties = numpy.flatnonzero(ranked[1:] == ranked[:-1]).tolist()
+    if not ties:
+        return order
+
+    order = order.copy()
+    start = end = ties[0]
+    for pos in ties[1:] + [None]:
+        if pos == end + 1:
+            end = pos
+            continue
+        # order[start:end + 2] all have the same score.
+        rows = order[start:end + 2].tolist()
+        rows.sort(key=lambda row: (matrix[row].tolist(), doc_ids[row]),
+                  reverse=True)
+        order[start:end + 2] = rows
+        if pos is not None:
+            start = end = pos
+    return order
+
+
 class SharedSearchObject(object):
     """Simple case class, used as a shared object between search features.
 
     Used to pass, reuse values (if required by features that share common
     logic.)
+
+    It also holds the postings lists read during the query, so that each
+    (index, term) is only read and decoded once, however many features use
+    it.
     """
     def __init__(self):
         self.doc_ids_to_scores = {}
+        # The same scores, as feature: {doc_id: score}.
+        self.scores_by_feature = {}
+        self.__matrix = None
+        self.__postings = {}
+        self.__postings_lists = {}
+        self.__cache = {}
+        # Features may run in several threads (see scheduler.py), and what is
+        # cached may take a while to compute (e.g. the scores of every VSM
+        # feature), so each value is computed once, under a lock. Reentrant,
+        # as values are computed from other values.
+        self.__cache_lock = threading.RLock()
+
+    def score_matrix(self, features):
+        """Returns (doc_ids, matrix): the sorted ids of all scored documents,
+        and a dense len(doc_ids) x len(features) matrix of their score for
+        each of the given features (0 if a feature did not score them.)
+
+        The matrix is kept until a score is changed, so that it can be
+        reused for different feature weights.
+        """
+        features = tuple(features)
+        if self.__matrix is not None and self.__matrix[0] == features:
+            return self.__matrix[1:]
+
+        doc_ids = numpy.fromiter(self.doc_ids_to_scores.iterkeys(),
+                                 numpy.int64, len(self.doc_ids_to_scores))
+        doc_ids.sort()
+        # Column-major, so that each feature's scores are contiguous.
+        matrix = numpy.zeros((len(doc_ids), len(features)), order='F')
+        for column, feature in enumerate(features):
+            scores = self.scores_by_feature.get(feature)
+            if not scores:
+                continue
+            rows = numpy.searchsorted(doc_ids, numpy.fromiter(
+                scores.iterkeys(), numpy.int64, len(scores)))
+            matrix[rows, column] = numpy.fromiter(
+                scores.itervalues(), numpy.float64, len(scores))
+
+        self.__matrix = (features, doc_ids, matrix)
+        return doc_ids, matrix
+
+    def postings(self, compound_index, index_name, term):
+        """Returns the (guids, term_freqs) NumPy arrays of a term in an
+        index."""
+        key = (index_name, term)
+        profile = profiling.current()
+        if key not in self.__postings:
+            self.__postings[key] = compound_index.postings_numpy(
+                index_name, term)
+            profile.count('postings lists fetched')
+        else:
+            profile.count('postings cache hits')
+        guids, tfs = self.__postings[key]
+        profile.count('postings entries scanned', len(guids))
+        return guids, tfs
+
+    def postings_list(self, compound_index, index_name, term):
+        """Returns the postings list of a term in an index, as a list of
+        (guid, term_freq)-tuples. The list must not be modified."""
+        key = (index_name, term)
+        if key not in self.__postings_lists:
+            guids, tfs = self.postings(compound_index, index_name, term)
+            self.__postings_lists[key] = zip(guids.tolist(), tfs.tolist())
+        return self.__postings_lists[key]
+
+    def cached(self, key, compute):
+        """Returns the value stored under key for this query, calling compute
+        to create it the first time."""
+        with self.__cache_lock:
+            if key not in self.__cache:
+                self.__cache[key] = compute()
+                profiling.current().count('query cache misses')
+            else:
+                profiling.current().count('query cache hits')
+            return self.__cache[key]
 
     def set_feature_score(self, feature, doc_id, score):
         """Given a feature name, document ID, and a score, updates the score of
@@ -236,30 +499,291 @@ class SharedSearchObject(object):
         if not self.doc_ids_to_scores.get(doc_id):
             self.doc_ids_to_scores[doc_id] = {}
         self.doc_ids_to_scores[doc_id][feature] = score
+        if feature not in self.scores_by_feature:
+            self.scores_by_feature[feature] = {}
+        self.scores_by_feature[feature][doc_id] = score
+        self.__matrix = None
+
+    def set_feature_scores(self, feature, doc_ids, scores):
+        """Like set_feature_score, for several documents at once, given
+        NumPy arrays of their ids and scores."""
+        feature_scores = self.scores_by_feature.setdefault(feature, {})
+        for doc_id, score in zip(doc_ids.tolist(), scores.tolist()):
+            doc_scores = self.doc_ids_to_scores.get(doc_id)
+            if not doc_scores:
+                doc_scores = self.doc_ids_to_scores[doc_id] = {}
+            doc_scores[feature] = score
+            feature_scores[doc_id] = score
+        self.__matrix = None
+
+
+class ArraySearchObject(SharedSearchObject):
+    """SharedSearchObject that keeps scores in arrays rather than dicts.
+
+    Each feature's scores are kept in a float32 array indexed by guid
+    (allocated when the feature sets its first score), and a boolean array
+    marks the documents that have any score. This takes 4 bytes per document
+    per feature, instead of a dict (and boxed floats) per scored document.
+
+    doc_ids_to_scores and scores_by_feature are read-only views that build
+    the dicts of SharedSearchObject on demand (only listing non-zero scores),
+    so features written against SharedSearchObject work unchanged. Scores
+    are rounded to float32, so rankings can differ from SharedSearchObject's
+    among nearly tied documents.
+    """
+    def __init__(self, guid_count):
+        super(ArraySearchObject, self).__init__()
+        self.__guid_count = guid_count
+        self.__scores = {}
+        self.__touched = numpy.zeros(guid_count, numpy.bool_)
+        self.__matrix = None
+        self.doc_ids_to_scores = DocScoresView(self.__scores, self.__touched)
+        self.scores_by_feature = FeatureScoresView(self.__scores)
+
+    def score_matrix(self, features):
+        features = tuple(features)
+        if self.__matrix is not None and self.__matrix[0] == features:
+            return self.__matrix[1:]
+
+        doc_ids = numpy.flatnonzero(self.__touched)
+        matrix = numpy.zeros((len(doc_ids), len(features)), order='F')
+        for column, feature in enumerate(features):
+            scores = self.__scores.get(feature)
+            if scores is not None:
+                matrix[:, column] = scores[doc_ids]
+
+        self.__matrix = (features, doc_ids, matrix)
+        return doc_ids, matrix
+
+    def score_sums(self, exclude_prefix=None):
+        """Returns (doc_ids, sums): the ids of all scored documents, and the
+        sum of each one's scores, leaving out features whose names start with
+        exclude_prefix."""
+        doc_ids = numpy.flatnonzero(self.__touched)
+        sums = numpy.zeros(len(doc_ids))
+        for feature, scores in self.__scores.iteritems():
+            if not (exclude_prefix and feature.startswith(exclude_prefix)):
+                sums += scores[doc_ids]
+        return doc_ids, sums
+
+    def set_feature_score(self, feature, doc_id, score):
+        scores = self.__scores.get(feature)
+        if scores is None:
+            scores = numpy.zeros(self.__guid_count, numpy.float32)
+            self.__scores[feature] = scores
+        scores[doc_id] = score
+        self.__touched[doc_id] = True
+        self.__matrix = None
+
+    def set_feature_scores(self, feature, doc_ids, scores):
+        if feature not in self.__scores:
+            self.__scores[feature] = numpy.zeros(self.__guid_count,
+                                                 numpy.float32)
+        self.__scores[feature][doc_ids] = scores
+        self.__touched[doc_ids] = True
+        self.__matrix = None
+
+
+class DocScoresView(collections.Mapping):
+    """Read-only doc_id: {feature: score} view of an ArraySearchObject's
+    arrays."""
+    def __init__(self, scores, touched):
+        self.__scores = scores
+        self.__touched = touched
+
+    def __getitem__(self, doc_id):
+        if not 0 <= doc_id < len(self.__touched) or \
+                not self.__touched[doc_id]:
+            raise KeyError(doc_id)
+        return {feature: float(scores[doc_id])
+                for feature, scores in self.__scores.iteritems()
+                if scores[doc_id]}
+
+    def __iter__(self):
+        return iter(numpy.flatnonzero(self.__touched).tolist())
+
+    def __len__(self):
+        return int(numpy.count_nonzero(self.__touched))
+
+
+class FeatureScoresView(collections.Mapping):
+    """Read-only feature: {doc_id: score} view of an ArraySearchObject's
+    arrays."""
+    def __init__(self, scores):
+        self.__scores = scores
+
+    def __getitem__(self, feature):
+        scores = self.__scores[feature]
+        doc_ids = numpy.flatnonzero(scores)
+        return dict(zip(doc_ids.tolist(), scores[doc_ids].tolist()))
+
+    def __iter__(self):
+        return iter(self.__scores)
+
+    def __len__(self):
+        return len(self.__scores)
+
+
+def use_index_norms():
+    """Makes the VSM features weight documents by log-tf, and normalise them
+    by the norms stored in the index (see VSMBase.USE_INDEX_NORMS.)"""
+    # Imported here, so that features are only imported when first loaded.
+    from features.vsm.base import VSMBase
+    VSMBase.USE_INDEX_NORMS = True
+
+
+def batch_query_files(batch):
+    """
+    Returns the query files of a batch: either every .xml file in a
+    directory (in name order), or the paths listed in a file, one per line.
+    Relative paths in a list are relative to the list's directory; blank
+    lines and lines starting with # are ignored.
+    """
+    if os.path.isdir(batch):
+        return [os.path.join(batch, name) for name in sorted(os.listdir(batch))
+                if name.endswith('.xml')]
+
+    directory = os.path.dirname(batch)
+    with open(batch, 'r') as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(directory, line) for line in lines
+            if line and not line.startswith('#')]
+
+
+def query_id(query_file):
+    """Returns the id of a query: the name of its file, less the extension."""
+    return os.path.splitext(os.path.basename(query_file))[0]
+
+
+def run_batch(compound_index, query_files, output, trec=False,
+              run_tag='patsnap', top_k=None, feature_threads=1,
+              compact_scores=False, result_cache=None, deadline_ms=None):
+    """
+    Runs every query file against the same (already loaded) index, so the
+    index, the caches of its methods and the NLTK resources are shared by all
+    queries.
+
+    Results are written to <output>/<query id>.txt, one file per query, or if
+    trec is True, to the single TREC run file at output, as lines of
+    `<query id> Q0 <document> <rank> <score> <run_tag>`.
+
+    If top_k is set, only the top_k results of each query are written. If a
+    result_cache is given, queries whose results it holds are not executed.
+    If deadline_ms is set, each query is given that many ms for its features
+    (see Search.execute.)
+
+    A query that fails is reported and skipped. Returns the number of queries
+    that failed.
+    """
+    if trec:
+        run_file = open(output, 'w')
+    elif not os.path.isdir(output):
+        os.makedirs(output)
+
+    failed = 0
+    for query_file in query_files:
+        qid = query_id(query_file)
+        try:
+            with open(query_file, 'r') as f:
+                query_xml = f.read()
+            s = Search(query_xml, compound_index, top_k=top_k,
+                       feature_threads=feature_threads,
+                       compact_scores=compact_scores,
+                       deadline_ms=deadline_ms)
+            results = s.run(result_cache)
+        except Exception, e:
+            import traceback
+            print "# Error in query: %s\n%s" % (
+                query_file, traceback.format_exc())
+            failed += 1
+            continue
+
+        if trec:
+            for rank, (doc, score) in enumerate(results, 1):
+                run_file.write('%s Q0 %s %d %r %s\n' % (
+                    qid, doc, rank, score, run_tag))
+        else:
+            with open(os.path.join(output, qid + '.txt'), 'w+') as f:
+                f.write('%s\n' % ' '.join(doc for doc, _ in results))
+
+    if trec:
+        run_file.close()
+    return failed
+
+
+def open_result_cache(args):
+    """Returns the ResultCache given by --cache, or None."""
+    if not args.cache:
+        return None
+    fingerprint = compoundindex.fingerprint(os.path.abspath(args.dictionary),
+                                            os.path.abspath(args.postings))
+    return resultcache.ResultCache(os.path.abspath(args.cache), fingerprint,
+                                   int(args.cache_size * 1024 * 1024))
 
 
 def main(args):
+    output_file = os.path.abspath(args.output)
+
+    if args.stem_table and args.dictionary:
+        with profiling.current().timer('load stem table'):
+            load_stem_table(stem_table_path(os.path.abspath(args.dictionary)))
+
+    if args.lexicon and args.dictionary:
+        with profiling.current().timer('load lexicon'):
+            lexicon.load(lexicon.lexicon_path(
+                os.path.abspath(args.dictionary)))
+
+    if args.batch:
+        with profiling.current().timer('load index'):
+            compound_index = compoundindex.load(
+                os.path.abspath(args.dictionary),
+                os.path.abspath(args.postings), use_snapshots=args.snapshot)
+        query_files = batch_query_files(os.path.abspath(args.batch))
+        failed = run_batch(compound_index, query_files, output_file,
+                           trec=args.trec, top_k=args.top_k,
+                           feature_threads=args.feature_threads,
+                           compact_scores=args.compact_scores,
+                           result_cache=open_result_cache(args),
+                           deadline_ms=args.deadline_ms)
+        compound_index.close()
+        if failed:
+            sys.exit('{} of {} queries failed.'.format(
+                failed, len(query_files)))
+        return
+
+    query_file = os.path.abspath(args.query)
+
+    if args.server:
+        # Let a running server.py answer the query.
+        import server
+        with open(query_file, 'r') as f:
+            results = server.request(os.path.abspath(args.server), f.read(),
+                                     top_k=args.top_k,
+                                     deadline_ms=args.deadline_ms)
+        with open(output_file, 'w+') as output:
+            output.write('%s\n' % ' '.join(results))
+        return
+
     dictionary_file = os.path.abspath(args.dictionary)
     postings_file = os.path.abspath(args.postings)
-    query_file = os.path.abspath(args.query)
-    output_file = os.path.abspath(args.output)
 
     # Open the dictionary.
     # NOTE(michael): Do these things outside the search class to allow
     # dependency injection at runtime/testing.
-    with open(dictionary_file, 'r') as f:
-        json_obj = json.load(f)
-
-    compound_index = compoundindex.CompoundIndex(json_obj)
+    with profiling.current().timer('load index'):
+        compound_index = compoundindex.load(dictionary_file, postings_file,
+                                            use_snapshots=args.snapshot)
 
     # Load the query file.
     with open(query_file, 'r') as f:
         query_xml = f.read()
 
     # Execute the query.
-    s = Search(query_xml, compound_index)
-    s.execute()
-    results = s.results()
+    s = Search(query_xml, compound_index, top_k=args.top_k,
+               feature_threads=args.feature_threads,
+               compact_scores=args.compact_scores,
+               deadline_ms=args.deadline_ms)
+    results = [doc for doc, _ in s.run(open_result_cache(args))]
 
     # Write results to file.
     with open(output_file, 'w+') as output:
@@ -268,13 +792,116 @@ def main(args):
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Patsnap assignment - Search')
-    parser.add_argument('-d', '--dictionary', required=True,
+    parser.add_argument('-d', '--dictionary',
                         help='dictionary file.')
-    parser.add_argument('-p', '--postings', required=True,
+    parser.add_argument('-p', '--postings',
                         help='postings file.')
-    parser.add_argument('-q', '--query', required=True,
+    parser.add_argument('-q', '--query',
                         help='query file.')
     parser.add_argument('-o', '--output', required=True,
-                        help='output file.')
+                        help='output file (with --batch, the output '
+                             'directory, or the run file with --trec.)')
+    parser.add_argument('-b', '--batch',
+                        help='run every query file in this directory, or '
+                             'listed in this file, in one process.')
+    parser.add_argument('--trec', action='store_true',
+                        help='with --batch, write a single TREC-style run '
+                             'file instead of one results file per query.')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='load the dictionary from its binary snapshot '
+                             '(see snapshot.py) if it is up to date.')
+    parser.add_argument('--stem-table', action='store_true',
+                        help='look up the stems of words in the table written '
+                             'by index.py --stem-table, if there is one.')
+    parser.add_argument('--lexicon', action='store_true',
+                        help='read stopwords, stems, synonyms and IPC '
+                             'labels from the lexicon written by lexicon.py, '
+                             'if there is one, instead of NLTK data and '
+                             'thesaurus.json.')
+    parser.add_argument('-k', '--top-k', type=int, default=None,
+                        help='only return the K most relevant documents.')
+    parser.add_argument('--disable-feature', action='append', default=[],
+                        metavar='NAME', choices=featureregistry.names(),
+                        help='do not load or run this feature (may be given '
+                             'more than once.)')
+    parser.add_argument('-t', '--feature-threads', type=int, default=1,
+                        help='run independent features in this many '
+                             'threads. The default of 1 runs them one after '
+                             'the other, in order.')
+    parser.add_argument('--compact-scores', action='store_true',
+                        help='keep feature scores in float32 arrays indexed '
+                             'by document instead of dicts (less memory on '
+                             'large indexes; scores are rounded to float32.)')
+    parser.add_argument('--cache',
+                        help='directory of a result cache: queries whose '
+                             'results are cached there (for the same index) '
+                             'are not executed again.')
+    parser.add_argument('--cache-size', type=float,
+                        default=resultcache.DEFAULT_MAX_BYTES / (1024 * 1024),
+                        help='approximate size limit (in MiB) of the result '
+                             'cache.')
+    parser.add_argument('--index-norms', action='store_true',
+                        help='weight documents by log-tf and normalise them '
+                             'by the length of their full vector, stored in '
+                             'the index, in the VSM features of single '
+                             'zones. The feature weights were trained '
+                             'without it (see learn.py --index-norms.)')
+    parser.add_argument('--deadline-ms', type=float, default=None,
+                        help='time (in ms) the features of a query may take. '
+                             'Features that contribute least for their cost, '
+                             'or that would overrun it, are left out.')
+    parser.add_argument('--feature-stats',
+                        help='JSON file of the measured cost and contribution '
+                             'of each feature, used by --deadline-ms; read '
+                             'if it exists, and updated.')
+    parser.add_argument('--profile', nargs='?', const=profiling.TEXT,
+                        choices=profiling.FORMATS,
+                        help='print the time taken by each feature and stage, '
+                             'and counts of postings read, documents scored '
+                             'and cache hits, to stderr (as a table, or as '
+                             'JSON with --profile json.)')
+    parser.add_argument('--server',
+                        help='send the query to the server.py listening on '
+                             'this Unix socket, instead of loading the index. '
+                             'Only -k/--top-k and --deadline-ms are sent with '
+                             'the query; the server is configured with the '
+                             'other options.')
     args = parser.parse_args()
-    main(args)
+    if bool(args.query) == bool(args.batch):
+        parser.error('exactly one of -q/--query and -b/--batch is required')
+    if args.batch and args.server:
+        parser.error('argument --server does not support --batch')
+    if args.server:
+        # These configure the search itself, which the server does.
+        local_options = [name for name, given in [
+            ('--cache', args.cache),
+            ('--compact-scores', args.compact_scores),
+            ('-t/--feature-threads', args.feature_threads != 1),
+            ('--disable-feature', args.disable_feature),
+            ('--feature-stats', args.feature_stats),
+            ('--snapshot', args.snapshot),
+            ('--stem-table', args.stem_table),
+            ('--lexicon', args.lexicon),
+            ('--index-norms', args.index_norms),
+        ] if given]
+        if local_options:
+            parser.error('argument --server does not support {} (give them '
+                         'to server.py instead)'.format(
+                             ', '.join(local_options)))
+    if not args.server and not (args.dictionary and args.postings):
+        parser.error('arguments -d/--dictionary and -p/--postings are '
+                     'required')
+    Search.disabled_features = frozenset(args.disable_feature)
+    if args.index_norms:
+        use_index_norms()
+    if args.feature_stats:
+        Search.feature_stats = budget.FeatureStats(args.feature_stats)
+        Search.measure_features = True
+    if args.profile:
+        profiling.start()
+    try:
+        main(args)
+    finally:
+        if args.profile:
+            print >> sys.stderr, profiling.stop().report(args.profile)
+        Search.feature_stats.save()
@@ -0,0 +1,201 @@
+import array
+import fieldstore
+import indexfields
+import numpy
+import postings
+
+
+class SegmentBase(object):
+    """
+    A single segment of an index: a dictionary and the postings file it
+    points into, as written by one run of index.py.
+
+    Subclasses load the dictionary from a particular format, and implement
+    the accessors below. CompoundIndex only uses these accessors, so that it
+    does not depend on how a segment is stored.
+
+    The guids of a segment are contiguous, starting at first_guid.
+    """
+    first_guid = 0
+
+    def __init__(self, postings_path):
+        self.postings_path = postings_path
+        self.postings = postings.PostingsReader(postings_path)
+
+    def guid_count(self):
+        """Returns the number of guids assigned in this segment."""
+        raise NotImplementedError()
+
+    def document_name(self, guid):
+        """Returns the document name for a guid, or None."""
+        raise NotImplementedError()
+
+    def guid_for_document_name(self, name):
+        """Returns the guid for a document name, or None."""
+        raise NotImplementedError()
+
+    def index_names(self):
+        """Returns the names of the indices (zones) in this segment."""
+        raise NotImplementedError()
+
+    def documents_in_index(self, index_name):
+        """Returns the sorted guids of the documents in an index."""
+        raise NotImplementedError()
+
+    def terms(self, index_name):
+        """Returns the terms of an index."""
+        raise NotImplementedError()
+
+    def term_count(self, index_name):
+        """Returns the number of terms in an index."""
+        raise NotImplementedError()
+
+    def term_entry(self, index_name, term):
+        """
+        Returns the (doc_freq, idf, offset, length) of a term in an index, or
+        None if the term is not in the index.
+        """
+        raise NotImplementedError()
+
+    def max_weight(self, index_name, term):
+        """
+        Returns the largest weight of a term in the documents of an index (its
+        log-tf divided by the document's norm), as computed at index time: 0
+        if the term is not in the index, or None if the segment does not
+        store it.
+        """
+        raise NotImplementedError()
+
+    def norm(self, index_name, guid):
+        """
+        Returns the length of the full log-tf vector of a document in an
+        index, or 0 if the document is not in the index.
+        """
+        raise NotImplementedError()
+
+    def norm_array(self, index_name):
+        """
+        Returns the norms of an index as a NumPy array of float64, aligned to
+        guid (starting at first_guid), or an empty array if the index is not
+        in this segment.
+        """
+        raise NotImplementedError()
+
+    def column(self, field):
+        """
+        Returns the fieldstore.FieldColumn of a field, or None.
+        """
+        raise NotImplementedError()
+
+    def postings_arrays(self, index_name, term):
+        """
+        Returns the (guids, term_freqs) arrays for a term in an index.
+        """
+        entry = self.term_entry(index_name, term)
+        if entry is None:
+            return array.array('i'), array.array('i')
+        _, _, offset, length = entry
+        return self.postings.read(offset, length)
+
+    def postings_numpy(self, index_name, term):
+        """
+        Returns the (guids, term_freqs) NumPy arrays for a term in an index.
+        """
+        entry = self.term_entry(index_name, term)
+        if entry is None:
+            return numpy.array([], postings.GUID_DTYPE), \
+                numpy.array([], postings.TF_DTYPE)
+        _, _, offset, length = entry
+        return self.postings.read_numpy(offset, length)
+
+    def close(self):
+        self.postings.close()
+
+
+class IndexSegment(SegmentBase):
+    """
+    A segment whose dictionary is the JSON object written by index.py.
+    """
+    def __init__(self, json_obj, postings_path):
+        super(IndexSegment, self).__init__(postings_path)
+
+        # Keys in JSON have to be strings, and our GUIDs are implicitly cast
+        # to strings on serialisation. We re-parse them into integer types to
+        # recover ease of comparison.
+        # Note:
+        # No error checking is performed. This will fail fatally if the JSON
+        # file was modified out of band to contain invalid integers.
+        self.gd_map = {
+            int(key): val
+            for key, val in json_obj[indexfields.GUID_DOC_MAP].iteritems()
+        }
+        self.dg_map = json_obj[indexfields.DOC_GUID_MAP]
+        self.indices = json_obj[indexfields.ZONES]
+        self.first_guid = json_obj[indexfields.FIRST_GUID]
+        self.norms = {
+            index_name: array.array('d', index[indexfields.INDEX_NORMS])
+            for index_name, index in self.indices.iteritems()
+        }
+        self.columns = {
+            field: fieldstore.FieldColumn(column, self.first_guid)
+            for field, column in json_obj[indexfields.FIELDS].iteritems()
+        }
+
+    def __dictionary(self, index_name):
+        if index_name not in self.indices:
+            return {}
+        return self.indices[index_name][indexfields.INDEX_DICT]
+
+    def guid_count(self):
+        return len(self.gd_map)
+
+    def document_name(self, guid):
+        return self.gd_map.get(guid)
+
+    def guid_for_document_name(self, name):
+        return self.dg_map.get(name)
+
+    def index_names(self):
+        return self.indices.keys()
+
+    def documents_in_index(self, index_name):
+        if index_name not in self.indices:
+            return []
+        return self.indices[index_name][indexfields.INDEX_DOCS]
+
+    def terms(self, index_name):
+        return self.__dictionary(index_name).keys()
+
+    def term_count(self, index_name):
+        return len(self.__dictionary(index_name))
+
+    def term_entry(self, index_name, term):
+        entry = self.__dictionary(index_name).get(term)
+        if entry is None:
+            return None
+        return (entry[indexfields.TOKEN_DOC_FREQ],
+                entry[indexfields.TOKEN_IDF],
+                entry[indexfields.TOKEN_OFFSET],
+                entry[indexfields.TOKEN_LENGTH])
+
+    def max_weight(self, index_name, term):
+        entry = self.__dictionary(index_name).get(term)
+        if entry is None:
+            return 0.0
+        return entry.get(indexfields.TOKEN_MAX_WEIGHT)
+
+    def norm(self, index_name, guid):
+        norms = self.norms.get(index_name)
+        offset = guid - self.first_guid
+        if norms is None or offset < 0 or offset >= len(norms):
+            return 0.0
+        return norms[offset]
+
+    def norm_array(self, index_name):
+        norms = self.norms.get(index_name)
+        if norms is None:
+            return numpy.array([], numpy.float64)
+        return numpy.frombuffer(norms, numpy.float64)
+
+    def column(self, field):
+        return self.columns.get(field)
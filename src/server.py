@@ -0,0 +1,316 @@
+import SocketServer
+import argparse
+import compoundindex
+import featureregistry
+import json
+import lexicon
+import os
+import resultcache
+import signal
+import socket
+import sys
+import threading
+import time
+import tokenizer
+import traceback
+
+from search import Search, open_result_cache, use_index_norms
+
+# Used to load lazily initialised resources (NLTK models, stopwords, the
+# thesaurus, field caches) before the first real query arrives.
+WARM_UP_QUERY = '''<?xml version="1.0" ?>
+<query>
+  <title>washing machine</title>
+  <description>Relevant documents will describe washing machines</description>
+</query>'''
+
+# Request and response keys. Each request and each response is a single line
+# of JSON.
+QUERY = 'query'
+QUERY_FILE = 'query_file'
+ID = 'id'
+TOP_K = 'top_k'
+DEADLINE_MS = 'deadline_ms'
+DROPPED = 'dropped'
+RESULTS = 'results'
+ERROR = 'error'
+ELAPSED_MS = 'elapsed_ms'
+
+
+class SearchService(object):
+    """
+    Runs queries against a resident CompoundIndex.
+
+    Features keep no per-query state (see featureregistry.py): each query
+    has its own Search, and everything features compute for it is kept in
+    the Search's shared object. Queries from several clients therefore run
+    at the same time. The lock only guards the count of queries in progress,
+    so that close() can wait for them before closing the index.
+    """
+    def __init__(self, compound_index, feature_threads=1,
+                 compact_scores=False, result_cache=None, deadline_ms=None):
+        self.compound_index = compound_index
+        self.feature_threads = feature_threads
+        self.compact_scores = compact_scores
+        self.result_cache = result_cache
+        self.deadline_ms = deadline_ms
+        self.__condition = threading.Condition()
+        self.__active = 0
+        self.__closed = False
+
+    def warm_up(self):
+        # Not through the result cache, and without a deadline, so all the
+        # features are run (and measured.)
+        self.search(WARM_UP_QUERY, use_cache=False, measure=True)
+
+    def search(self, query_xml, top_k=None, use_cache=True,
+               deadline_ms=None, measure=None):
+        """Returns the ranked document names for a query, and the names of
+        the features dropped to meet the deadline. If measure is True, the
+        features are measured (see Search.measure_features) even without a
+        deadline."""
+        result_cache = self.result_cache if use_cache else None
+        with self.__condition:
+            if self.__closed:
+                raise RuntimeError('The server is shutting down.')
+            self.__active += 1
+        try:
+            s = Search(query_xml, self.compound_index, top_k=top_k,
+                       feature_threads=self.feature_threads,
+                       compact_scores=self.compact_scores,
+                       deadline_ms=deadline_ms, measure_features=measure)
+            results = [doc for doc, _ in s.run(result_cache)]
+            return results, s.dropped_features
+        finally:
+            with self.__condition:
+                self.__active -= 1
+                self.__condition.notify_all()
+
+    def handle(self, line):
+        """
+        Handles one request line, returning the response as a dict.
+
+        A request is a JSON object with either a `query` (query XML) or a
+        `query_file` (path to a query file), and optionally an `id`, which is
+        echoed back, a `top_k` limiting the number of results, and a
+        `deadline_ms` for the features (by default, the server's.) The
+        response has either `results` (the ranked document names) or an
+        `error`, and lists the features left out to meet the deadline (if
+        any) under `dropped`.
+        """
+        start = time.time()
+        response = {}
+        try:
+            request = json.loads(line)
+            if ID in request:
+                response[ID] = request[ID]
+            if QUERY in request:
+                query_xml = request[QUERY]
+            elif QUERY_FILE in request:
+                with open(request[QUERY_FILE], 'r') as f:
+                    query_xml = f.read()
+            else:
+                raise ValueError('Request needs a `{}` or `{}`.'.format(
+                    QUERY, QUERY_FILE))
+            if isinstance(query_xml, unicode):
+                query_xml = query_xml.encode('utf-8')
+            results, dropped = self.search(
+                query_xml, request.get(TOP_K),
+                deadline_ms=request.get(DEADLINE_MS, self.deadline_ms))
+            response[RESULTS] = results
+            if dropped:
+                response[DROPPED] = dropped
+        except Exception, e:
+            response[ERROR] = '{}: {}'.format(type(e).__name__, e)
+        response[ELAPSED_MS] = round(1000 * (time.time() - start), 3)
+        return response
+
+    def close(self):
+        """
+        Waits for the queries in progress (if any), then closes the index.
+        Later requests are answered with an error.
+        """
+        with self.__condition:
+            self.__closed = True
+            while self.__active:
+                self.__condition.wait()
+            self.compound_index.close()
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """Serves request lines from one client until it disconnects."""
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            response = self.server.service.handle(line)
+            try:
+                self.wfile.write(json.dumps(response) + '\n')
+                self.wfile.flush()
+            except socket.error:
+                return
+
+
+class SearchServer(SocketServer.ThreadingMixIn,
+                   SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, service):
+        SocketServer.UnixStreamServer.__init__(
+            self, socket_path, RequestHandler)
+        self.service = service
+
+
+def serve_socket(service, socket_path):
+    """
+    Serves clients on a Unix socket, each in its own thread, until SIGINT or
+    SIGTERM.
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = SearchServer(socket_path, service)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    print >> sys.stderr, 'Listening on {}'.format(socket_path)
+    # Wait with a timeout, so the main thread can still receive signals.
+    while not stop.is_set():
+        stop.wait(0.5)
+
+    print >> sys.stderr, 'Shutting down'
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    service.close()
+    os.remove(socket_path)
+
+
+def serve_stdin(service):
+    """
+    Serves request lines from stdin until it is closed, writing responses to
+    stdout. Anything else the search prints goes to stderr.
+    """
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        for line in iter(sys.stdin.readline, ''):
+            if not line.strip():
+                continue
+            out.write(json.dumps(service.handle(line)) + '\n')
+            out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout = out
+        service.close()
+
+
+def request(socket_path, query_xml, top_k=None, deadline_ms=None):
+    """
+    Sends a query to a running server, returning the ranked document names.
+    Without a deadline_ms, the server's default is used.
+    """
+    message = {QUERY: query_xml, TOP_K: top_k}
+    if deadline_ms is not None:
+        message[DEADLINE_MS] = deadline_ms
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    try:
+        f = client.makefile('r+')
+        f.write(json.dumps(message) + '\n')
+        f.flush()
+        response = json.loads(f.readline())
+    finally:
+        client.close()
+    if ERROR in response:
+        raise RuntimeError(response[ERROR])
+    return response[RESULTS]
+
+
+def main(args):
+    dictionary_file = os.path.abspath(args.dictionary)
+    postings_file = os.path.abspath(args.postings)
+
+    start = time.time()
+    if args.stem_table:
+        tokenizer.load_stem_table(tokenizer.stem_table_path(dictionary_file))
+    if args.lexicon:
+        lexicon.load(lexicon.lexicon_path(dictionary_file))
+    compound_index = compoundindex.load(dictionary_file, postings_file,
+                                        use_snapshots=args.snapshot)
+    service = SearchService(compound_index, args.feature_threads,
+                            args.compact_scores, open_result_cache(args),
+                            args.deadline_ms)
+    if not args.no_warm_up:
+        # Feature errors are printed by Search.execute; keep them off stdout.
+        out = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            service.warm_up()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            sys.stdout = out
+    print >> sys.stderr, 'Ready in {:.2f}s'.format(time.time() - start)
+
+    if args.socket:
+        serve_socket(service, os.path.abspath(args.socket))
+    else:
+        serve_stdin(service)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Patsnap assignment - Search server. Loads the index once '
+                    'and answers queries, one JSON request per line, on a '
+                    'Unix socket or on stdin.')
+    parser.add_argument('-d', '--dictionary', required=True,
+                        help='dictionary file.')
+    parser.add_argument('-p', '--postings', required=True,
+                        help='postings file.')
+    parser.add_argument('-s', '--socket',
+                        help='path of the Unix socket to listen on. If not '
+                             'given, requests are read from stdin.')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='load the dictionary from its binary snapshot '
+                             'if it is up to date.')
+    parser.add_argument('-t', '--feature-threads', type=int, default=1,
+                        help='run independent features of a query in this '
+                             'many threads.')
+    parser.add_argument('--compact-scores', action='store_true',
+                        help='keep feature scores in float32 arrays (see '
+                             'search.py.)')
+    parser.add_argument('--cache',
+                        help='directory of a result cache (see search.py.)')
+    parser.add_argument('--cache-size', type=float,
+                        default=resultcache.DEFAULT_MAX_BYTES / (1024 * 1024),
+                        help='approximate size limit (in MiB) of the result '
+                             'cache.')
+    parser.add_argument('--deadline-ms', type=float, default=None,
+                        help='default time (in ms) the features of a query '
+                             'may take (see search.py.)')
+    parser.add_argument('--stem-table', action='store_true',
+                        help='look up the stems of words in the table written '
+                             'by index.py --stem-table, if there is one.')
+    parser.add_argument('--lexicon', action='store_true',
+                        help='read stopwords, stems, synonyms and IPC '
+                             'labels from the lexicon written by lexicon.py, '
+                             'if there is one.')
+    parser.add_argument('--index-norms', action='store_true',
+                        help='normalise documents by the norms stored in '
+                             'the index in the VSM features of single zones '
+                             '(see search.py.)')
+    parser.add_argument('--disable-feature', action='append', default=[],
+                        metavar='NAME', choices=featureregistry.names(),
+                        help='do not load or run this feature (may be given '
+                             'more than once.)')
+    parser.add_argument('--no-warm-up', action='store_true',
+                        help='do not run a warm-up query before serving.')
+    args = parser.parse_args()
+    Search.disabled_features = frozenset(args.disable_feature)
+    if args.index_norms:
+        use_index_norms()
+    main(args)
@@ -0,0 +1,396 @@
+import array
+import argparse
+import fieldstore
+import indexfields
+import json
+import mmap
+import numpy
+import os
+import segment
+import struct
+
+# A snapshot is a binary copy of a dictionary file (as written by index.py)
+# that can be memory-mapped instead of parsed. It is laid out as:
+#
+#   MAGIC
+#   uint32 length of the header
+#   header: a JSON object (see write_snapshot)
+#   sections, each starting at a multiple of ALIGNMENT
+#
+# Every section is either a flat NumPy array or a blob of UTF-8 strings
+# separated by SEPARATOR. Section offsets in the header are relative to the
+# start of the first section.
+MAGIC = 'SNP1'
+ALIGNMENT = 8
+SEPARATOR = '\0'
+
+BLOB = 'blob'
+
+# Header keys.
+SOURCE_SIZE = 'source_size'
+SOURCE_MTIME = 'source_mtime'
+GUID_COUNT = 'guid_count'
+SECTIONS = 'sections'
+FIELD_TYPES = 'field_types'
+
+
+def snapshot_path(dictionary_path):
+    """
+    Returns the path of the snapshot belonging to a dictionary file.
+    """
+    return dictionary_path + '.snapshot'
+
+
+def zone_section(zone, name):
+    return 'zone:{}:{}'.format(zone, name)
+
+
+def field_section(field, name):
+    return 'field:{}:{}'.format(field, name)
+
+
+def _join(strings):
+    return SEPARATOR.join(s.encode('utf-8') for s in strings)
+
+
+def _split(blob):
+    if not blob:
+        return []
+    return blob.decode('utf-8').split(SEPARATOR)
+
+
+def read_header(path, magic=MAGIC):
+    """
+    Reads the header of a snapshot file (or another file of sections starting
+    with magic), returning (header, data_start), or None if the file is not
+    one.
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(len(magic) + 4)
+        if len(prefix) < len(magic) + 4 or prefix[:len(magic)] != magic:
+            return None
+        header_length, = struct.unpack('<I', prefix[len(magic):])
+        header = json.loads(f.read(header_length))
+    data_start = len(magic) + 4 + header_length
+    data_start += -data_start % ALIGNMENT
+    return header, data_start
+
+
+def read_section(buf, data_start, layout):
+    """
+    Returns a section of a file read into (or memory-mapped as) buf, given
+    its entry in the header's SECTIONS: a NumPy array over buf, or a blob.
+    """
+    offset, dtype, count = layout
+    start = data_start + offset
+    if dtype == BLOB:
+        return buf[start:start + count]
+    return numpy.frombuffer(buf, numpy.dtype(dtype), count, start)
+
+
+def write_sections(path, magic, header, sections):
+    """
+    Writes a file laid out as a snapshot, starting with magic. sections is a
+    list of (name, data)-tuples, where data is a NumPy array or a blob; their
+    layout is added to the header (a dict) under SECTIONS.
+    """
+    layout = {}
+    offset = 0
+    for name, data in sections:
+        if isinstance(data, numpy.ndarray):
+            layout[name] = [offset, data.dtype.str, len(data)]
+            offset += data.nbytes
+        else:
+            layout[name] = [offset, BLOB, len(data)]
+            offset += len(data)
+        offset += -offset % ALIGNMENT
+    header = dict(header)
+    header[SECTIONS] = layout
+    header = json.dumps(header, sort_keys=True)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(magic)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write('\0' * (-f.tell() % ALIGNMENT))
+        for _, data in sections:
+            if isinstance(data, numpy.ndarray):
+                f.write(data.tostring())
+            else:
+                f.write(data)
+            f.write('\0' * (-f.tell() % ALIGNMENT))
+    os.rename(tmp_path, path)
+
+
+def is_fresh(dictionary_path):
+    """
+    True if the dictionary file has a snapshot that was written from its
+    current contents.
+    """
+    path = snapshot_path(dictionary_path)
+    if not os.path.exists(path):
+        return False
+    result = read_header(path)
+    if result is None:
+        return False
+    header, _ = result
+    stat = os.stat(dictionary_path)
+    return header[SOURCE_SIZE] == stat.st_size and \
+        header[SOURCE_MTIME] == stat.st_mtime
+
+
+def write_snapshot(dictionary_path):
+    """
+    Writes the snapshot of a dictionary file, returning its path.
+    """
+    stat = os.stat(dictionary_path)
+    with open(dictionary_path, 'r') as f:
+        json_obj = json.load(f)
+
+    first_guid = json_obj[indexfields.FIRST_GUID]
+    gd_map = {int(key): val
+              for key, val in json_obj[indexfields.GUID_DOC_MAP].iteritems()}
+    guid_count = len(gd_map)
+
+    # (name, data) for each section, where data is a NumPy array or a blob.
+    sections = []
+
+    # Document names are stored in guid order, with the offset of each name
+    # (and of the end of the last one) so that a single name can be sliced
+    # out without splitting the whole blob.
+    names = [gd_map[first_guid + i].encode('utf-8')
+             for i in xrange(guid_count)]
+    name_offsets = numpy.zeros(guid_count + 1, numpy.int64)
+    numpy.cumsum([len(name) + len(SEPARATOR) for name in names],
+                 out=name_offsets[1:])
+    sections.append(('doc_names', SEPARATOR.join(names)))
+    sections.append(('doc_name_offsets', name_offsets))
+
+    zones = sorted(json_obj[indexfields.ZONES])
+    for zone in zones:
+        index = json_obj[indexfields.ZONES][zone]
+        dictionary = index[indexfields.INDEX_DICT]
+        terms = sorted(dictionary)
+        entries = [dictionary[term] for term in terms]
+        sections.extend([
+            (zone_section(zone, 'docs'),
+             numpy.array(index[indexfields.INDEX_DOCS], numpy.int32)),
+            (zone_section(zone, 'norms'),
+             numpy.array(index[indexfields.INDEX_NORMS], numpy.float64)),
+            (zone_section(zone, 'terms'), _join(terms)),
+            (zone_section(zone, 'df'), numpy.array(
+                [e[indexfields.TOKEN_DOC_FREQ] for e in entries],
+                numpy.int32)),
+            (zone_section(zone, 'idf'), numpy.array(
+                [e[indexfields.TOKEN_IDF] for e in entries], numpy.float64)),
+            (zone_section(zone, 'offset'), numpy.array(
+                [e[indexfields.TOKEN_OFFSET] for e in entries], numpy.int64)),
+            (zone_section(zone, 'length'), numpy.array(
+                [e[indexfields.TOKEN_LENGTH] for e in entries], numpy.int32)),
+        ])
+        # Dictionaries written before the largest weights were stored have
+        # none.
+        if all(indexfields.TOKEN_MAX_WEIGHT in e for e in entries):
+            sections.append((zone_section(zone, 'max_weight'), numpy.array(
+                [e[indexfields.TOKEN_MAX_WEIGHT] for e in entries],
+                numpy.float64)))
+
+    field_types = {}
+    for field, column in json_obj[indexfields.FIELDS].iteritems():
+        field_types[field] = column[indexfields.COLUMN_TYPE]
+        sections.append((field_section(field, 'codes'), numpy.array(
+            column[indexfields.COLUMN_CODES], numpy.int32)))
+        if indexfields.COLUMN_VALUES in column:
+            sections.append((field_section(field, 'values'),
+                             json.dumps(column[indexfields.COLUMN_VALUES])))
+
+    path = snapshot_path(dictionary_path)
+    write_sections(path, MAGIC, {
+        SOURCE_SIZE: stat.st_size,
+        SOURCE_MTIME: stat.st_mtime,
+        indexfields.FIRST_GUID: first_guid,
+        GUID_COUNT: guid_count,
+        indexfields.ZONES: zones,
+        FIELD_TYPES: field_types,
+    }, sections)
+    return path
+
+
+class SnapshotSegment(segment.SegmentBase):
+    """
+    A segment whose dictionary is read from a snapshot file.
+
+    Nothing is parsed when the segment is opened: arrays are used in place
+    over the memory-mapped file, and the lookup tables of a zone (or field)
+    are only built the first time it is used.
+    """
+    def __init__(self, path, postings_path):
+        super(SnapshotSegment, self).__init__(postings_path)
+        result = read_header(path)
+        if result is None:
+            self.postings.close()
+            raise ValueError('{} is not a snapshot file.'.format(path))
+        header, self.__data_start = result
+
+        self.__file = open(path, 'rb')
+        self.__mmap = mmap.mmap(self.__file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+        self.__sections = header[SECTIONS]
+        self.__zones = header[indexfields.ZONES]
+        self.__field_types = header[FIELD_TYPES]
+        self.__guid_count = header[GUID_COUNT]
+        self.first_guid = header[indexfields.FIRST_GUID]
+
+        self.__name_offsets = self.__section('doc_name_offsets')
+        self.__dg_map = None
+        self.__terms = {}
+        self.__docs = {}
+        self.__norms = {}
+        self.__max_weights = {}
+        self.__columns = {}
+
+    def __section(self, name):
+        return read_section(self.__mmap, self.__data_start,
+                            self.__sections[name])
+
+    def __term_ids(self, index_name):
+        """
+        Returns a dict of term: position in the zone's term arrays.
+        """
+        if index_name not in self.__terms:
+            if index_name in self.__zones:
+                terms = _split(self.__section(
+                    zone_section(index_name, 'terms')))
+                self.__terms[index_name] = (
+                    {term: i for i, term in enumerate(terms)},
+                    self.__section(zone_section(index_name, 'df')),
+                    self.__section(zone_section(index_name, 'idf')),
+                    self.__section(zone_section(index_name, 'offset')),
+                    self.__section(zone_section(index_name, 'length')))
+            else:
+                self.__terms[index_name] = ({}, None, None, None, None)
+        return self.__terms[index_name]
+
+    def guid_count(self):
+        return self.__guid_count
+
+    def document_name(self, guid):
+        i = guid - self.first_guid
+        if i < 0 or i >= self.__guid_count:
+            return None
+        start = self.__data_start + self.__sections['doc_names'][0]
+        return self.__mmap[start + self.__name_offsets[i]:
+                           start + self.__name_offsets[i + 1] -
+                           len(SEPARATOR)].decode('utf-8')
+
+    def guid_for_document_name(self, name):
+        if self.__dg_map is None:
+            names = _split(self.__section('doc_names'))
+            self.__dg_map = {
+                doc: self.first_guid + i for i, doc in enumerate(names)
+            }
+        return self.__dg_map.get(name)
+
+    def index_names(self):
+        return list(self.__zones)
+
+    def documents_in_index(self, index_name):
+        if index_name not in self.__zones:
+            return []
+        if index_name not in self.__docs:
+            self.__docs[index_name] = self.__section(
+                zone_section(index_name, 'docs')).tolist()
+        return self.__docs[index_name]
+
+    def terms(self, index_name):
+        return self.__term_ids(index_name)[0].keys()
+
+    def term_count(self, index_name):
+        return len(self.__term_ids(index_name)[0])
+
+    def term_entry(self, index_name, term):
+        ids, df, idf, offset, length = self.__term_ids(index_name)
+        i = ids.get(term)
+        if i is None:
+            return None
+        return int(df[i]), float(idf[i]), int(offset[i]), int(length[i])
+
+    def max_weight(self, index_name, term):
+        i = self.__term_ids(index_name)[0].get(term)
+        if i is None:
+            return 0.0
+        if index_name not in self.__max_weights:
+            name = zone_section(index_name, 'max_weight')
+            self.__max_weights[index_name] = \
+                self.__section(name) if name in self.__sections else None
+        max_weights = self.__max_weights[index_name]
+        return None if max_weights is None else float(max_weights[i])
+
+    def norm(self, index_name, guid):
+        if index_name not in self.__zones:
+            return 0.0
+        norms = self.norm_array(index_name)
+        offset = guid - self.first_guid
+        if offset < 0 or offset >= len(norms):
+            return 0.0
+        return float(norms[offset])
+
+    def norm_array(self, index_name):
+        if index_name not in self.__zones:
+            return numpy.array([], numpy.float64)
+        if index_name not in self.__norms:
+            self.__norms[index_name] = self.__section(
+                zone_section(index_name, 'norms'))
+        return self.__norms[index_name]
+
+    def column(self, field):
+        if field not in self.__field_types:
+            return None
+        if field not in self.__columns:
+            column = {
+                indexfields.COLUMN_TYPE: self.__field_types[field],
+                indexfields.COLUMN_CODES: array.array(
+                    'i', self.__section(
+                        field_section(field, 'codes')).tostring()),
+            }
+            values = field_section(field, 'values')
+            if values in self.__sections:
+                column[indexfields.COLUMN_VALUES] = \
+                    json.loads(self.__section(values))
+            self.__columns[field] = fieldstore.FieldColumn(
+                column, self.first_guid)
+        return self.__columns[field]
+
+    def close(self):
+        super(SnapshotSegment, self).close()
+        self.__mmap.close()
+        self.__file.close()
+
+
+def write_snapshots(dictionary_path):
+    """
+    Writes snapshots for the dictionaries of every segment of an index.
+    """
+    # Imported here, as compoundindex imports this module.
+    import compoundindex
+
+    return [write_snapshot(path) for path, _ in
+            compoundindex.segment_paths(dictionary_path, None)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Writes binary snapshots of an existing index, for faster '
+                    'loading with search.py --snapshot.')
+    parser.add_argument(
+        '-d', '--dictionary', default='dictionary.txt',
+        help='Dictionary file of the index.')
+    args = parser.parse_args()
+
+    for path in write_snapshots(args.dictionary):
+        print 'Wrote {}'.format(path)
+
+
+if __name__ == '__main__':
+    main()
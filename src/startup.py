@@ -0,0 +1,57 @@
+import argparse
+import compoundindex
+import os
+import snapshot
+import time
+
+
+def time_load(dictionary_path, postings_path, use_snapshots, index_name,
+              term):
+    """
+    Loads the index and reads one postings list, as the first query would.
+
+    Returns (seconds to load, seconds to the first postings list.)
+    """
+    start = time.time()
+    compound_index = compoundindex.load(dictionary_path, postings_path,
+                                        use_snapshots=use_snapshots)
+    loaded = time.time()
+    compound_index.postings_arrays(index_name, term)
+    first = time.time()
+    compound_index.close()
+    return loaded - start, first - start
+
+
+def main(args):
+    dictionary_path = os.path.abspath(args.dictionary)
+    postings_path = os.path.abspath(args.postings)
+
+    if not snapshot.is_fresh(dictionary_path):
+        snapshot.write_snapshots(dictionary_path)
+
+    for name, use_snapshots in [('json', False), ('snapshot', True)]:
+        timings = [time_load(dictionary_path, postings_path, use_snapshots,
+                             args.zone, args.term)
+                   for _ in xrange(args.repeat)]
+        print '{:<10} load {:8.2f} ms   first postings {:8.2f} ms'.format(
+            name,
+            1000 * min(t[0] for t in timings),
+            1000 * min(t[1] for t in timings))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compares the time to load an index from JSON and from '
+                    'its snapshot.')
+    parser.add_argument('-d', '--dictionary', required=True,
+                        help='dictionary file.')
+    parser.add_argument('-p', '--postings', required=True,
+                        help='postings file.')
+    parser.add_argument('-z', '--zone', default='Abstract',
+                        help='zone of the term to look up.')
+    parser.add_argument('-t', '--term', default='water',
+                        help='term whose postings list is read.')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='number of runs; the fastest is reported.')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+
+from budget import *
+from nose.tools import eq_ as assert_eq
+
+
+def test_plan():
+    stats = FeatureStats()
+    stats.record('cheap', 1.0, 1.0)
+    stats.record('useful', 10.0, 50.0)
+    stats.record('expensive', 20.0, 1.0)
+
+    names = ['cheap', 'useful', 'expensive', 'new']
+    assert_eq(set(names), plan(names, stats, 100))
+    # By contribution per ms: useful (5), cheap (1), expensive (0.05).
+    assert_eq(set(['useful', 'cheap', 'new']), plan(names, stats, 15))
+    assert_eq(set(['cheap', 'new']), plan(names, stats, 5))
+
+
+def test_remeasure_dropped():
+    stats = FeatureStats()
+    stats.record('slow', 100.0, 1.0)
+    stats.record('fast', 1.0, 1.0)
+    for _ in xrange(REMEASURE_AFTER - 1):
+        assert_eq(set(['fast']), plan(['slow', 'fast'], stats, 10))
+        stats.drop('slow')
+    assert not stats.needs_measuring('slow')
+    stats.drop('slow')
+    assert stats.needs_measuring('slow')
+    assert_eq(set(['slow', 'fast']), plan(['slow', 'fast'], stats, 10))
+    # Measuring it again restarts the count.
+    stats.record('slow', 100.0, 1.0)
+    assert not stats.needs_measuring('slow')
+    assert_eq(set(['fast']), plan(['slow', 'fast'], stats, 10))
+
+    # Stats saved without the count load as never dropped.
+    stats = FeatureStats()
+    stats.stats = {'old': {COST_MS: 1.0, CONTRIBUTION: 1.0, RUNS: 3}}
+    assert not stats.needs_measuring('old')
+    stats.drop('old')
+    assert_eq(1, stats.stats['old'][DROPPED])
+
+
+def test_record_and_save():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'stats.json')
+        stats = FeatureStats(path)
+        assert_eq(None, stats.cost('feature'))
+        stats.record('feature', 10.0, 2.0)
+        stats.record('feature', 20.0, 2.0)
+        assert_eq(10.0 + SMOOTHING * 10.0, stats.cost('feature'))
+        assert_eq(2.0, stats.contribution('feature'))
+        stats.save()
+        assert_eq(stats.cost('feature'), FeatureStats(path).cost('feature'))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,32 @@
+import featureregistry
+import search
+
+from nose.tools import eq_ as assert_eq, raises
+
+
+def test_load():
+    for name in featureregistry.names():
+        feature = featureregistry.load(name)
+        assert_eq(name, feature.NAME)
+        assert featureregistry.load(name) is feature
+
+
+@raises(KeyError)
+def test_unknown_feature():
+    featureregistry.load('VSM_Nothing')
+
+
+def test_search_features():
+    for name, _ in search.Search.FEATURES:
+        assert name in featureregistry.FEATURES, name
+
+    disabled = search.Search.disabled_features
+    try:
+        search.Search.disabled_features = frozenset(['VSM_Title'])
+        names = [name for name, _ in search.Search.enabled_features()]
+    finally:
+        search.Search.disabled_features = disabled
+    assert 'VSM_Title' not in names
+    # Zero weight.
+    assert 'Cites' not in names
+    assert 'VSM_Abstract' in names
@@ -0,0 +1,48 @@
+from fieldstore import *
+from nose.tools import eq_ as assert_eq
+
+
+def test_int_column():
+    encoded = encode_column({10: 3, 12: 0}, 10, 4)
+    assert_eq(INT, encoded['type'])
+
+    column = FieldColumn(encoded, 10)
+    assert_eq(4, len(column))
+    assert_eq(3, column.get(10))
+    assert_eq(None, column.get(11))
+    assert_eq(0, column.get(12))
+    assert_eq(None, column.get(13))
+    assert_eq([(10, 3), (12, 0)], list(column.items()))
+
+
+def test_categorical_column():
+    encoded = encode_column({0: 'H', 1: 'A', 3: 'H'}, 0, 4)
+    assert_eq(CATEGORICAL, encoded['type'])
+    assert_eq(['A', 'H'], encoded['values'])
+
+    column = FieldColumn(encoded, 0)
+    assert_eq('H', column.get(0))
+    assert_eq('A', column.get(1))
+    assert_eq(None, column.get(2))
+    assert_eq([(0, 'H'), (1, 'A'), (3, 'H')], list(column.items()))
+
+
+def test_mixed_values_are_categorical():
+    encoded = encode_column({0: 5, 1: 'n/a'}, 0, 2)
+    assert_eq(CATEGORICAL, encoded['type'])
+
+    column = FieldColumn(encoded, 0)
+    assert_eq(5, column.get(0))
+    assert_eq('n/a', column.get(1))
+
+
+def test_guid_out_of_range():
+    column = FieldColumn(encode_column({5: 1}, 5, 1), 5)
+    assert_eq(None, column.get(4))
+    assert_eq(None, column.get(6))
+
+
+def test_empty_column():
+    column = FieldColumn(encode_column({}, 0, 3), 0)
+    assert_eq([], list(column.items()))
+    assert_eq(None, column.get(1))
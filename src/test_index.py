@@ -0,0 +1,338 @@
+import compoundindex
+import index
+import math
+import os
+import random
+import shutil
+import tempfile
+
+from index import DirectoryProcessor, IndexBuilder, merge_segments, \
+    update_index
+from nose.tools import eq_ as assert_eq
+
+WORDS = ['pump', 'valve', 'water', 'engine', 'gear', 'shaft', 'motor', 'fluid',
+         'pressure', 'seal', 'rotor', 'blade', 'housing', 'spring', 'piston',
+         'cylinder', 'bearing', 'nozzle', 'filter', 'sensor']
+
+
+def tokenize(text):
+    """Stands in for free_text, which needs NLTK's data."""
+    return text.lower().split()
+
+
+def write_corpus(directory, count=150, seed=0):
+    """Writes count patents with random titles and abstracts; returns their
+    doc_ids."""
+    rng = random.Random(seed)
+    words = WORDS + ['{}{}'.format(w, i) for w in WORDS for i in xrange(10)]
+    doc_ids = []
+    for i in xrange(count):
+        doc_id = 'US{:05}'.format(i)
+        title = ' '.join(rng.choice(WORDS) for _ in xrange(rng.randint(1, 6)))
+        abstract = ' '.join(rng.choice(words)
+                            for _ in xrange(rng.randint(20, 80)))
+        with open(os.path.join(directory, doc_id + '.xml'), 'w') as f:
+            f.write('<doc><str name="Title">{}</str>'
+                    '<str name="Abstract">{}</str>'
+                    '<str name="Cited By Count">{}</str>'
+                    '<str name="IPC Section">{}</str></doc>'.format(
+                        title, abstract, rng.randint(0, 9), rng.choice('ABGH')))
+        doc_ids.append(doc_id)
+    return doc_ids
+
+
+def build(doc_dir, out_dir, **kwargs):
+    """Indexes doc_dir into out_dir; returns the dictionary and postings
+    paths."""
+    dict_path = os.path.join(out_dir, 'dictionary.txt')
+    postings_path = os.path.join(out_dir, 'postings.txt')
+    ib = IndexBuilder(dict_path, postings_path,
+                      kwargs.pop('memory_budget', None))
+    DirectoryProcessor(doc_dir, ib, tokenize, **kwargs).run()
+    return dict_path, postings_path
+
+
+def copy_documents(doc_ids, from_dir, to_dir):
+    for doc_id in doc_ids:
+        shutil.copy(os.path.join(from_dir, doc_id + '.xml'), to_dir)
+
+
+def scores(dict_path, postings_path):
+    """
+    Returns, for each zone and term, its document frequency, idf and the
+    weight (log-tf times idf, over the document's norm) of each document by
+    name: what the VSM features score with, independent of guids.
+    """
+    compound = compoundindex.load(dict_path, postings_path)
+    try:
+        result = {}
+        for zone in compound.indices():
+            for term in compound.terms_in_index(zone):
+                idf = compound.inverse_document_frequency(zone, term)
+                weights = dict(
+                    (compound.document_name_for_guid(guid),
+                     (1 + math.log(tf, 10)) * idf /
+                     compound.document_norm(zone, guid))
+                    for guid, tf in compound.postings_list(zone, term))
+                result[zone, term] = (
+                    compound.document_frequency(zone, term), idf, weights)
+        return result
+    finally:
+        compound.close()
+
+
+def max_weights(dict_path, postings_path):
+    """
+    Returns, for each zone and term, its max_weight in the index and the
+    largest log-tf over norm of its documents.
+    """
+    compound = compoundindex.load(dict_path, postings_path)
+    try:
+        result = {}
+        for zone in compound.indices():
+            for term in compound.terms_in_index(zone):
+                result[zone, term] = (
+                    compound.max_weight(zone, term),
+                    max((1 + math.log(tf, 10)) /
+                        compound.document_norm(zone, guid)
+                        for guid, tf in compound.postings_list(zone, term)))
+        return result
+    finally:
+        compound.close()
+
+
+def read_files(paths):
+    contents = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            contents.append(f.read())
+    return contents
+
+
+class Corpus(object):
+    """A corpus in a temporary directory, and a directory for indices."""
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.doc_dir = os.path.join(self.directory, 'docs')
+        os.mkdir(self.doc_dir)
+        self.doc_ids = write_corpus(self.doc_dir)
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def build(self, name, doc_dir=None, **kwargs):
+        out_dir = os.path.join(self.directory, name)
+        os.mkdir(out_dir)
+        return build(doc_dir or self.doc_dir, out_dir, **kwargs)
+
+
+def test_norm_does_not_depend_on_order():
+    tf = dict(('term{}'.format(i), i % 7 + 1) for i in xrange(200))
+    items = tf.items()
+    norms = set()
+    for seed in xrange(5):
+        random.Random(seed).shuffle(items)
+        ib = IndexBuilder(os.devnull, os.devnull)
+        ib.add_term_frequencies_for_zone(dict(items), 'US1', 'Title')
+        norms.add(ib.m_file[index.indexfields.ZONES]['Title'][
+            index.indexfields.INDEX_NORMS][0])
+    assert_eq(1, len(norms))
+    expected = math.sqrt(sum((1 + math.log(i % 7 + 1, 10)) ** 2
+                             for i in xrange(200)))
+    assert abs(norms.pop() - expected) < 1e-9
+
+
+class TestBuilds(Corpus):
+    def test_workers_match_serial(self):
+        serial = read_files(self.build('serial'))
+        assert_eq(serial, read_files(self.build('workers', workers=3)))
+
+    def test_any_number_of_workers_matches_serial(self):
+        # Fewer slices than workers, and slices of a single document.
+        serial = read_files(self.build('serial'))
+        default = DirectoryProcessor.SLICE_SIZE
+        for workers, slice_size in [(2, default), (4, 1), (8, 100)]:
+            DirectoryProcessor.SLICE_SIZE = slice_size
+            try:
+                paths = self.build('workers{}'.format(workers),
+                                   workers=workers)
+            finally:
+                DirectoryProcessor.SLICE_SIZE = default
+            assert_eq(serial, read_files(paths))
+
+    def test_memory_budget_matches_in_memory_build(self):
+        in_memory = read_files(self.build('in_memory'))
+        # Spill a run after every few documents.
+        paths = self.build('spimi', memory_budget=20000)
+        assert_eq(in_memory, read_files(paths))
+        assert_eq([], [f for f in os.listdir(os.path.dirname(paths[1]))
+                       if f.endswith('.run')])
+
+    def test_max_weights(self):
+        for (zone, term), (stored, largest) in max_weights(
+                *self.build('index')).iteritems():
+            assert_eq(largest, stored)
+        compound = compoundindex.load(*self.build('other'))
+        assert_eq(0, compound.max_weight('Title', 'missing'))
+        compound.close()
+
+    def test_update_and_merge_match_fresh_build(self):
+        # The update replaces 20 of the documents and adds 50.
+        base_dir, update_dir, fresh_dir = [
+            os.path.join(self.directory, name)
+            for name in ['base', 'update', 'fresh']]
+        for directory in [base_dir, update_dir, fresh_dir]:
+            os.mkdir(directory)
+        copy_documents(self.doc_ids[:100], self.doc_dir, base_dir)
+        changed_dir = os.path.join(self.directory, 'changed')
+        os.mkdir(changed_dir)
+        write_corpus(changed_dir, seed=1)
+        copy_documents(self.doc_ids[80:], changed_dir, update_dir)
+        copy_documents(self.doc_ids[:80], base_dir, fresh_dir)
+        copy_documents(self.doc_ids[80:], update_dir, fresh_dir)
+
+        out_dir = os.path.join(self.directory, 'updated')
+        os.mkdir(out_dir)
+        dict_path, postings_path = build(base_dir, out_dir)
+        base = compoundindex.load(dict_path, postings_path)
+        replaced = [base.guid_for_document_name(doc_id)
+                    for doc_id in self.doc_ids[80:100]]
+        base.close()
+        assert None not in replaced
+        update_index(update_dir, dict_path, postings_path,
+                     free_text_tokenizer=tokenize)
+
+        updated = compoundindex.load(dict_path, postings_path)
+        try:
+            assert_eq(2, updated.segment_count())
+            for zone in updated.indices():
+                for term in updated.terms_in_index(zone):
+                    guids, _ = updated.postings_arrays(zone, term)
+                    numpy_guids, _ = updated.postings_numpy(zone, term)
+                    for guid in replaced:
+                        assert guid not in guids
+                        assert guid not in numpy_guids
+                    assert_eq(len(guids),
+                              updated.document_frequency(zone, term))
+                guids = range(-1, updated.max_guid() + 2)
+                assert_eq([updated.document_norm(zone, guid)
+                           for guid in guids],
+                          updated.document_norms(zone, guids).tolist())
+        finally:
+            updated.close()
+
+        expected = scores(*self.build('fresh_index', doc_dir=fresh_dir))
+        assert_eq(expected, scores(dict_path, postings_path))
+        # Replaced documents still count towards the largest weights.
+        for stored, largest in max_weights(dict_path,
+                                           postings_path).itervalues():
+            assert stored >= largest
+        # With a small budget, the postings are spilled to runs.
+        merge_segments(dict_path, postings_path, memory_budget=20000)
+        manifest = compoundindex.read_manifest(dict_path)
+        assert_eq([], manifest[index.indexfields.SEGMENTS])
+        assert_eq(1, manifest[index.indexfields.GENERATION])
+        assert_eq(expected, scores(dict_path, postings_path))
+        for stored, largest in max_weights(dict_path,
+                                           postings_path).itervalues():
+            assert_eq(largest, stored)
+        # Only the merged files are left.
+        assert_eq(['dictionary.txt.g1', 'postings.txt.g1'],
+                  sorted(f for f in os.listdir(out_dir)
+                         if f.startswith(('dictionary', 'postings')) and
+                         not f.endswith('lock') and
+                         not f.endswith('.segments')))
+
+        # The merged index can be updated and merged again.
+        update_index(update_dir, dict_path, postings_path,
+                     free_text_tokenizer=tokenize)
+        merge_segments(dict_path, postings_path)
+        assert_eq(2, compoundindex.read_manifest(dict_path)[
+            index.indexfields.GENERATION])
+        assert_eq(expected, scores(dict_path, postings_path))
+
+    def updated_index(self, name):
+        """
+        Indexes the first 100 documents, then adds the last 70 (changed) as
+        an update. Returns the dictionary and postings paths, and the
+        directory of the update.
+        """
+        base_dir, update_dir, changed_dir, out_dir = [
+            os.path.join(self.directory, name + suffix)
+            for suffix in ['_base', '_update', '_changed', '']]
+        for directory in [base_dir, update_dir, changed_dir, out_dir]:
+            os.mkdir(directory)
+        copy_documents(self.doc_ids[:100], self.doc_dir, base_dir)
+        write_corpus(changed_dir, seed=1)
+        copy_documents(self.doc_ids[80:], changed_dir, update_dir)
+        dict_path, postings_path = build(base_dir, out_dir)
+        update_index(update_dir, dict_path, postings_path,
+                     free_text_tokenizer=tokenize)
+        return dict_path, postings_path, update_dir
+
+    def test_interrupted_merge_changes_nothing(self):
+        dict_path, postings_path, _ = self.updated_index('interrupted')
+        expected = scores(dict_path, postings_path)
+        manifest = compoundindex.read_manifest(dict_path)
+
+        def crash(dict_path, manifest):
+            raise IOError('No space left on device')
+        default = index.write_manifest
+        index.write_manifest = crash
+        try:
+            merge_segments(dict_path, postings_path)
+            assert False
+        except IOError:
+            pass
+        finally:
+            index.write_manifest = default
+        assert_eq(manifest, compoundindex.read_manifest(dict_path))
+        assert_eq(expected, scores(dict_path, postings_path))
+
+        # The next merge replaces the files left behind.
+        merge_segments(dict_path, postings_path)
+        assert_eq(1, compoundindex.read_manifest(dict_path)[
+            index.indexfields.GENERATION])
+        assert_eq(expected, scores(dict_path, postings_path))
+
+    def test_update_during_merge(self):
+        dict_path, postings_path, update_dir = self.updated_index('during')
+        # While the segments are merged, documents 0-9 are replaced and 10
+        # added.
+        again_dir = os.path.join(self.directory, 'again')
+        os.mkdir(again_dir)
+        write_corpus(again_dir, count=160, seed=2)
+        again = self.doc_ids[:10] + ['US{:05}'.format(i)
+                                     for i in xrange(150, 160)]
+        for name in os.listdir(again_dir):
+            if name[:-len('.xml')] not in again:
+                os.remove(os.path.join(again_dir, name))
+
+        def write_and_update(*args):
+            guids = default(*args)
+            update_index(again_dir, dict_path, postings_path,
+                         free_text_tokenizer=tokenize)
+            return guids
+        default = index.write_merged
+        index.write_merged = write_and_update
+        try:
+            merge_segments(dict_path, postings_path)
+        finally:
+            index.write_merged = default
+        assert_eq(1, len(compoundindex.read_manifest(dict_path)[
+            index.indexfields.SEGMENTS]))
+
+        fresh_dir = os.path.join(self.directory, 'during_fresh')
+        os.mkdir(fresh_dir)
+        copy_documents(self.doc_ids[10:80], self.doc_dir, fresh_dir)
+        copy_documents(self.doc_ids[80:], update_dir, fresh_dir)
+        copy_documents(again, again_dir, fresh_dir)
+        expected = scores(*self.build('during_index', doc_dir=fresh_dir))
+        assert_eq(expected, scores(dict_path, postings_path))
+
+    def test_pipeline_matches_serial(self):
+        serial = read_files(self.build('serial'))
+        for workers in [1, 3]:
+            paths = self.build('pipeline{}'.format(workers), workers=workers,
+                               use_pipeline=True, queue_size=1)
+            assert_eq(serial, read_files(paths))
@@ -0,0 +1,79 @@
+import json
+import lexicon
+import os
+import shutil
+import tempfile
+import tokenizer
+import utils
+
+from nose.tools import eq_ as assert_eq, raises
+
+STOPWORDS = ['the', 'a', 'of', 'and']
+STEMS = {'pumps': 'pump', 'geese': 'goose', u'caf\xe9s': u'caf\xe9'}
+THESAURUS = {'pump': ['siphon', 'compressor'], 'valve': [], 'tap': ['faucet']}
+IPC_SECTIONS = {'G': ['physic'], 'H': ['electr']}
+
+
+def write(directory):
+    path = os.path.join(directory, 'dictionary.txt.lexicon')
+    lexicon.write_lexicon(path, STOPWORDS, STEMS, THESAURUS, IPC_SECTIONS)
+    return path
+
+
+def test_lexicon():
+    directory = tempfile.mkdtemp()
+    try:
+        lex = lexicon.Lexicon(write(directory))
+        try:
+            assert_eq(4, len(lex.stopwords))
+            for word in STOPWORDS:
+                assert word in lex.stopwords
+            assert 'pump' not in lex.stopwords
+
+            for word, stem in STEMS.iteritems():
+                assert_eq(stem, lex.stems.get(word))
+            assert_eq(None, lex.stems.get('valve'))
+
+            for word, stems in THESAURUS.iteritems():
+                assert_eq(stems, lex.thesaurus.values(word))
+            assert_eq([], lex.thesaurus.values('siphon'))
+
+            assert_eq(IPC_SECTIONS, lex.ipc_sections)
+        finally:
+            lex.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_current_lexicon():
+    directory = tempfile.mkdtemp()
+    try:
+        assert_eq(None, lexicon.load(os.path.join(directory, 'missing')))
+        assert_eq(None, lexicon.current())
+        lex = lexicon.load(write(directory))
+        try:
+            assert lexicon.current() is lex
+            assert_eq(['pump', 'water'],
+                      utils.without_stopwords(['the', 'pump', 'of', 'water']))
+            # The stemmer would give 'gees'.
+            assert_eq(['goose', 'pump'], tokenizer.stem_all(['geese', 'pump']))
+        finally:
+            lexicon.unload()
+        assert_eq(None, lexicon.current())
+    finally:
+        shutil.rmtree(directory)
+
+
+@raises(ValueError)
+def test_other_version():
+    directory = tempfile.mkdtemp()
+    try:
+        path = write(directory)
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data.replace(json.dumps(lexicon.VERSION_KEY) + ': 1',
+                                 json.dumps(lexicon.VERSION_KEY) + ': 0'))
+        lexicon.Lexicon(path)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,68 @@
+import os
+import pipeline
+import random
+import time
+
+from nose.tools import eq_ as assert_eq, raises
+
+
+def read(batch):
+    return [(x, os.getpid()) for x in batch]
+
+
+def square(data):
+    # Finish out of order.
+    time.sleep(random.random() * 0.01)
+    return [x * x for x, _ in data]
+
+
+def slow_first(data):
+    if data[0][0] == 0:
+        time.sleep(0.5)
+    return [x for x, _ in data]
+
+
+def fail(data):
+    raise ValueError('Cannot process {}.'.format(data))
+
+
+def test_in_order():
+    batches = [range(i, i + 3) for i in xrange(0, 30, 3)]
+    for workers in [1, 4]:
+        stats = pipeline.PipelineStats()
+        results = list(pipeline.run(batches, read, square, workers,
+                                    queue_size=2, stats=stats))
+        assert_eq([[x * x for x in batch] for batch in batches], results)
+        for stage in pipeline.STAGES:
+            assert_eq(30, stats.items[stage])
+        assert max(stats.depths[pipeline.READ_QUEUE]) <= 2
+        assert stats.report()
+
+
+def test_slow_batch_stops_reader():
+    # While the first batch is slow, the others finish, but are not written.
+    batches = [[i] for i in xrange(30)]
+    reads = []
+
+    def record(batch):
+        reads.append(batch)
+        return read(batch)
+
+    for i, result in enumerate(pipeline.run(batches, record, slow_first, 3,
+                                            queue_size=2)):
+        assert_eq(batches[i], result)
+        assert len(reads) <= i + 2 + 3
+
+
+def test_empty():
+    assert_eq([], list(pipeline.run([], read, square)))
+
+
+@raises(RuntimeError)
+def test_worker_failure():
+    list(pipeline.run([[1], [2]], read, fail, 2))
+
+
+@raises(RuntimeError)
+def test_reader_failure():
+    list(pipeline.run([[1], None], read, square))
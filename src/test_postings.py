@@ -0,0 +1,137 @@
+import array
+import os
+import tempfile
+
+from nose.tools import eq_ as assert_eq
+from nose.tools import raises
+from postings import *
+
+
+def test_varint_round_trip():
+    values = [0, 1, 127, 128, 300, 16383, 16384, 2 ** 31 - 1]
+    out = bytearray()
+    for value in values:
+        encode_varint(value, out)
+    assert_eq(values, decode_varints(out).tolist())
+
+
+def test_varints_truncated():
+    out = bytearray()
+    for value in [5, 300, 7]:
+        encode_varint(value, out)
+    assert_eq([5, 300], decode_varints(out[:-1]).tolist())
+    assert_eq([5], decode_varints(out[:2]).tolist())
+    assert_eq([], decode_varints(out[1:2]).tolist())
+    assert_eq([], decode_varints('').tolist())
+
+
+def test_varint_single_byte():
+    out = bytearray()
+    encode_varint(5, out)
+    assert_eq(1, len(out))
+
+    out = bytearray()
+    encode_varint(128, out)
+    assert_eq(2, len(out))
+
+
+def test_postings_round_trip():
+    entries = [(3, 1), (10, 2), (11, 300), (100000, 1)]
+    guids, tfs = decode_postings(encode_postings(entries))
+    assert_eq([3, 10, 11, 100000], list(guids))
+    assert_eq([1, 2, 300, 1], list(tfs))
+
+
+def test_postings_unsorted_input():
+    entries = [(11, 4), (3, 1), (10, 2)]
+    guids, tfs = decode_postings(encode_postings(entries))
+    assert_eq([3, 10, 11], list(guids))
+    assert_eq([1, 2, 4], list(tfs))
+
+
+def test_postings_empty():
+    guids, tfs = decode_postings(encode_postings([]))
+    assert_eq(0, len(guids))
+    assert_eq(0, len(tfs))
+
+
+def test_writer_reader():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        with open(path, 'wb') as f:
+            writer = PostingsWriter(f)
+            first = writer.write([(0, 1), (5, 2)])
+            second = writer.write([(7, 3)])
+
+        reader = PostingsReader(path)
+        guids, tfs = reader.read(*second)
+        assert_eq([7], list(guids))
+        assert_eq([3], list(tfs))
+
+        guids, tfs = reader.read(*first)
+        assert_eq([0, 5], list(guids))
+        assert_eq([1, 2], list(tfs))
+        reader.close()
+    finally:
+        os.remove(path)
+
+
+@raises(ValueError)
+def test_reader_rejects_other_formats():
+    fd, path = tempfile.mkstemp()
+    os.write(fd, '[[0, 1]]')
+    os.close(fd)
+    try:
+        PostingsReader(path)
+    finally:
+        os.remove(path)
+
+
+def test_raw_writer_reader():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        with open(path, 'wb') as f:
+            writer = PostingsWriter(f, raw=True)
+            first = writer.write([(5, 2), (0, 1), (9, 7)])
+            second = writer.write([(7, 3)])
+
+        reader = PostingsReader(path)
+        assert reader.raw
+        # Lists stay aligned for their int32 guids.
+        assert_eq(0, second[0] % 4)
+
+        guids, tfs = reader.read_numpy(*first)
+        assert_eq([0, 5, 9], guids.tolist())
+        assert_eq([1, 2, 7], tfs.tolist())
+        assert not guids.flags.writeable
+
+        guids, tfs = reader.read(*second)
+        assert_eq([7], list(guids))
+        assert_eq([3], list(tfs))
+        del guids, tfs
+        reader.close()
+    finally:
+        os.remove(path)
+
+
+@raises(ValueError)
+def test_raw_term_frequency_overflow():
+    encode_raw_postings([(0, MAX_RAW_TF + 1)])
+
+
+def test_union_sum():
+    guids, tfs = union_sum([
+        (array.array('i', [1, 4, 6]), array.array('i', [1, 2, 3])),
+        (array.array('i', [2, 4]), array.array('i', [5, 5])),
+        (array.array('i'), array.array('i')),
+    ])
+    assert_eq([1, 2, 4, 6], guids.tolist())
+    assert_eq([1, 5, 7, 3], tfs.tolist())
+
+
+def test_union_sum_empty():
+    guids, tfs = union_sum([])
+    assert_eq(0, len(guids))
+    assert_eq(0, len(tfs))
@@ -0,0 +1,61 @@
+import json
+import profiling
+
+from nose.tools import eq_ as assert_eq
+
+
+def test_disabled_by_default():
+    assert not profiling.enabled()
+    with profiling.current().timer('stage'):
+        profiling.current().count('counter')
+    assert_eq(None, profiling.stop())
+
+    null = profiling.current()
+    assert null.timer('stage') is null.timer('other')
+    try:
+        with null.timer('stage'):
+            raise ValueError('not swallowed')
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_profile():
+    profile = profiling.start()
+    try:
+        for _ in xrange(3):
+            with profiling.current().timer('stage'):
+                profiling.current().count('entries', 2)
+    finally:
+        assert profiling.stop() is profile
+    assert not profiling.enabled()
+
+    assert_eq(3, profile.timings['stage'][0])
+    assert_eq(6, profile.counters['entries'])
+
+    other = profiling.Profile()
+    other.merge(profile.to_dict())
+    other.merge(profile.to_dict())
+    assert_eq(6, other.timings['stage'][0])
+    assert_eq(12, other.counters['entries'])
+
+    data = json.loads(other.report(profiling.JSON))
+    assert_eq(['stage'], [timing['name'] for timing in data['timings']])
+    assert 'entries' in other.report()
+
+
+def test_rates():
+    profiling.define_rate('test hit rate', ['test hits'],
+                          ['test hits', 'test misses'])
+    profile = profiling.Profile()
+    assert_eq([], [name for name, _ in profile.rates()
+                   if name == 'test hit rate'])
+    profile.count('test hits', 3)
+    profile.count('test misses', 1)
+    assert_eq(0.75, dict(profile.rates())['test hit rate'])
+    data = json.loads(profile.report(profiling.JSON))
+    assert_eq(0.75, dict((rate['name'], rate['rate'])
+                         for rate in data['rates'])['test hit rate'])
+    assert 'test hit rate' in profile.report()
+    assert '75.0' in profile.report()
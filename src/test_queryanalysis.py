@@ -0,0 +1,46 @@
+import queryanalysis
+import threading
+import time
+
+from nose.tools import eq_ as assert_eq
+from queryanalysis import QueryAnalysis
+
+
+def test_forms_are_computed_once_in_threads():
+    calls = []
+
+    def slow_tokenizer(text):
+        calls.append(text)
+        time.sleep(0.01)
+        return text.lower().split()
+
+    default = queryanalysis.tokenizer
+    queryanalysis.tokenizer = slow_tokenizer
+    try:
+        for _ in xrange(5):
+            del calls[:]
+            analysis = QueryAnalysis({'Title': 'Water Pump',
+                                      'Abstract': 'A pump for water, quietly'})
+            start = threading.Event()
+            results = []
+
+            def read():
+                start.wait()
+                results.append((analysis.tokens('Abstract'),
+                                analysis.stem_map('Title'),
+                                analysis.tokens('Title')))
+
+            threads = [threading.Thread(target=read) for _ in xrange(16)]
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+
+            assert_eq(2, len(calls))
+            assert_eq(16, len(results))
+            for result in results:
+                for form, first in zip(result, results[0]):
+                    assert form is first
+    finally:
+        queryanalysis.tokenizer = default
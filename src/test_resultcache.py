@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_ as assert_eq
+from resultcache import *
+
+RESULTS = [(u'US1', 2.5), (u'US2', 1.25)]
+
+
+def test_get_and_put():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ResultCache(directory, 'index')
+        key = {'tokens': ['water', 'pump'], 'top_k': None}
+        assert_eq(None, cache.get(key))
+        cache.put(key, RESULTS)
+        assert_eq(RESULTS, cache.get(key))
+        assert_eq(None, cache.get({'tokens': ['water'], 'top_k': None}))
+
+        # Still there when reopened for the same index, but not for another.
+        assert_eq(RESULTS, ResultCache(directory, 'index').get(key))
+        assert_eq(None, ResultCache(directory, 'changed').get(key))
+        assert_eq(None, ResultCache(directory, 'index').get(key))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_eviction():
+    directory = tempfile.mkdtemp()
+    try:
+        # Room for three entries.
+        size = len(json.dumps(RESULTS))
+        cache = ResultCache(directory, 'index', max_bytes=3 * size)
+        for i in xrange(3):
+            before = set(os.listdir(directory))
+            cache.put(i, RESULTS)
+            new, = set(os.listdir(directory)) - before
+            # Entries used in order, a second apart.
+            os.utime(os.path.join(directory, new), (1000 + i, 1000 + i))
+
+        # Reading 0 makes 1 the least recently used.
+        cache.get(0)
+        cache.put(3, RESULTS)
+        assert_eq([RESULTS, None, RESULTS, RESULTS],
+                  [cache.get(i) for i in xrange(4)])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_eviction_is_batched():
+    directory = tempfile.mkdtemp()
+    listed = []
+    listdir = os.listdir
+
+    def counting_listdir(path):
+        listed.append(path)
+        return listdir(path)
+    os.listdir = counting_listdir
+    try:
+        size = len(json.dumps(RESULTS))
+        cache = ResultCache(directory, 'index',
+                            max_bytes=EVICT_EVERY * size * 10)
+        del listed[:]
+        for i in xrange(100):
+            cache.put(i, RESULTS)
+        # The directory is listed once more than ten entries have been put
+        # since it last was, not on every put.
+        assert_eq(9, len(listed))
+    finally:
+        os.listdir = listdir
+        shutil.rmtree(directory)
+
+
+def test_clear_skips_removed_entries():
+    directory = tempfile.mkdtemp()
+    listdir = os.listdir
+    # An entry another process removed after the directory was listed.
+    os.listdir = lambda path: listdir(path) + ['removed' + ENTRY_EXTENSION]
+    try:
+        cache = ResultCache(directory, 'index')
+        cache.put(0, RESULTS)
+        cache.clear()
+        assert_eq(None, cache.get(0))
+    finally:
+        os.listdir = listdir
+        shutil.rmtree(directory)
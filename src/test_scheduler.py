@@ -0,0 +1,154 @@
+import os
+import subprocess
+import sys
+import time
+
+from nose.tools import eq_ as assert_eq
+from scheduler import *
+
+
+class FakeSharedObject(object):
+    def __init__(self):
+        self.doc_ids_to_scores = {}
+
+    def set_feature_score(self, feature, doc_id, score):
+        self.doc_ids_to_scores.setdefault(doc_id, {})[feature] = score
+
+
+class Scorer(object):
+    """Gives a fixed score to some documents, slowly."""
+    def __init__(self, name, scores, delay=0):
+        self.NAME = name
+        self.scores = scores
+        self.delay = delay
+
+    def __call__(self, search, shared_obj):
+        time.sleep(self.delay)
+        for doc_id, score in self.scores.iteritems():
+            shared_obj.set_feature_score(self.NAME, doc_id, score)
+
+
+class Summer(object):
+    """Scores every document seen so far with the sum of its scores."""
+    INPUTS = (Scorer,)
+
+    def __init__(self, name):
+        self.NAME = name
+
+    def __call__(self, search, shared_obj):
+        sums = {doc_id: sum(scores.values())
+                for doc_id, scores in shared_obj.doc_ids_to_scores.iteritems()}
+        for doc_id, score in sums.iteritems():
+            shared_obj.set_feature_score(self.NAME, doc_id, score)
+
+
+class Slow(object):
+    """Like Scorer, but not one of Summer's INPUTS."""
+    def __init__(self, name, scores, delay):
+        self.NAME = name
+        self.scores = scores
+        self.delay = delay
+
+    def __call__(self, search, shared_obj):
+        time.sleep(self.delay)
+        for doc_id, score in self.scores.iteritems():
+            shared_obj.set_feature_score(self.NAME, doc_id, score)
+
+
+class Failing(object):
+    NAME = 'Failing'
+
+    def __call__(self, search, shared_obj):
+        shared_obj.set_feature_score(self.NAME, 1, 1.0)
+        raise ValueError('broken feature')
+
+
+def make_features():
+    return [
+        Scorer('A', {1: 1.0, 2: 2.0}, delay=0.05),
+        Scorer('B', {2: 4.0, 3: 8.0}),
+        Failing(),
+        Summer('Sum'),
+        Scorer('C', {4: 16.0}),
+    ]
+
+
+def test_dependencies():
+    assert_eq([[], [], [], [0, 1, 2], []], dependencies(make_features()))
+
+
+def test_threads_match_list_order():
+    expected = None
+    for workers in [1, 4]:
+        shared_obj = FakeSharedObject()
+        errors = []
+        FeatureScheduler(make_features(), workers).run(
+            None, shared_obj, lambda f, tb: errors.append(f.NAME))
+        assert_eq(['Failing'], errors)
+        if expected is None:
+            expected = shared_obj.doc_ids_to_scores
+        assert_eq(expected, shared_obj.doc_ids_to_scores)
+
+    # Sum sees the scores of A and B (and of Failing, set before it failed)
+    # but not those of C.
+    assert_eq(2.0 + 4.0, expected[2]['Sum'])
+    assert 4 not in [doc_id for doc_id, scores in expected.iteritems()
+                     if 'Sum' in scores]
+
+
+def test_readers_wait_for_features_not_in_inputs():
+    # Sum reads every score set before it, including those of a slow feature
+    # that is not one of its INPUTS.
+    expected = None
+    for workers in [1, 4]:
+        shared_obj = FakeSharedObject()
+        FeatureScheduler([Scorer('A', {1: 1.0}),
+                          Slow('S', {1: 2.0, 2: 4.0}, delay=0.05),
+                          Summer('Sum')], workers).run(
+            None, shared_obj, lambda f, tb: None)
+        if expected is None:
+            expected = shared_obj.doc_ids_to_scores
+        assert_eq(expected, shared_obj.doc_ids_to_scores)
+    assert_eq(1.0 + 2.0, expected[1]['Sum'])
+    assert_eq(4.0, expected[2]['Sum'])
+
+
+# Loads what features load on first use, from 16 threads at once, in a new
+# process (so that nothing is loaded yet.) NLTK's data may not be installed,
+# in which case the stopwords and the tokens of the IPC labels are left out.
+FIRST_USE = """
+import threading, tokenizer, utils
+from features import ipc
+from features.vsm import expansion
+
+def load():
+    loaded = [tokenizer.stemmer(), expansion.thesaurus()]
+    for resource in [utils.english_stopwords, ipc.section_tokens]:
+        try:
+            loaded.append(resource())
+        except LookupError:
+            loaded.append(None)
+    return loaded
+
+start = threading.Event()
+results = []
+def run():
+    start.wait()
+    results.append(load())
+threads = [threading.Thread(target=run) for _ in range(16)]
+for thread in threads:
+    thread.start()
+start.set()
+for thread in threads:
+    thread.join()
+assert len(results) == 16
+for result in results:
+    assert all(x is y for x, y in zip(result, results[0]))
+"""
+
+
+def test_first_use_in_threads():
+    for _ in xrange(3):
+        subprocess.check_call(
+            [sys.executable, '-c', FIRST_USE],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,456 @@
+import budget
+import collections
+import compoundindex
+import lexicon
+import math
+import numpy
+import os
+import profiling
+import queryanalysis
+import shutil
+import StringIO
+import sys
+import tempfile
+import test_index
+import utils
+
+from features.vsm import shared
+from features.vsm.base import VSMBase
+from features.vsm.single import VSMTitle
+from features.vsm.vsmutils import logtf
+from nose.tools import eq_ as assert_eq
+from search import ArraySearchObject, Search, SharedSearchObject, \
+    _break_ties, batch_query_files, query_id, run_batch
+
+# Queries over the words of the test corpus (see test_index.py), as
+# (title, description).
+QUERIES = {
+    'q1': ('pump with a water valve',
+           'Relevant documents will describe a pump and the valve of an '
+           'engine that seals water under pressure'),
+    'q2': ('motor shaft bearing',
+           'Relevant documents will describe the bearing of a rotor shaft '
+           'driven by a motor with a gear'),
+    'q3': ('nozzle filter',
+           'Relevant documents will describe a filter for the nozzle of a '
+           'fluid sensor'),
+}
+
+# Stand-ins for NLTK's stopwords and the thesaurus (in a lexicon, see
+# lexicon.py) and for NLTK's tokenizer and tagger, so that every feature runs.
+STOPWORDS = ['a', 'and', 'by', 'for', 'of', 'that', 'the', 'under', 'with']
+THESAURUS = {'pump': ['piston', 'motor'], 'valve': ['nozzle'],
+             'water': ['fluid'], 'bearing': ['housing'], 'filter': []}
+
+# An index of the test corpus, shared by every test.
+directory = None
+compound_index = None
+defaults = None
+
+
+def tag(tokens):
+    """Stands in for nltk.pos_tag: the words of the corpus are nouns."""
+    return [(token, 'NN' if token in test_index.WORDS else 'DT')
+            for token in tokens]
+
+
+def setup_module():
+    global directory, compound_index, defaults
+    directory = tempfile.mkdtemp()
+    doc_dir = os.path.join(directory, 'docs')
+    index_dir = os.path.join(directory, 'index')
+    os.mkdir(doc_dir)
+    os.mkdir(index_dir)
+    # Every fifth document twice (under another name), so that rankings have
+    # ties.
+    for doc_id in test_index.write_corpus(doc_dir)[::5]:
+        shutil.copy(os.path.join(doc_dir, doc_id + '.xml'),
+                    os.path.join(doc_dir, doc_id + 'X.xml'))
+    dict_path, postings_path = test_index.build(doc_dir, index_dir)
+    compound_index = compoundindex.load(dict_path, postings_path)
+
+    lexicon.write_lexicon(lexicon.lexicon_path(dict_path), STOPWORDS, {},
+                          THESAURUS, {})
+    lexicon.load(lexicon.lexicon_path(dict_path))
+    defaults = queryanalysis.tokenizer, queryanalysis.pos_tag
+    queryanalysis.tokenizer = test_index.tokenize
+    queryanalysis.pos_tag = tag
+
+
+def teardown_module():
+    queryanalysis.tokenizer, queryanalysis.pos_tag = defaults
+    lexicon.unload()
+    compound_index.close()
+    shutil.rmtree(directory)
+
+
+class CountingIndex(object):
+    """Counts the postings read from a compound index."""
+    def __init__(self, compound_index):
+        self.compound_index = compound_index
+        self.reads = []
+
+    def postings_numpy(self, index_name, term):
+        self.reads.append((index_name, term))
+        return self.compound_index.postings_numpy(index_name, term)
+
+
+def query_xml(name):
+    title, description = QUERIES[name]
+    return ('<query><title>{}</title><description>{}</description>'
+            '</query>'.format(title, description))
+
+
+def test_batch_query_files():
+    batch_dir = tempfile.mkdtemp()
+    try:
+        for name in ['q2.xml', 'q1.xml', 'notes.txt']:
+            open(os.path.join(batch_dir, name), 'w').close()
+        assert_eq([os.path.join(batch_dir, 'q1.xml'),
+                   os.path.join(batch_dir, 'q2.xml')],
+                  batch_query_files(batch_dir))
+
+        list_path = os.path.join(batch_dir, 'queries.txt')
+        with open(list_path, 'w') as f:
+            f.write('# Queries\nq2.xml\n\n/elsewhere/q9.xml\n')
+        assert_eq([os.path.join(batch_dir, 'q2.xml'), '/elsewhere/q9.xml'],
+                  batch_query_files(list_path))
+    finally:
+        shutil.rmtree(batch_dir)
+    assert_eq('q1', query_id('/queries/q1.xml'))
+
+
+def test_run_batch_matches_single_queries():
+    query_dir = os.path.join(directory, 'queries')
+    os.mkdir(query_dir)
+    for name in ['q1', 'q2']:
+        with open(os.path.join(query_dir, name + '.xml'), 'w') as f:
+            f.write(query_xml(name))
+    query_files = [os.path.join(query_dir, 'q1.xml'),
+                   os.path.join(query_dir, 'missing.xml'),
+                   os.path.join(query_dir, 'q2.xml')]
+    expected = {}
+    for name in ['q1', 'q2']:
+        s = Search(query_xml(name), compound_index, top_k=20)
+        expected[name] = s.run()
+        assert expected[name]
+        assert_eq([], s.failed_features)
+
+    output = os.path.join(directory, 'results')
+    assert_eq(1, run_batch(compound_index, query_files, output, top_k=20))
+    assert_eq(['q1.txt', 'q2.txt'], sorted(os.listdir(output)))
+    for name, results in expected.iteritems():
+        with open(os.path.join(output, name + '.txt'), 'r') as f:
+            assert_eq(' '.join(doc for doc, _ in results), f.read().strip())
+
+    run_file = os.path.join(directory, 'run.txt')
+    assert_eq(1, run_batch(compound_index, query_files, run_file, trec=True,
+                           run_tag='test', top_k=20))
+    with open(run_file, 'r') as f:
+        lines = [line.split() for line in f]
+    assert_eq(sum(len(results) for results in expected.itervalues()),
+              len(lines))
+    for qid, q0, doc, rank, score, tag in lines:
+        assert_eq(('Q0', 'test'), (q0, tag))
+        assert_eq((doc, float(score)), expected[qid][int(rank) - 1])
+
+
+def test_shared_postings():
+    counting = CountingIndex(compound_index)
+    shared = SharedSearchObject()
+    keys = [(zone, term) for zone in compound_index.indices()
+            for term in compound_index.terms_in_index(zone)[:10]]
+    keys.append(('Title', 'missing'))
+    for _ in xrange(3):
+        for zone, term in keys:
+            guids, tfs = shared.postings(counting, zone, term)
+            expected_guids, expected_tfs = \
+                compound_index.postings_numpy(zone, term)
+            assert_eq(expected_guids.tolist(), guids.tolist())
+            assert_eq(expected_tfs.tolist(), tfs.tolist())
+            assert_eq(compound_index.postings_list(zone, term),
+                      shared.postings_list(counting, zone, term))
+    assert_eq(keys, counting.reads)
+
+    computed = []
+
+    def compute():
+        computed.append('answer')
+        return 42
+
+    for _ in xrange(3):
+        assert_eq(42, shared.cached('answer', compute))
+    assert_eq(['answer'], computed)
+
+
+def test_break_ties():
+    # Few distinct rows, so that many documents tie, some with equal rows.
+    rng = numpy.random.RandomState(0)
+    doc_ids = rng.permutation(300)[:100]
+    matrix = rng.randint(0, 3, (100, 3)).astype(float)
+    scores = matrix.dot([1.0, 2.0, 1.0])
+    order = numpy.argsort(-scores, kind='mergesort')
+
+    expected = sorted(xrange(len(doc_ids)), reverse=True, key=lambda row: (
+        scores[row], matrix[row].tolist(), doc_ids[row]))
+    assert_eq(expected, _break_ties(order, doc_ids, matrix, scores).tolist())
+
+
+def test_scores_and_top_k():
+    for name in ['q1', 'q3']:
+        s = Search(query_xml(name), compound_index)
+        ranking = s.run()
+        assert_eq([], s.failed_features)
+        # Copies of documents tie, so the top k are cut between equal scores.
+        scores = [score for _, score in ranking]
+        assert len(set(scores)) < len(scores)
+
+        doc_ids, matrix, weighted = s.calculate_scores()
+        for row in xrange(len(doc_ids)):
+            assert_eq(utils.dot_product(matrix[row].tolist(),
+                                        s.features_weights),
+                      weighted[row])
+
+        for k in [1, 2, 5, 10, 50, len(ranking), len(ranking) + 5]:
+            s = Search(query_xml(name), compound_index, top_k=k)
+            assert_eq(ranking[:k], s.run())
+            assert_eq([], s.failed_features)
+
+
+def test_top_k_skips_documents():
+    # The clusters read every document's VSM scores, so documents can only be
+    # skipped without them.
+    default = Search.disabled_features
+    Search.disabled_features = frozenset(
+        name for name, _ in Search.FEATURES if name.startswith('Cluster'))
+    try:
+        for norms in [False, True]:
+            VSMBase.USE_INDEX_NORMS = norms
+            skipped = 0
+            for name in sorted(QUERIES):
+                ranking = Search(query_xml(name), compound_index).run()
+                for k in [1, 5, 10, len(ranking)]:
+                    s = Search(query_xml(name), compound_index, top_k=k)
+                    profile = profiling.start()
+                    try:
+                        assert_eq(ranking[:k], s.run())
+                    finally:
+                        profiling.stop()
+                    assert_eq([], s.failed_features)
+                    skipped += profile.counters.get(
+                        'MaxScore documents skipped', 0)
+            assert skipped > 0
+    finally:
+        VSMBase.USE_INDEX_NORMS = False
+        Search.disabled_features = default
+
+    # With the clusters, every document is scored.
+    s = Search(query_xml('q1'), compound_index, top_k=1)
+    profile = profiling.start()
+    try:
+        s.run()
+    finally:
+        profiling.stop()
+    assert_eq(0, profile.counters.get('MaxScore documents skipped', 0))
+
+def test_array_search_object():
+    # Scores that float32 holds exactly, so both objects keep the same ones.
+    rng = numpy.random.RandomState(0)
+    features = ['A', 'B', 'VSM_C']
+    shared, compact = SharedSearchObject(), ArraySearchObject(500)
+    for _ in xrange(300):
+        feature = features[rng.randint(len(features))]
+        doc_id = int(rng.randint(500))
+        score = rng.randint(1, 1000) / 8.0
+        for scores in [shared, compact]:
+            scores.set_feature_score(feature, doc_id, score)
+
+    assert_eq(dict(shared.doc_ids_to_scores), dict(compact.doc_ids_to_scores))
+    assert_eq(len(shared.doc_ids_to_scores), len(compact.doc_ids_to_scores))
+    assert_eq(dict(shared.scores_by_feature),
+              dict((feature, compact.scores_by_feature[feature])
+                   for feature in compact.scores_by_feature))
+    for expected, actual in zip(shared.score_matrix(features),
+                                compact.score_matrix(features)):
+        assert_eq(expected.tolist(), actual.tolist())
+
+    doc_ids, sums = compact.score_sums(exclude_prefix='VSM_')
+    for doc_id, total in zip(doc_ids.tolist(), sums.tolist()):
+        assert_eq(sum(score for feature, score
+                      in shared.doc_ids_to_scores[doc_id].iteritems()
+                      if not feature.startswith('VSM_')), total)
+
+    # The sums the cluster features average, given the scores of a search.
+    searches = [Search(query_xml('q2'), compound_index),
+                Search(query_xml('q2'), compound_index, compact_scores=True)]
+    for s in searches:
+        s.execute()
+        assert_eq([], s.failed_features)
+    shared, compact = [s.shared_search_obj for s in searches]
+    doc_ids, sums = compact.score_sums(exclude_prefix='Cluster')
+    assert_eq(sorted(shared.doc_ids_to_scores), doc_ids.tolist())
+    for doc_id, total in zip(doc_ids.tolist(), sums.tolist()):
+        expected = sum(score for feature, score
+                       in shared.doc_ids_to_scores[doc_id].iteritems()
+                       if not feature.startswith('Cluster'))
+        assert abs(expected - total) < 1e-6 * max(1, abs(expected))
+
+
+def test_compact_scores_match():
+    for name in ['q1', 'q3']:
+        searches = [Search(query_xml(name), compound_index),
+                    Search(query_xml(name), compound_index,
+                           compact_scores=True)]
+        expected, actual = [s.run() for s in searches]
+        for s in searches:
+            assert_eq([], s.failed_features)
+        assert_eq([doc for doc, _ in expected], [doc for doc, _ in actual])
+        for (_, expected_score), (_, score) in zip(expected, actual):
+            assert abs(expected_score - score) < 1e-6 * abs(expected_score)
+
+
+def test_caches_are_per_index():
+    # Another index of different documents, with the same fields.
+    other_dir = tempfile.mkdtemp()
+    try:
+        doc_dir = os.path.join(other_dir, 'docs')
+        os.mkdir(doc_dir)
+        test_index.write_corpus(doc_dir, count=20, seed=1)
+        other = compoundindex.load(*test_index.build(doc_dir, other_dir))
+        try:
+            for index in [other, compound_index]:
+                values = index.value_for_field('Cited By Count')
+                assert_eq(index.documents_in_index('Abstract'),
+                          [guid for guid, _ in values])
+                assert_eq(dict(values), index.dict_for_field('Cited By Count'))
+                assert_eq(len(index.documents_in_index('Abstract')),
+                          index.document_count(['Title', 'Abstract']))
+        finally:
+            other.close()
+    finally:
+        shutil.rmtree(other_dir)
+
+
+def reference_scores(feature, search, shared_obj):
+    """Scores a VSM feature on its own, one term at a time, in Python."""
+    terms, weights = feature.query_vector(search, shared_obj)
+    dot = collections.defaultdict(float)
+    length_squared = collections.defaultdict(float)
+    for term, query_weight in zip(terms, weights):
+        doc_ids, term_frequencies = feature.postings(search, shared_obj, term)
+        for doc_id, tf in zip(doc_ids.tolist(), term_frequencies.tolist()):
+            dot[doc_id] += query_weight * tf
+            length_squared[doc_id] += tf * tf
+    return dict((doc_id, doc_dot / math.sqrt(length_squared[doc_id]))
+                for doc_id, doc_dot in dot.iteritems())
+
+
+class BrokenVSM(VSMTitle):
+    NAME = 'VSM_Broken'
+
+    def query_tokens(self, search):
+        raise LookupError('No tagger.')
+
+
+def test_vsm_features_scored_together():
+    for name in sorted(QUERIES):
+        s = Search(query_xml(name), compound_index).execute()
+        assert_eq([], s.failed_features)
+        features = [f for f in s.features if isinstance(f, VSMBase)]
+        assert_eq(10, len(features))
+        shared_obj = SharedSearchObject()
+        for feature in features:
+            assert_eq(reference_scores(feature, s, shared_obj),
+                      s.shared_search_obj.scores_by_feature[feature.NAME])
+
+    # A feature that fails does not stop the others from being scored.
+    s = Search(query_xml('q1'), compound_index)
+    features = [VSMTitle(), BrokenVSM()]
+    shared_obj = SharedSearchObject()
+    doc_ids, scores = shared.scores(s, shared_obj, features[0], features)
+    assert_eq(reference_scores(features[0], s, shared_obj),
+              dict(zip(doc_ids.tolist(), scores.tolist())))
+    try:
+        shared.scores(s, shared_obj, features[1], features)
+        assert False
+    except LookupError:
+        pass
+
+
+def test_index_norms():
+    # The length of each document's full log-tf vector in each zone.
+    norms = {}
+    for zone in compound_index.indices():
+        squares = collections.defaultdict(list)
+        for term in compound_index.terms_in_index(zone):
+            for guid, tf in compound_index.postings_list(zone, term):
+                squares[guid].append(logtf(tf) ** 2)
+        norms[zone] = dict((guid, math.sqrt(math.fsum(values)))
+                           for guid, values in squares.iteritems())
+
+    default = VSMBase.USE_INDEX_NORMS
+    VSMBase.USE_INDEX_NORMS = True
+    try:
+        for name in sorted(QUERIES):
+            s = Search(query_xml(name), compound_index).execute()
+            assert_eq([], s.failed_features)
+            shared_obj = SharedSearchObject()
+            single_zone = [f for f in s.features if f.NAME in
+                           s.cache_key()['index_norms']]
+            assert_eq(8, len(single_zone))
+            for feature in single_zone:
+                # Scored with the stored norms, as with the norms computed
+                # here.
+                terms, weights = feature.query_vector(s, shared_obj)
+                dot = collections.defaultdict(float)
+                for term, query_weight in zip(terms, weights):
+                    doc_ids, term_frequencies = feature.postings(
+                        s, shared_obj, term)
+                    for doc_id, tf in zip(doc_ids.tolist(),
+                                          term_frequencies.tolist()):
+                        dot[doc_id] += query_weight * logtf(tf)
+                assert_eq(dict((doc_id, doc_dot / norms[feature.INDEX][doc_id])
+                               for doc_id, doc_dot in dot.iteritems()),
+                          s.shared_search_obj.scores_by_feature[feature.NAME])
+
+            # The features of several zones have no stored norms.
+            for feature in s.features:
+                if isinstance(feature, VSMBase) and feature not in single_zone:
+                    assert_eq(reference_scores(feature, s, shared_obj),
+                              s.shared_search_obj.scores_by_feature[
+                                  feature.NAME])
+    finally:
+        VSMBase.USE_INDEX_NORMS = default
+    assert_eq([], Search(query_xml('q1'), compound_index).cache_key()[
+        'index_norms'])
+
+
+def test_feature_stats_with_deadline():
+    default = Search.feature_stats
+    Search.feature_stats = budget.FeatureStats()
+    try:
+        # Without a deadline, features are not measured.
+        s = Search(query_xml('q1'), compound_index).execute()
+        assert_eq({}, Search.feature_stats.stats)
+
+        s = Search(query_xml('q1'), compound_index, deadline_ms=1e6).execute()
+        assert_eq([], s.dropped_features)
+        assert_eq(sorted(s.features_vector_key),
+                  sorted(Search.feature_stats.stats))
+
+        # Features left out are reported on stderr, not with the results.
+        Search.feature_stats.record('VSM_Title', 1e9, 0.0)
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+        try:
+            s = Search(query_xml('q1'), compound_index,
+                       deadline_ms=1e6).execute()
+            printed, reported = sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        assert_eq(['VSM_Title'], s.dropped_features)
+        assert_eq('', printed)
+        assert_eq('# Dropped features (deadline): VSM_Title\n', reported)
+        assert_eq(1, Search.feature_stats.stats['VSM_Title'][budget.DROPPED])
+    finally:
+        Search.feature_stats = default
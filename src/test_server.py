@@ -0,0 +1,202 @@
+import json
+import os
+import server
+import shutil
+import tempfile
+import test_search
+import threading
+import time
+
+from nose.tools import eq_ as assert_eq, raises
+from server import SearchServer, SearchService
+
+QUERY_XML = '<query><title>water pump</title></query>'
+
+
+class FakeIndex(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class RecordingService(SearchService):
+    """Records the searches asked for, instead of running them."""
+    def __init__(self, deadline_ms=None):
+        SearchService.__init__(self, FakeIndex(), deadline_ms=deadline_ms)
+        self.searches = []
+
+    def search(self, query_xml, top_k=None, use_cache=True,
+               deadline_ms=None, measure=None):
+        self.searches.append((query_xml, top_k, deadline_ms))
+        if 'missing' in query_xml:
+            raise KeyError('missing')
+        return ['US2', 'US1'], ['VSM_Title']
+
+
+def handle(service, request):
+    response = service.handle(json.dumps(request))
+    assert response.pop(server.ELAPSED_MS) >= 0
+    return response
+
+
+def test_query():
+    service = RecordingService(deadline_ms=100)
+    assert_eq({server.ID: 7, server.RESULTS: ['US2', 'US1'],
+               server.DROPPED: ['VSM_Title']},
+              handle(service, {server.QUERY: QUERY_XML, server.ID: 7,
+                               server.TOP_K: 2}))
+    handle(service, {server.QUERY: QUERY_XML, server.DEADLINE_MS: 5})
+    assert_eq([(QUERY_XML, 2, 100), (QUERY_XML, None, 5)], service.searches)
+
+
+def test_query_file():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'q1.xml')
+        with open(path, 'w') as f:
+            f.write(QUERY_XML)
+        service = RecordingService()
+        response = handle(service, {server.QUERY_FILE: path})
+        assert_eq(['US2', 'US1'], response[server.RESULTS])
+        assert_eq([(QUERY_XML, None, None)], service.searches)
+
+        response = handle(service, {server.QUERY_FILE: path + '.missing',
+                                    server.ID: 'q2'})
+        assert_eq([server.ERROR, server.ID], sorted(response))
+        assert_eq('q2', response[server.ID])
+        assert response[server.ERROR].startswith('IOError: ')
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_errors():
+    service = RecordingService()
+    response = service.handle('{not json')
+    assert response[server.ERROR].startswith('ValueError: ')
+    assert server.RESULTS not in response
+
+    response = handle(service, {server.ID: 3})
+    assert_eq({server.ID: 3, server.ERROR: 'ValueError: Request needs a '
+                                           '`query` or `query_file`.'},
+              response)
+
+    response = handle(service, {server.QUERY: 'missing'})
+    assert_eq({server.ERROR: "KeyError: 'missing'"}, response)
+
+
+def test_closed():
+    index = FakeIndex()
+    service = SearchService(index)
+    service.close()
+    assert index.closed
+    assert_eq({server.ERROR: 'RuntimeError: The server is shutting down.'},
+              handle(service, {server.QUERY: QUERY_XML}))
+
+
+def test_concurrent_queries():
+    running = []
+    release = threading.Event()
+
+    class BlockingSearch(object):
+        """Stands in for Search, running until released."""
+        def __init__(self, query_xml, compound_index, **kwargs):
+            self.query_xml = query_xml
+            self.dropped_features = []
+
+        def run(self, result_cache):
+            running.append(self.query_xml)
+            release.wait()
+            return [(self.query_xml, 1.0)]
+
+    default = server.Search
+    server.Search = BlockingSearch
+    try:
+        index = FakeIndex()
+        service = SearchService(index)
+        results = []
+        threads = [threading.Thread(target=lambda q=q: results.append(
+            service.search(q))) for q in ['q1', 'q2', 'q3']]
+        for thread in threads:
+            thread.start()
+        # All three queries run at once.
+        deadline = time.time() + 10
+        while len(running) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        assert_eq(['q1', 'q2', 'q3'], sorted(running))
+
+        # close waits for them before closing the index.
+        closer = threading.Thread(target=service.close)
+        closer.start()
+        time.sleep(0.05)
+        assert not index.closed
+        release.set()
+        for thread in threads + [closer]:
+            thread.join()
+        assert index.closed
+        assert_eq([([q], []) for q in ['q1', 'q2', 'q3']], sorted(results))
+    finally:
+        release.set()
+        server.Search = default
+
+
+class TestConcurrentSearches(object):
+    """Runs real searches from several threads (on the index of
+    test_search.py), which must give the results they give one at a time."""
+    def setup(self):
+        test_search.setup_module()
+
+    def teardown(self):
+        test_search.teardown_module()
+
+    def test_results_match_serial(self):
+        for feature_threads in [1, 3]:
+            service = SearchService(test_search.compound_index,
+                                    feature_threads=feature_threads)
+            names = sorted(test_search.QUERIES) * 4
+            expected = dict((name, service.search(
+                test_search.query_xml(name))) for name in names)
+            results = [None] * len(names)
+            start = threading.Event()
+
+            def run(i):
+                start.wait()
+                results[i] = service.search(
+                    test_search.query_xml(names[i]))
+
+            threads = [threading.Thread(target=run, args=(i,))
+                       for i in xrange(len(names))]
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+            assert_eq([expected[name] for name in names], results)
+
+
+class TestSocket(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, 'socket')
+        self.service = RecordingService(deadline_ms=100)
+        self.server = SearchServer(self.socket_path, self.service)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def teardown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_request(self):
+        assert_eq(['US2', 'US1'],
+                  server.request(self.socket_path, QUERY_XML, top_k=2))
+        server.request(self.socket_path, QUERY_XML, deadline_ms=5)
+        assert_eq([(QUERY_XML, 2, 100), (QUERY_XML, None, 5)],
+                  self.service.searches)
+
+    @raises(RuntimeError)
+    def test_request_error(self):
+        server.request(self.socket_path, 'missing')
@@ -0,0 +1,83 @@
+import json
+import os
+import shutil
+import tempfile
+
+from index import IndexBuilder
+from nose.tools import eq_ as assert_eq
+from segment import IndexSegment
+from snapshot import *
+
+
+def build_index(directory):
+    dict_path = os.path.join(directory, 'dictionary.txt')
+    postings_path = os.path.join(directory, 'postings.txt')
+    ib = IndexBuilder(dict_path, postings_path)
+    ib.add_tokens_for_zone(['water', 'pump', 'water'], 'US1', 'Title')
+    ib.add_tokens_for_zone(['pump'], 'US2', 'Title')
+    ib.add_tokens_for_zone(['valve'], 'US2', 'Abstract')
+    ib.add_value_for_field(3, 'US1', 'Cited By Count')
+    ib.add_value_for_field('H', 'US2', 'IPC Section')
+    ib.serialize()
+    return dict_path, postings_path
+
+
+def test_snapshot_matches_json():
+    directory = tempfile.mkdtemp()
+    try:
+        dict_path, postings_path = build_index(directory)
+        assert not is_fresh(dict_path)
+        write_snapshot(dict_path)
+        assert is_fresh(dict_path)
+
+        with open(dict_path, 'r') as f:
+            expected = IndexSegment(json.load(f), postings_path)
+        actual = SnapshotSegment(snapshot_path(dict_path), postings_path)
+
+        assert_eq(expected.first_guid, actual.first_guid)
+        assert_eq(expected.guid_count(), actual.guid_count())
+        assert_eq(sorted(expected.index_names()), sorted(actual.index_names()))
+        for guid in xrange(-1, 3):
+            assert_eq(expected.document_name(guid), actual.document_name(guid))
+        for name in ['US1', 'US2', 'US3']:
+            assert_eq(expected.guid_for_document_name(name),
+                      actual.guid_for_document_name(name))
+
+        for zone in ['Title', 'Abstract', 'Claims']:
+            assert_eq(expected.documents_in_index(zone),
+                      actual.documents_in_index(zone))
+            assert_eq(sorted(expected.terms(zone)),
+                      sorted(actual.terms(zone)))
+            for term in ['water', 'pump', 'valve', 'missing']:
+                assert_eq(expected.term_entry(zone, term),
+                          actual.term_entry(zone, term))
+                assert_eq(map(list, expected.postings_arrays(zone, term)),
+                          map(list, actual.postings_arrays(zone, term)))
+                assert_eq(expected.max_weight(zone, term),
+                          actual.max_weight(zone, term))
+            for guid in xrange(-1, 3):
+                assert_eq(expected.norm(zone, guid), actual.norm(zone, guid))
+            assert_eq(expected.norm_array(zone).tolist(),
+                      actual.norm_array(zone).tolist())
+
+        for field in ['Cited By Count', 'IPC Section']:
+            assert_eq(list(expected.column(field).items()),
+                      list(actual.column(field).items()))
+        assert_eq(None, actual.column('Missing'))
+
+        expected.close()
+        actual.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_stale_snapshot():
+    directory = tempfile.mkdtemp()
+    try:
+        dict_path, _ = build_index(directory)
+        write_snapshot(dict_path)
+        with open(dict_path, 'a') as f:
+            f.write(' ')
+        assert not is_fresh(dict_path)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,100 @@
+import os
+import profiling
+import shutil
+import tempfile
+import tokenizer
+
+from nltk.stem.snowball import SnowballStemmer
+from nose.tools import eq_ as assert_eq
+
+WORDS = ['pumps', 'pumping', 'water', 'pumps', 'valves', 'generously']
+
+
+def test_stem_all_matches_stemmer():
+    stemmer = SnowballStemmer('english')
+    expected = [stemmer.stem(w) for w in WORDS]
+    assert_eq(expected, tokenizer.stem_all(WORDS))
+    # Again, from the memo.
+    assert_eq(expected, tokenizer.stem_all(WORDS))
+
+
+def test_memo_keeps_words_when_full():
+    memo = tokenizer.__stem_memo
+    saved, size = dict(memo), tokenizer.MEMO_SIZE
+    memo.clear()
+    tokenizer.MEMO_SIZE = 2
+    try:
+        expected = tokenizer.stem_all(WORDS)
+        assert_eq(set(WORDS[:2]), set(memo))
+        assert_eq(expected, tokenizer.stem_all(WORDS))
+        assert_eq(set(WORDS[:2]), set(memo))
+    finally:
+        memo.clear()
+        memo.update(saved)
+        tokenizer.MEMO_SIZE = size
+
+
+def test_stem_hit_rate():
+    memo = tokenizer.__stem_memo
+    saved, size = dict(memo), tokenizer.MEMO_SIZE
+    memo.clear()
+    tokenizer.MEMO_SIZE = 2
+    profile = profiling.start()
+    try:
+        tokenizer.stem_all(WORDS)
+        tokenizer.stem_all(WORDS)
+    finally:
+        profiling.stop()
+        memo.clear()
+        memo.update(saved)
+        tokenizer.MEMO_SIZE = size
+    hits = profile.counters['stem table hits'] + \
+        profile.counters['stem memo hits']
+    assert_eq(2 * len(WORDS), hits + profile.counters['stemmer calls'])
+    assert hits >= 2
+    assert_eq([('stem hit rate', float(hits) / (2 * len(WORDS)))],
+              profile.rates())
+    assert 'stem hit rate' in profile.report()
+
+
+def test_fast_free_text_not_string():
+    assert_eq([], tokenizer.fast_free_text(None))
+    assert_eq([], tokenizer.fast_free_text(42))
+
+
+def test_stem_table():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'dictionary.txt.stems')
+        tokenizer.record_vocabulary()
+        tokenizer.stem_all(WORDS[:3])
+        tokenizer.add_to_vocabulary(['valves'])
+        vocabulary = tokenizer.take_vocabulary()
+        assert_eq(set(['pumps', 'pumping', 'water', 'valves']), vocabulary)
+
+        tokenizer.record_vocabulary(False)
+        assert_eq(None, tokenizer.take_vocabulary())
+
+        tokenizer.write_stem_table(path, vocabulary)
+        tokenizer.write_stem_table(path, ['generously'])
+        tokenizer.load_stem_table(path)
+        assert_eq(tokenizer.stem_all(WORDS),
+                  [SnowballStemmer('english').stem(w) for w in WORDS])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_fast_tokenize():
+    # As word_tokenize splits each sentence.
+    text = ('The pump (see Fig. 2) delivers 1,000 l/min; it can\'t stall. '
+            'A "smart" valve, e.g. a solenoid, is used -- or not! '
+            'It\'s the users\' choice: 3.5% of $20 [approx.] & more...')
+    assert_eq(['the', 'pump', '(', 'see', 'fig.', '2', ')', 'delivers',
+               '1,000', 'l/min', ';', 'it', 'ca', "n't", 'stall', '.',
+               'a', '``', 'smart', "''", 'valve', ',', 'e.g.', 'a',
+               'solenoid', ',', 'is', 'used', '--', 'or', 'not', '!',
+               'it', "'s", 'the', 'users', "'", 'choice', ':', '3.5', '%',
+               'of', '$', '20', '[', 'approx.', ']', '&', 'more', '...'],
+              tokenizer.fast_tokenize(text))
+    assert_eq(['washers', 'can', 'not', 'stop', '.'],
+              tokenizer.fast_tokenize('Washers cannot stop.'))
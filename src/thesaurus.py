@@ -26,3 +26,7 @@ class Thesaurus(object):
         if type(index) is not str:
             raise TypeError('Key must be type(str)')
         return self.__backing.get(index, [])
+
+    def iteritems(self):
+        """Iterates over the (word, synonyms)-pairs of the thesaurus."""
+        return self.__backing.iteritems()
@@ -0,0 +1,98 @@
+import argparse
+import difflib
+import os
+import time
+import tokenizer
+import utils
+
+from index import DirectoryProcessor
+
+# The tokenizers compared, by name. Both return unstemmed tokens; stemming is
+# the same for both.
+TOKENIZERS = [
+    ('nltk', tokenizer.nltk_tokenize),
+    ('fast', tokenizer.fast_tokenize),
+]
+
+
+def sample_texts(doc_dir, count):
+    """Returns the free text zones of the first count documents in doc_dir,
+    as a list of (document name, zone, text)-tuples."""
+    filenames = sorted(f for f in os.listdir(doc_dir)
+                       if f.endswith('.xml'))[:count]
+    texts = []
+    for filename in filenames:
+        info = utils.xml_file_to_dict(os.path.join(doc_dir, filename))
+        for zone in DirectoryProcessor.ZONES:
+            if info.get(zone):
+                texts.append((filename, zone, info[zone]))
+    return texts
+
+
+def throughput(tokenize, texts, repeat):
+    """Returns (tokens, tokens per second) of the fastest of repeat runs."""
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        tokens = sum(len(tokenize(text)) for _, _, text in texts)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return tokens, tokens / max(best, 1e-9)
+
+
+def mismatches(expected, actual):
+    """Returns the differing stretches of two token lists, as a list of
+    (expected tokens, actual tokens)-tuples."""
+    matcher = difflib.SequenceMatcher(None, expected, actual, autojunk=False)
+    return [(expected[i1:i2], actual[j1:j2])
+            for op, i1, i2, j1, j2 in matcher.get_opcodes()
+            if op != 'equal']
+
+
+def verify(texts, show):
+    """Prints where fast_tokenize differs from the tokens free_text stems.
+    Returns the number of differing stretches."""
+    total = 0
+    tokens = 0
+    for filename, zone, text in texts:
+        expected = tokenizer.nltk_tokenize(text)
+        tokens += len(expected)
+        for expected_part, actual_part in mismatches(
+                expected, tokenizer.fast_tokenize(text)):
+            total += 1
+            if total <= show:
+                print '{} {}: {} != {}'.format(filename, zone, expected_part,
+                                               actual_part)
+    print '{} mismatches in {} tokens ({} texts)'.format(total, tokens,
+                                                         len(texts))
+    return total
+
+
+def main(args):
+    texts = sample_texts(args.index, args.sample)
+    for name, tokenize in TOKENIZERS:
+        tokens, per_second = throughput(tokenize, texts, args.repeat)
+        print '{:<6} {:10d} tokens {:12.0f} tokens/s'.format(name, tokens,
+                                                             per_second)
+    if args.verify:
+        verify(texts, args.show)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compares the throughput of the NLTK and the fast '
+                    'tokenizer (see tokenizer.py) on a sample of documents, '
+                    'and optionally where their tokens differ.')
+    parser.add_argument('-i', '--index', required=True,
+                        help='directory of documents.')
+    parser.add_argument('-n', '--sample', type=int, default=500,
+                        help='number of documents to tokenize.')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of runs; the fastest is reported.')
+    parser.add_argument('--verify', action='store_true',
+                        help='also print the tokens the fast tokenizer gets '
+                             'wrong.')
+    parser.add_argument('--show', type=int, default=20,
+                        help='number of mismatches printed by --verify.')
+    args = parser.parse_args()
+    main(args)
@@ -1,30 +1,294 @@
-from nltk import pos_tag, word_tokenize, sent_tokenize
-from nltk.stem.snowball import SnowballStemmer
+import json
+import lexicon
+import os
+import re
+import threading
 
+import profiling
 
-# Initialise the stemmer exactly once to remove overheads when running
-# multiple times.
-__stemmer = SnowballStemmer('english')
+
+# NLTK takes most of a second to import, so it is imported the first time it
+# is needed rather than by everything that imports this module.
+def sent_tokenize(text):
+    from nltk import sent_tokenize
+    return sent_tokenize(text)
+
+
+def word_tokenize(text):
+    from nltk import word_tokenize
+    return word_tokenize(text)
+
+
+# Share of the words stem_all finds in the stem table or the memo.
+profiling.define_rate(
+    'stem hit rate', ['stem table hits', 'stem memo hits'],
+    ['stem table hits', 'stem memo hits', 'stemmer calls'])
+
+
+# Initialise the stemmer exactly once (on first use) to remove overheads when
+# running multiple times. Features running in several threads may ask for it
+# at once, hence the lock.
+__stemmer = None
+__stemmer_lock = threading.Lock()
+
+
+def stemmer():
+    global __stemmer
+    if __stemmer is None:
+        with __stemmer_lock:
+            if __stemmer is None:
+                from nltk.stem.snowball import SnowballStemmer
+                __stemmer = SnowballStemmer('english')
+    return __stemmer
+
+# Stems are looked up before running the stemmer: first in the stem table
+# written at index time (see load_stem_table, or the lexicon's if one is
+# loaded), then in a memo of the words stemmed since. Once the memo holds
+# MEMO_SIZE words no more are added (rather than emptying it, which would lose
+# the common words, memoised early, along with the rare ones.)
+MEMO_SIZE = 200000
+__stem_table = {}
+__stem_memo = {}
+
+# The set of words stemmed, while recording (see record_vocabulary.)
+__vocabulary = None
 
 
 def stem_all(words):
-    return [__stemmer.stem(w) for w in words]
+    current_lexicon = lexicon.current()
+    if current_lexicon is not None:
+        table = current_lexicon.stems
+    else:
+        table = __stem_table
+    memo = __stem_memo
+    stems = []
+    table_hits = memo_hits = 0
+    for w in words:
+        stem = table.get(w)
+        if stem is not None:
+            table_hits += 1
+        else:
+            stem = memo.get(w)
+            if stem is not None:
+                memo_hits += 1
+            else:
+                stem = stemmer().stem(w)
+                if len(memo) < MEMO_SIZE:
+                    memo[w] = stem
+        stems.append(stem)
+
+    add_to_vocabulary(words)
+
+    profile = profiling.current()
+    profile.count('stem table hits', table_hits)
+    profile.count('stem memo hits', memo_hits)
+    profile.count('stemmer calls', len(words) - table_hits - memo_hits)
+    return stems
+
+
+def record_vocabulary(record=True):
+    """Starts (or stops) recording the words that are stemmed."""
+    global __vocabulary
+    __vocabulary = set() if record else None
+
+
+def add_to_vocabulary(words):
+    """Adds words (e.g. those stemmed by a worker process) to the recorded
+    vocabulary, if recording."""
+    if __vocabulary is not None:
+        __vocabulary.update(words)
+
+
+def take_vocabulary():
+    """Returns the words stemmed since recording started (or since the last
+    call), or None if not recording."""
+    global __vocabulary
+    vocabulary = __vocabulary
+    if vocabulary is not None:
+        __vocabulary = set()
+    return vocabulary
+
+
+def stem_table_path(dictionary_path):
+    """Returns the path of the stem table belonging to a dictionary file."""
+    return dictionary_path + '.stems'
+
+
+def write_stem_table(path, words):
+    """Writes a table of the stem of each word (adding to the table
+    already at path, if any) for load_stem_table."""
+    table = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            table = json.load(f)
+    words = [w for w in words if w not in table]
+    table.update(zip(words, stem_all(words)))
+    with open(path + '.tmp', 'w') as f:
+        json.dump(table, f, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def load_stem_table(path):
+    """Loads a table written by write_stem_table, so that the words in it are
+    never stemmed again. Does nothing if there is no table at path."""
+    global __stem_table
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            __stem_table = json.load(f)
 
 
 # This is the tokeniser from homework 3.
 # Uses sent_tokenize(), case-folds, word_tokenize(), then stems using Porter
 # Stemmer.
 def free_text(text):
-    global __stemmer
+    profile = profiling.current()
     try:
-        sentences = sent_tokenize(text)
-        words = []
-        for sent in sentences:
-            sent = sent.lower()
-            words += word_tokenize(sent.strip())
-        words = stem_all(words)
+        with profile.timer('tokenize'):
+            words = nltk_tokenize(text)
+        with profile.timer('stem'):
+            words = stem_all(words)
         return words
     except TypeError:
         print u'TypeError while processing text: {}\nNo tokens were returned' \
               .format(text)
         return []
+
+
+def nltk_tokenize(text):
+    """Returns the (unstemmed, lower case) tokens free_text stems."""
+    words = []
+    for sent in sent_tokenize(text):
+        sent = sent.lower()
+        words += word_tokenize(sent.strip())
+    return words
+
+
+# A faster alternative to free_text, for indexing: a single pass over the
+# whitespace-separated chunks of the text, applying the rules of NLTK's
+# TreebankWordTokenizer (which word_tokenize uses) to each chunk, instead of
+# Punkt sentence splitting followed by a dozen regex substitutions over each
+# sentence.
+#
+# The only use word_tokenize makes of sentences is to split off the period
+# ending each one. Here a chunk ends a sentence if it ends with a period and
+# is the last chunk, or the next chunk starts with an upper case letter or a
+# digit, unless it is a known abbreviation or an initial. Punkt's decisions
+# are statistical, so the two can differ; see tokenbench.py --verify.
+
+# Split off wherever they appear.
+_ALWAYS_SPLIT = re.compile(r"(\.\.\.|--|''|`+|[;@#$%&?!\[\](){}<>\"])")
+# Commas and colons are split off unless a digit follows (as in 1,000.)
+_COMMA_COLON = re.compile(r'([,:])(?!\d)')
+_CLOSING = ')]}>"\''
+_OPENING = '([{<'
+# word_tokenize splits a quote off a single letter or digit (as in 'a').
+_OPEN_SINGLE_QUOTE = re.compile(r"(')(?!re|ve|ll|m|t|s|d)(\w)\b")
+_CONTRACTIONS = re.compile(r"^(.*[^' ])('s|'m|'d|'ll|'re|'ve|n't)$")
+_SPLIT_WORDS = {
+    'cannot': ['can', 'not'],
+    "d'ye": ['d', "'ye"],
+    'gimme': ['gim', 'me'],
+    'gonna': ['gon', 'na'],
+    'gotta': ['got', 'ta'],
+    'lemme': ['lem', 'me'],
+    "mor'n": ['mor', "'n"],
+    'wanna': ['wan', 'na'],
+    "'tis": ["'t", 'is'],
+    "'twas": ["'t", 'was'],
+}
+_INITIALS = re.compile(r'^(?:[a-z]\.)*[a-z]$')
+ABBREVIATIONS = frozenset([
+    'e.g', 'i.e', 'etc', 'fig', 'figs', 'no', 'nos', 'vs', 'u.s', 'inc',
+    'co', 'corp', 'ltd', 'approx', 'ca', 'cf', 'al', 'mr', 'mrs', 'dr', 'st',
+    'jr', 'ser', 'pat', 'eq', 'ref', 'vol', 'pp',
+])
+
+
+def _ends_sentence(chunk, next_chunk):
+    word = chunk.rstrip(_CLOSING)
+    if not word.endswith('.') or word.endswith('..'):
+        return False
+    if next_chunk is None:
+        return True
+    if not (next_chunk[0].isupper() or next_chunk[0].isdigit()):
+        return False
+    # Abbreviations and initials (as in "U.S.") rarely end a sentence.
+    word = word[:-1].lstrip(_OPENING + '"\'').lower()
+    return not (word in ABBREVIATIONS or _INITIALS.match(word))
+
+
+def _chunk_tokens(chunk, sentence_start, sentence_end):
+    """Returns the (lower case) tokens of a whitespace-separated chunk."""
+    chunk = chunk.lower()
+    if sentence_end:
+        # The final period (before any closing brackets or quotes.)
+        word = chunk.rstrip(_CLOSING)
+        chunk = word[:-1] + ' . ' + chunk[len(word):]
+
+    tokens = []
+    previous = None
+    for piece in _ALWAYS_SPLIT.split(chunk):
+        if not piece:
+            continue
+        if piece == '"' or piece == "''":
+            # An opening quote after a space or an opening bracket (but a
+            # sentence can only open with a double quote.)
+            if previous is None:
+                opening = piece == '"' or not sentence_start
+            else:
+                opening = previous in _OPENING
+            tokens.append('``' if opening else "''")
+        elif _ALWAYS_SPLIT.match(piece):
+            tokens.append(piece)
+        else:
+            piece = _OPEN_SINGLE_QUOTE.sub(r'\1 \2', piece)
+            for part in _COMMA_COLON.sub(r' \1 ', piece).split():
+                tokens.extend(_word_tokens(part))
+        previous = piece
+    return tokens
+
+
+def _word_tokens(word):
+    if word in _SPLIT_WORDS:
+        return _SPLIT_WORDS[word]
+    if word.endswith("'") and len(word) > 1 and word[-2] != "'":
+        return _word_tokens(word[:-1]) + ["'"]
+    match = _CONTRACTIONS.match(word)
+    if match:
+        return [match.group(1), match.group(2)]
+    return [word]
+
+
+def fast_tokenize(text):
+    """Returns the (unstemmed, lower case) tokens of text."""
+    if not isinstance(text, basestring):
+        # As NLTK's tokenizers do (which free_text relies on.)
+        raise TypeError('expected string or buffer')
+    chunks = text.split()
+    tokens = []
+    sentence_start = True
+    for i, chunk in enumerate(chunks):
+        if chunk.isalnum():
+            tokens.extend(_word_tokens(chunk.lower()))
+            sentence_start = False
+            continue
+        next_chunk = chunks[i + 1] if i + 1 < len(chunks) else None
+        sentence_end = _ends_sentence(chunk, next_chunk)
+        tokens.extend(_chunk_tokens(chunk, sentence_start, sentence_end))
+        sentence_start = (sentence_end or
+                          chunk.rstrip(_CLOSING).endswith(('?', '!')))
+    return tokens
+
+
+def fast_free_text(text):
+    """Like free_text, but tokenizes with fast_tokenize."""
+    profile = profiling.current()
+    try:
+        with profile.timer('tokenize'):
+            words = fast_tokenize(text)
+        with profile.timer('stem'):
+            return stem_all(words)
+    except TypeError:
+        print u'TypeError while processing text: {}\nNo tokens were returned' \
+              .format(text)
+        return []
@@ -1,8 +1,8 @@
+import lexicon
+import threading
 import xml.etree.ElementTree as ElementTree
 
 from itertools import izip
-from nltk.corpus import stopwords
-from nltk.corpus import wordnet
 
 
 def xml_file_to_dict(file_path):
@@ -22,6 +22,13 @@ def xml_file_to_dict(file_path):
     return dict_representation
 
 
+def xml_string_to_dict(xml):
+    """
+    Like xml_file_to_dict, given the contents of the file.
+    """
+    return root_node_to_dictionary(ElementTree.fromstring(xml))
+
+
 def root_node_to_dictionary(root):
     """Given the root node of an ElementTree, returns
     a dictionary where keys are the 'name' attributes
@@ -64,14 +71,36 @@ def dot_product(v1, v2):
     return sum(x * y for x, y in izip(v1, v2))
 
 
+__stopwords = None
+# NLTK's corpus loaders replace themselves on first use, and fail if used by
+# another thread meanwhile, so they are loaded under a lock.
+__stopwords_lock = threading.Lock()
+
+
+def english_stopwords():
+    """Returns the set of English stopwords: the lexicon's, if one is loaded
+    (see lexicon.py), or else NLTK's, loading it on first use."""
+    global __stopwords
+    current_lexicon = lexicon.current()
+    if current_lexicon is not None:
+        return current_lexicon.stopwords
+    if __stopwords is None:
+        with __stopwords_lock:
+            if __stopwords is None:
+                from nltk.corpus import stopwords
+                __stopwords = frozenset(stopwords.words('english'))
+    return __stopwords
+
+
 def without_stopwords(words):
     """Given a list of words, returns a list of words without stopwords."""
-    stop = stopwords.words('english')
+    stop = english_stopwords()
     return [word for word in words if word not in stop]
 
 
 def synonyms(word):
     """Given a word, returns a list of synonyms from WordNet."""
+    from nltk.corpus import wordnet
     synsets = wordnet.synsets(word)
     all_synonyms = [lemma.name for syn in synsets for lemma in syn.lemmas]
     unique_synonyms = set(all_synonyms)